@@ -0,0 +1,60 @@
+# Заполнение /16: старый выбор случайного адреса с повтором при коллизии vs AddressPool
+# python benchmarks/pool_fill.py
+import ipaddress
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from core.pool import AddressPool  # noqa: E402
+
+NETWORK = ipaddress.ip_network("10.48.0.0/16")
+
+
+def random_fill(first, last):
+    """HostDatabase._get_free_address до AddressPool (рекурсия заменена циклом, иначе RecursionError)"""
+    index = {}
+    attempts = 0
+    for _ in range(last - first + 1):
+        while True:
+            attempts += 1
+            ip = str(ipaddress.ip_address(random.randint(first, last)))
+            if not index.get(ip):
+                break
+        index[ip] = "mac"
+    return attempts
+
+
+def pool_fill(first, last):
+    pool = AddressPool(first, last)
+    for i in range(last - first + 1):
+        pool.allocate(f"{i:012x}")
+    return pool
+
+
+def main():
+    first, last = int(NETWORK.network_address) + 1, int(NETWORK.broadcast_address) - 1
+    size = last - first + 1
+    t = time.perf_counter()
+    pool = pool_fill(first, last)
+    t_pool = time.perf_counter() - t
+    print(f"AddressPool: {size:,} addresses in {t_pool:.2f}s ({t_pool / size * 1e6:.2f} us/allocate), "
+          f"{pool.stats()}")
+    t = time.perf_counter()
+    for i in range(0, size, 2):
+        pool.release(str(ipaddress.IPv4Address(first + i)), f"{i:012x}")
+    for i in range(0, size, 2):
+        pool.allocate(f"{i:012x}")
+    t_churn = time.perf_counter() - t
+    print(f"AddressPool: release + sticky re-allocate of {size // 2:,} addresses in {t_churn:.2f}s")
+    t = time.perf_counter()
+    attempts = random_fill(first, last)
+    t_random = time.perf_counter() - t
+    print(f"random + retry: {size:,} addresses in {t_random:.2f}s, {attempts:,} attempts "
+          f"(the last address took ~{size:,} on average)")
+
+
+if __name__ == '__main__':
+    main()
@@ -61,9 +61,12 @@ class DHCPServerConfiguration:
     router: str = field(default_factory=lambda: '10.47.0.1')
     domain: str = field(default_factory=lambda: 'localnet')
     lease_time: int = 300
+    offer_hold: int = 60  # Сколько держать предложенный адрес без DHCPREQUEST
+    decline_hold: int = 600  # Сколько не выдавать адрес после DHCPDECLINE
     domain_name_servers: set = field(default_factory=lambda: set('10.47.0.1'))
     dhcp_server_ip: ipaddress.IPv4Address = field(default_factory=lambda: None)
     data_file: str = 'hosts.json'
+    storage: str = 'sqlite'  # 'sqlite' (hosts.json -> hosts.db, старый JSON переносится) или 'json'
 
     @property
     def dhcp_range_len(self):
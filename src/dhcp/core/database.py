@@ -1,10 +1,14 @@
-import json
 import time
-from pathlib import Path
-from threading import Thread
+from enum import Enum
+from threading import RLock
+from typing import Callable
 
 from loguru import logger
 
+from .expiry import ExpiryQueue
+from .pool import AddressPool
+from .storage import open_storage
+
 
 class Host:
     def __init__(self, mac, ip, hostname, last_used):
@@ -36,24 +40,50 @@ class Host:
         return f"Host(name='{self.hostname}' identifier=({self.mac} @ {self.ip})"
 
 
+class LeaseState(Enum):
+    OFFERED = 1  # Адрес зарезервирован на offer_hold секунд, в хранилище не пишется
+    BOUND = 2
+    RENEWING = 3  # Прошло T1 (половина аренды), клиент должен продлевать
+    RELEASED = 4  # DHCPRELEASE: адрес сразу вернулся в пул
+    DECLINED = 5  # DHCPDECLINE: адрес занят в сети, не выдаётся decline_hold секунд
+
+
 class HostDatabase:
+    """
+    Аренды по RFC 2131: offer() резервирует адрес без записи в хранилище, bind() по DHCPREQUEST
+    закрепляет его (BOUND) или продлевает существующую аренду, release()/decline() освобождают.
+    Продления меняют срок в памяти и пишутся в хранилище одной пачкой в flush().
+    """
+
     def __init__(self, conf):
-        self.t = None
-        self.run = True
         self.conf = conf
-        self.file = Path(self.conf.data_file)
+        self.lock = RLock()
+        self.expiry = ExpiryQueue()
+        self.expire_callbacks: list[Callable[[Host], None]] = []  # Например, удаление записи из DNS
+        self.offers: dict[str, tuple[str, str]] = {}  # mac: (ip, hostname)
+        self.offer_expiry = ExpiryQueue()
+        self.declined = ExpiryQueue()  # ip: когда адрес можно выдавать снова
+        self.ended: dict[str, LeaseState] = {}  # mac: RELEASED / DECLINED - чем закончилась последняя аренда
+        self.renewed: set[str] = set()  # Продления, ещё не записанные в хранилище
+        self.storage = open_storage(self.conf.data_file, self.conf.storage)
         self.data = {'index': {'ip': {}}, 'devices': {}}
+        self.pool = AddressPool(*self.conf.dhcp_range, reserved=(self.conf.router, self.conf.dhcp_server_ip))
         self._read()
 
     def _read(self):
-        if not self.file.exists():
-            self._write()
-        with open(self.file, "r", encoding="utf-8") as f:
-            self.data = json.load(f)
+        for row in self.storage.load():
+            mac, ip = row[0], row[1]
+            if ip:
+                self.data['index']['ip'][ip] = mac
+                self.pool.take(ip)
+            self.data['devices'][mac] = tuple(row)
+            self._schedule(mac, int(row[3]))
 
-    def _write(self):
-        with open(self.file, "w", encoding="utf-8") as f:
-            json.dump(self.data, f, indent=4)
+    def _schedule(self, mac, last_used):
+        if last_used == 0:  # Без срока аренды
+            self.expiry.cancel(mac)
+        else:
+            self.expiry.schedule(mac, last_used + self.conf.lease_time)
 
     def get(self, ip=None, mac=None):
         if ip:
@@ -62,15 +92,132 @@ class HostDatabase:
             return Host.from_tuple(self.data['devices'][mac])
 
     def add(self, host: Host):
-        if host.ip:
-            self.data['index']['ip'][host.ip] = host.mac
-        self.data['devices'][host.mac] = host.to_tuple()
-        self._write()
+        with self.lock:
+            if host.ip:
+                self.data['index']['ip'][host.ip] = host.mac
+                self.pool.take(host.ip)
+            self.data['devices'][host.mac] = host.to_tuple()
+            self._schedule(host.mac, host.last_used)
+            self.storage.put(host.to_tuple())
 
     def delete(self, host: Host):
-        if host.ip:
-            del self.data['index']['ip'][host.ip]
-        del self.data['devices'][host.mac]
+        with self.lock:
+            if host.ip:
+                del self.data['index']['ip'][host.ip]
+                self.pool.release(host.ip, host.mac)
+            del self.data['devices'][host.mac]
+            self.expiry.cancel(host.mac)
+            self.storage.delete(host.mac)
+
+    def renew(self, mac, now=None) -> Host | None:
+        """Продление аренды: новый last_used и срок в очереди за O(log n)"""
+        with self.lock:
+            host = self.get(mac=mac.upper())
+            if host is None:
+                return None
+            if host.last_used != 0:
+                host.last_used = int(now or time.time())
+                self.data['devices'][host.mac] = host.to_tuple()
+                self._schedule(host.mac, host.last_used)
+                self.renewed.add(host.mac)
+            return host
+
+    def state(self, mac, now=None) -> LeaseState | None:
+        mac = mac.upper()
+        if mac in self.offers:
+            return LeaseState.OFFERED
+        row = self.data['devices'].get(mac)
+        if row is None:
+            return self.ended.get(mac)
+        last_used = int(row[3])
+        if last_used and (now or time.time()) - last_used >= self.conf.lease_time * 0.5:
+            return LeaseState.RENEWING
+        return LeaseState.BOUND
+
+    def offer(self, mac, requested_ip, hostname) -> str | int:
+        """DHCPDISCOVER: текущий адрес клиента, уже предложенный, запрошенный (если свободен) или новый из пула"""
+        mac = mac.upper()
+        with self.lock:
+            host = self.get(mac=mac)
+            if host:
+                if self.conf.in_range(host.ip):
+                    logger.info(f'Known device: {host}')
+                    return host.ip
+                self.delete(host)
+            if mac in self.offers:
+                ip = self.offers[mac][0]
+            elif requested_ip and self.pool.take(requested_ip):
+                ip = str(requested_ip)
+            else:
+                ip = self._get_free_address(mac)
+                if ip == 0:
+                    return 0
+            self.offers[mac] = (ip, hostname or 'UnknownName')
+            self.offer_expiry.schedule(mac, time.time() + self.conf.offer_hold)
+            self.ended.pop(mac, None)
+            logger.info(f'Offered: {ip}. MAC: {mac}')
+            return ip
+
+    def bind(self, mac, ip, hostname=None, now=None) -> Host | None:
+        """DHCPREQUEST: закрепляет предложенный адрес или продлевает аренду; None - отказ (DHCPNAK)"""
+        mac, ip = mac.upper(), str(ip)
+        with self.lock:
+            offer = self.offers.get(mac)
+            if offer is not None and offer[0] == ip:
+                del self.offers[mac]
+                self.offer_expiry.cancel(mac)
+                host = Host(mac, ip, hostname or offer[1], now or time.time())
+                self.add(host)
+                logger.success(f'Device registered: {host}')
+                return host
+            host = self.get(mac=mac)
+            if host is not None and host.ip == ip:
+                return self.renew(mac, now)
+            return None
+
+    def cancel_offer(self, mac):
+        """Клиент выбрал другой сервер: резерв снимается"""
+        with self.lock:
+            offer = self.offers.pop(mac.upper(), None)
+            self.offer_expiry.cancel(mac.upper())
+            if offer is not None:
+                self.pool.release(offer[0], mac.upper())
+
+    def release(self, mac, ip) -> bool:
+        mac, ip = mac.upper(), str(ip)
+        with self.lock:
+            host = self.get(mac=mac)
+            if host is None or host.ip != ip:
+                return False
+            self.delete(host)
+            self.renewed.discard(mac)
+            self.ended[mac] = LeaseState.RELEASED
+        logger.info(f'Released: {host}')
+        return True
+
+    def decline(self, mac, ip) -> bool:
+        """Адрес занят кем-то в сети: аренда снимается, адрес не выдаётся decline_hold секунд"""
+        mac, ip = mac.upper(), str(ip)
+        with self.lock:
+            host = self.get(mac=mac)
+            if host is not None and host.ip == ip:
+                self.delete(host)
+                self.renewed.discard(mac)
+            elif self.offers.get(mac, (None,))[0] == ip:
+                del self.offers[mac]
+                self.offer_expiry.cancel(mac)
+                self.pool.release(ip)
+            else:
+                return False
+            self.pool.forget(mac)
+            self.pool.take(ip)
+            self.declined.schedule(ip, time.time() + self.conf.decline_hold)
+            self.ended[mac] = LeaseState.DECLINED
+        logger.warning(f'Declined: {ip} by {mac}, address is held for {self.conf.decline_hold}s')
+        return True
+
+    def add_expire_callback(self, callback: Callable[[Host], None]):
+        self.expire_callbacks.append(callback)
 
     def all(self):
         return list(map(Host.from_tuple, self.data['devices'].values()))
@@ -79,54 +226,47 @@ class HostDatabase:
         self.delete(host)
         self.add(host)
 
-    def flush(self):
-        now = time.time()
-        for host in self.all():
-            if host.last_used == 0:
-                continue
-            if now - host.last_used > self.conf.lease_time:
-                self.delete(host)
-        self._write()
-
-    def _auto_deleter(self):
-        while self.run:
-            self.flush()
-            i_max = self.conf.lease_time/10
-            i = 0
-            while i < i_max:
-                time.sleep(1)
-                i += 1
-                if not self.run:
-                    return
-
-    def auto_deleter(self):
-        self.t = Thread(target=self._auto_deleter, daemon=True)
-        self.t.start()
-
-    def _get_free_address(self):
-        if len(self.data['index']['ip']) >= self.conf.dhcp_range_len:
+    def flush(self, now=None):
+        """
+        Удаляет только истёкшие аренды, снимает просроченные резервы (offer_hold, decline_hold)
+        и пишет накопленные продления одной пачкой. Полного прохода по хостам нет.
+        """
+        now = now or time.time()
+        expired = []
+        with self.lock:
+            for mac in self.expiry.pop_expired(now):
+                host = self.get(mac=mac)
+                if host is not None:
+                    self.delete(host)
+                    self.renewed.discard(mac)
+                    expired.append(host)
+            for mac in self.offer_expiry.pop_expired(now):
+                offer = self.offers.pop(mac, None)
+                if offer is not None:
+                    self.pool.release(offer[0], mac)
+            for ip in self.declined.pop_expired(now):
+                self.pool.release(ip)
+            renewed = [self.data['devices'][mac] for mac in self.renewed if mac in self.data['devices']]
+            self.renewed.clear()
+        if renewed:
+            self.storage.put_many(renewed)
+        for host in expired:
+            logger.info(f'Lease expired: {host}')
+            for callback in self.expire_callbacks:
+                try:
+                    callback(host)
+                except Exception as e:
+                    logger.exception(e)
+        self.storage.flush()
+
+    def close(self):
+        self.storage.close()
+
+    def _get_free_address(self, mac=None):
+        ip = self.pool.allocate(mac)
+        if ip is None:
             logger.error("[DHCP] Range is out")
             return 0
-        ip = self.conf.random_ip()
-        if self.data['index']['ip'].get(ip):
-            return self._get_free_address()
+        if self.pool.utilisation >= 0.9:
+            logger.warning(f"[DHCP] Pool utilisation: {self.pool.stats()}")
         return ip
-
-    def find_or_register(self, mac, requested_ip, hostname):
-        host = self.get(mac=mac)
-        if host:
-            if not self.conf.in_range(host.ip):
-                self.delete(host)
-                return self.find_or_register(mac, requested_ip, hostname)
-            logger.info(f'Known device: {host}')
-            return host.ip
-        if self.conf.in_range(requested_ip) and self.get(ip=requested_ip) is None:
-            ip = requested_ip
-            logger.info(f'New(?) device; IP: {ip}. MAC: {mac}')
-        else:
-            ip = self._get_free_address()
-            logger.info(f'New device. IP: {ip}. MAC: {mac}')
-        host = Host(mac, ip, hostname or 'UnknownName', time.time())
-        self.add(host)
-        logger.success(f'Device registered: {host}')
-        return host.ip
@@ -1,17 +1,20 @@
 # https://github.com/niccokunzmann/python_dhcp_server
 
-import collections
+import asyncio
+import ipaddress
 import socket
 import time
 from enum import Enum
 
-import select
 from dhcppython import options
 from dhcppython.packet import DHCPPacket
 from loguru import logger
 
 from .config import DHCPServerConfiguration
-from .database import HostDatabase
+from .database import HostDatabase, LeaseState
+from .expiry import ExpiryQueue
+
+ZERO = ipaddress.IPv4Address(0)
 
 
 # noinspection SpellCheckingInspection
@@ -57,20 +60,27 @@ class Transaction:
                     self.send_offer(packet)
                 case DHCPMessages.DHCPREQUEST:
                     self.send_ack(packet)
+                case DHCPMessages.DHCPRELEASE:
+                    self.server.hosts.release(packet.chaddr, packet.ciaddr)
+                    self.close()
+                case DHCPMessages.DHCPDECLINE:
+                    self.server.hosts.decline(packet.chaddr, self._option(packet, 50, 'requested_ip_address'))
+                    self.close()
+                case DHCPMessages.DHCPINFORM:
+                    self.send_inform_ack(packet)
                 case _:
                     logger.warning(f"Unhandled: {dhcp_message}")
 
+    @staticmethod
+    def _option(packet: DHCPPacket, code, key):
+        option = packet.options.by_code(code)
+        if option:
+            return option.value.get(key)
+
     def send_offer(self, packet: DHCPPacket):
-        mac = packet.chaddr
-        req_ip = packet.options.by_code(50)
-        if req_ip:
-            req_ip = req_ip.value.get('requested_ip_address')
-        else:
-            req_ip = packet.ciaddr
-        hostname = packet.options.by_code(12)
-        if hostname:
-            hostname = hostname.value.get("hostname")
-        ip = self.server.hosts.find_or_register(mac, req_ip, hostname)
+        req_ip = self._option(packet, 50, 'requested_ip_address') or packet.ciaddr
+        hostname = self._option(packet, 12, 'hostname')
+        ip = self.server.hosts.offer(packet.chaddr, req_ip, hostname)
         if ip == 0:
             return
         offer = DHCPPacket.Offer(
@@ -81,19 +91,29 @@ class Transaction:
             option_list=self.server.conf.options
         )
         offer.siaddr = self.server.conf.dhcp_server_ip
-        self.server.broadcast(offer)
+        self.server.send(offer, packet)
 
     def send_ack(self, packet: DHCPPacket):
-        host = self.server.hosts.get(mac=packet.chaddr)
+        hosts = self.server.hosts
+        server_id = self._option(packet, 54, 'dhcp_server')
+        if server_id and server_id != str(self.server.conf.dhcp_server_ip):
+            # SELECTING: клиент выбрал другой сервер
+            hosts.cancel_offer(packet.chaddr)
+            return self.close()
+        # SELECTING / INIT-REBOOT - адрес в опции 50, RENEWING / REBINDING - в ciaddr
+        req_ip = self._option(packet, 50, 'requested_ip_address') or str(packet.ciaddr)
+        state = hosts.state(packet.chaddr)
+        host = hosts.bind(packet.chaddr, req_ip, self._option(packet, 12, 'hostname'))
         if host is None:
-            logger.error(f"Fail DORA: No host found; MAC: {packet.chaddr}")
-            return self.send_nak(packet)
-        req_ip = packet.options.by_code(50)
-        if req_ip:
-            req_ip = req_ip.value.get('requested_ip_address')
-            if host.ip != req_ip:
-                logger.error(f"Fail DORA: IP mismatched {host.ip=} != {req_ip=}; MAC: {packet.chaddr}")
+            known = state in (LeaseState.OFFERED, LeaseState.BOUND, LeaseState.RENEWING)
+            if known or not self.configuration.in_range(req_ip):
+                logger.error(f"Fail DORA: {state=}, requested {req_ip}; MAC: {packet.chaddr}")
                 return self.send_nak(packet)
+            # RFC 2131 4.3.2: о клиенте нет записи - сервер молчит
+            logger.info(f"No lease for {req_ip}, ignoring REQUEST; MAC: {packet.chaddr}")
+            return self.close()
+        if state in (LeaseState.BOUND, LeaseState.RENEWING):
+            logger.info(f"Renewed: {host}")
         ack = DHCPPacket.Ack(
             packet.chaddr,
             int(time.time() - self.start),
@@ -101,8 +121,19 @@ class Transaction:
             host.ip,
             option_list=self.server.conf.options
         )
+        ack.ciaddr = packet.ciaddr
+        ack.siaddr = self.server.conf.dhcp_server_ip
+        self.server.send(ack, packet)
+        self.close()
+
+    def send_inform_ack(self, packet: DHCPPacket):
+        # Адрес у клиента уже есть: только параметры сети, без срока аренды (RFC 2131 3.4)
+        option_list = options.OptionList([o for o in self.server.conf.options if o.code not in (51, 58, 59)])
+        ack = DHCPPacket.Ack(packet.chaddr, int(time.time() - self.start), packet.xid, 0, option_list=option_list)
+        ack.ciaddr = packet.ciaddr
         ack.siaddr = self.server.conf.dhcp_server_ip
-        self.server.broadcast(ack)
+        self.server.send(ack, packet)
+        self.close()
 
     def send_nak(self, packet: DHCPPacket):
         nack = DHCPPacket.Ack(
@@ -112,78 +143,144 @@ class Transaction:
             packet.yiaddr
         )
         nack.siaddr = self.server.conf.dhcp_server_ip
-        nack.options = options.OptionList([options.options.short_value_to_object(53, "DHCPNAK")])
-        self.server.broadcast(nack)
+        nack.options = options.OptionList([
+            options.options.short_value_to_object(53, "DHCPNAK"),
+            options.options.short_value_to_object(54, self.server.conf.dhcp_server_ip),
+        ])
+        self.server.send(nack, packet)
+        self.close()
+
+class _DHCPProtocol(asyncio.DatagramProtocol):
+
+    def __init__(self, server: "DHCPServer"):
+        self.server = server
+
+    def datagram_received(self, data, addr):
+        try:
+            self.server.handle(data)
+        except Exception as e:
+            logger.exception(e)
+
+    def error_received(self, exc):
+        logger.error(f"[DHCP] Socket error: {exc}")
+
 
 class DHCPServer:
+    """
+    DHCP сервер на asyncio: сокет на 0.0.0.0:67 принимает широковещательные запросы, один заранее привязанный
+    к dhcp_server_ip:67 сокет отправляет все ответы и принимает unicast-запросы (продления): ядро отдаёт их
+    сокету с более точным адресом. Транзакции истекают через ExpiryQueue, раз в секунду вместе с арендами.
+    """
 
     def __init__(self, configuration: DHCPServerConfiguration = None):
         self.conf = configuration or DHCPServerConfiguration()
         self.socket = socket.socket(type=socket.SOCK_DGRAM)
+        self.reply_socket = socket.socket(type=socket.SOCK_DGRAM)
         self.closed = False
-        self.transactions = collections.defaultdict(lambda: Transaction(self))  # id: transaction
+        self.transactions: dict[int, Transaction] = {}  # id: transaction
+        self.timers = ExpiryQueue()  # id: timeout транзакции
         self.hosts = HostDatabase(self.conf)
         self.time_started = time.time()
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self.transport = None
+        self.reply_transport = None
 
     def __str__(self):
         return f"DHCPServer(configuration={self.conf})"
 
-    def broadcast(self, packet: DHCPPacket) -> None:
+    @staticmethod
+    def destination(reply: DHCPPacket, request: DHCPPacket) -> tuple[str, int] | None:
+        """
+        Куда отправить ответ (RFC 2131 4.1): relay (giaddr), ciaddr клиента, иначе широковещательно (None).
+        Unicast на yiaddr клиенту без адреса требует записи в ARP-кэше, поэтому в этом случае тоже broadcast
+        """
+        if request.giaddr != ZERO:
+            return str(request.giaddr), 67
+        if request.ciaddr != ZERO and reply.msg_type != "DHCPNAK":
+            return str(request.ciaddr), 68
+        return None
+
+    def send(self, reply: DHCPPacket, request: DHCPPacket) -> None:
+        destination = self.destination(reply, request)
+        reply.flags = request.flags  # RFC 2131, таблица 3: flags из запроса клиента
         logger.info(
-            f"{'broadcasting:':<14}{packet.options.by_code(53).value['dhcp_message_type']:<12}; "
-            f"'srv -> cli'; MAC: {packet.chaddr}"
+            f"{'broadcasting:' if destination is None else 'sending:':<14}{reply.msg_type:<12}; "
+            f"'srv -> cli'; MAC: {reply.chaddr}"
         )
-        with socket.socket(type=socket.SOCK_DGRAM) as broadcast_socket:
-            broadcast_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            broadcast_socket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-            try:
-                data = packet.asbytes
-                broadcast_socket.bind((str(self.conf.dhcp_server_ip), 67))
-                broadcast_socket.sendto(data, ('255.255.255.255', 68))
-                broadcast_socket.sendto(data, (str(self.conf.network.broadcast_address), 68))
-            except Exception as e:
-                logger.exception(e)
-                logger.error(f"Failed to broadcast from {self.conf.dhcp_server_ip}: {e}")
-
-    def _worker(self, timeout=0):
         try:
-            reads = select.select([self.socket], [], [], timeout)[0]
-        except ValueError:  # -1
-            return
-        for sock in reads:
-            try:
-                packet = DHCPPacket.from_bytes(sock.recvfrom(4096)[0])
-            except OSError:  # An operation was attempted on something that is not a socket
-                pass
+            data = reply.asbytes
+            if destination is None:
+                self.reply_transport.sendto(data, ('255.255.255.255', 68))
+                self.reply_transport.sendto(data, (str(self.conf.network.broadcast_address), 68))
             else:
-                logger.info(f"{'received:':<14}{packet.options.by_code(53).value['dhcp_message_type']:<12}; "
-                            f"{'cli -> srv' if packet.op == 'BOOTREQUEST' else 'srv -> cli'}; MAC: {packet.chaddr}")
-                self.transactions[packet.xid].receive(packet)
-        for transaction_id, transaction in list(self.transactions.items()):
-            if transaction.is_done():
+                self.reply_transport.sendto(data, destination)
+        except OSError as e:
+            logger.error(f"Failed to send from {self.conf.dhcp_server_ip}: {e}")
+
+    def handle(self, data: bytes):
+        packet = DHCPPacket.from_bytes(data)
+        logger.info(f"{'received:':<14}{packet.msg_type:<12}; "
+                    f"{'cli -> srv' if packet.op == 'BOOTREQUEST' else 'srv -> cli'}; MAC: {packet.chaddr}")
+        transaction = self.transactions.get(packet.xid)
+        if transaction is None or transaction.closed:
+            # Закрытая транзакция (ответ уже отправлен) на повтор запроса заводится заново
+            transaction = self.transactions[packet.xid] = Transaction(self)
+            self.timers.schedule(packet.xid, transaction.timeout)
+        transaction.receive(packet)
+
+    def _tick(self):
+        now = time.time()
+        for transaction_id in self.timers.pop_expired(now):
+            transaction = self.transactions.pop(transaction_id, None)
+            if transaction:
                 transaction.close()
-                self.transactions.pop(transaction_id)
+        try:
+            self.hosts.flush(now)
+        except Exception as e:
+            logger.exception(e)
+        if not self.closed:
+            self.loop.call_later(1, self._tick)
 
-    def start(self):
-        logger.success("Started")
+    async def _serve(self):
         self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.socket.bind(("0.0.0.0", 67))
-        while not self.closed:
-            try:
-                self._worker(1)
-            except KeyboardInterrupt:
-                self.stop()
-            except Exception as e:
-                logger.exception(e)
+        self.reply_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.reply_socket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        self.reply_socket.bind((str(self.conf.dhcp_server_ip), 67))
+        self.transport, _ = await self.loop.create_datagram_endpoint(lambda: _DHCPProtocol(self), sock=self.socket)
+        self.reply_transport, _ = await self.loop.create_datagram_endpoint(lambda: _DHCPProtocol(self),
+                                                                           sock=self.reply_socket)
+        self.loop.call_soon(self._tick)
+
+    def start(self):
+        self.loop = asyncio.new_event_loop()
+        try:
+            self.loop.run_until_complete(self._serve())
+            logger.success("Started")
+            self.loop.run_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.closed = True
+            self._close()
 
     def stop(self, *_, **__):
         self.closed = True
-        self.hosts.run = False
-        time.sleep(1)
+        if self.loop and self.loop.is_running():
+            self.loop.call_soon_threadsafe(self.loop.stop)  # Остальное сделает start()
+        elif self.loop is None:
+            self._close()
+
+    def _close(self):
+        for transport in (self.transport, self.reply_transport):
+            if transport:
+                transport.close()
         self.socket.close()
+        self.reply_socket.close()
+        if self.loop:
+            self.loop.close()
         self.hosts.flush()
-        if self.hosts.t:
-            self.hosts.t.join()
+        self.hosts.close()
         for transaction in list(self.transactions.values()):
             transaction.close()
         logger.success("Closed")
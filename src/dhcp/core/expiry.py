@@ -0,0 +1,48 @@
+import heapq
+import time
+
+
+class ExpiryQueue:
+    """
+    Сроки аренд: min-куча (expires, mac) с ленивым удалением.
+    Актуальный срок MAC хранится в deadlines; продление и отмена не ищут элемент в куче,
+    а устаревшие элементы пропускаются при извлечении. pop_expired() трогает только истёкшие аренды.
+    """
+
+    def __init__(self):
+        self.heap: list[tuple[float, str]] = []
+        self.deadlines: dict[str, float] = {}
+
+    def __len__(self):
+        return len(self.deadlines)
+
+    def __contains__(self, mac):
+        return mac in self.deadlines
+
+    def schedule(self, mac: str, expires: float):
+        """Новая аренда или продление, O(log n)"""
+        self.deadlines[mac] = expires
+        heapq.heappush(self.heap, (expires, mac))
+        if len(self.heap) > 2 * len(self.deadlines) + 1024:
+            self.heap = [(expires, mac) for mac, expires in self.deadlines.items()]
+            heapq.heapify(self.heap)
+
+    def cancel(self, mac: str):
+        self.deadlines.pop(mac, None)
+
+    def next_expiry(self) -> float | None:
+        heap = self.heap
+        while heap and self.deadlines.get(heap[0][1]) != heap[0][0]:
+            heapq.heappop(heap)
+        return heap[0][0] if heap else None
+
+    def pop_expired(self, now: float | None = None) -> list[str]:
+        now = now or time.time()
+        heap, deadlines = self.heap, self.deadlines
+        expired = []
+        while heap and heap[0][0] <= now:
+            expires, mac = heapq.heappop(heap)
+            if deadlines.get(mac) == expires:
+                del deadlines[mac]
+                expired.append(mac)
+        return expired
@@ -0,0 +1,108 @@
+import ipaddress
+from collections import deque
+
+
+class AddressPool:
+    """
+    Свободные адреса диапазона DHCP: bytearray занятости (байт на адрес) и очередь свободных адресов.
+    allocate() и release() - O(1): занятые вне очереди адреса (take() конкретного IP) выбрасываются
+    из неё лениво, при следующем allocate().
+    Sticky: освобождённый адрес запоминается за MAC и при следующем allocate(mac) выдаётся снова, если свободен.
+    Освобождённые адреса встают в начало очереди, поэтому другому MAC прежний адрес достаётся,
+    только когда никогда не выданные и давно освобождённые адреса кончились.
+    """
+
+    def __init__(self, first: int, last: int, reserved=()):
+        self.first = first
+        self.last = last
+        self.size = last - first + 1
+        self.used = bytearray(self.size)
+        self.count = 0
+        self.free = deque(range(last, first - 1, -1))  # pop() отдаёт адреса по возрастанию
+        self.sticky: dict[str, int] = {}
+        self.sticky_owner: dict[int, str] = {}  # Обратный индекс sticky: не больше записи на адрес
+        for ip in reserved:
+            if ip is not None:
+                self.take(ip)
+        self.reserved = self.count
+
+    def _index(self, ip) -> int | None:
+        value = int(ipaddress.IPv4Address(ip)) - self.first
+        return value if 0 <= value < self.size else None
+
+    def __contains__(self, ip):
+        return self._index(ip) is not None
+
+    def is_free(self, ip) -> bool:
+        index = self._index(ip)
+        return index is not None and not self.used[index]
+
+    def take(self, ip) -> bool:
+        """Занимает конкретный адрес; False - вне диапазона или уже занят"""
+        index = self._index(ip)
+        if index is None or self.used[index]:
+            return False
+        self.used[index] = 1
+        self.count += 1
+        self._unstick(self.first + index)
+        return True
+
+    def _unstick(self, value: int):
+        mac = self.sticky_owner.pop(value, None)
+        if mac is not None:
+            del self.sticky[mac]
+
+    def forget(self, mac: str):
+        """Не выдавать MAC его прежний адрес"""
+        value = self.sticky.pop(mac, None)
+        if value is not None:
+            del self.sticky_owner[value]
+
+    def allocate(self, mac: str | None = None) -> str | None:
+        """Свободный адрес (прежний адрес MAC, если он свободен); None - диапазон исчерпан"""
+        if mac is not None:
+            previous = self.sticky.get(mac)
+            if previous is not None and not self.used[previous - self.first]:
+                self.used[previous - self.first] = 1
+                self.count += 1
+                self._unstick(previous)
+                return str(ipaddress.IPv4Address(previous))
+        free, used, first = self.free, self.used, self.first
+        while free:
+            value = free.pop()
+            if not used[value - first]:
+                used[value - first] = 1
+                self.count += 1
+                self._unstick(value)
+                return str(ipaddress.IPv4Address(value))
+        return None
+
+    def release(self, ip, mac: str | None = None):
+        index = self._index(ip)
+        if index is None or not self.used[index]:
+            return
+        self.used[index] = 0
+        self.count -= 1
+        value = self.first + index
+        self.free.appendleft(value)
+        if len(self.free) > 2 * self.size:
+            # Адреса, занятые через take() и sticky, остаются в очереди дублями; порядок освобождения сохраняется
+            seen = set()
+            compact = deque()
+            for free in self.free:
+                if free not in seen and not self.used[free - self.first]:
+                    seen.add(free)
+                    compact.append(free)
+            self.free = compact
+        if mac is not None:
+            self.forget(mac)
+            self.sticky[mac] = value
+            self.sticky_owner[value] = mac
+
+    @property
+    def utilisation(self) -> float:
+        return (self.count - self.reserved) / max(self.size - self.reserved, 1)
+
+    def stats(self):
+        return {"size": self.size - self.reserved, "used": self.count - self.reserved,
+                "free": self.size - self.count, "utilisation": round(self.utilisation, 4)}
@@ -0,0 +1,146 @@
+import json
+import os
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from pathlib import Path
+
+from loguru import logger
+
+
+class LeaseStorage(ABC):
+    """
+    Хранилище аренд для HostDatabase. Запись - (mac, ip, hostname, last_used), как Host.to_tuple().
+    put()/delete() вызываются на каждое событие аренды и должны стоить O(1);
+    flush() - периодическая запись для хранилищ, которые не пишут сразу.
+    """
+
+    @abstractmethod
+    def load(self) -> list[tuple]:
+        """Все сохранённые аренды"""
+
+    @abstractmethod
+    def put(self, row: tuple):
+        """Добавляет или заменяет аренду по MAC"""
+
+    def put_many(self, rows: list[tuple]):
+        for row in rows:
+            self.put(row)
+
+    @abstractmethod
+    def delete(self, mac: str):
+        """Удаляет аренду по MAC"""
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class SQLiteStorage(LeaseStorage):
+    """
+    SQLite в режиме WAL: каждое событие - одна короткая транзакция (INSERT OR REPLACE / DELETE по MAC).
+    При падении процесса база не повреждается; с synchronous=NORMAL при потере питания могут
+    потеряться только последние транзакции (клиент подтвердит адрес повторным REQUEST).
+    """
+
+    def __init__(self, path, synchronous="NORMAL"):
+        self.path = Path(path)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(f"PRAGMA synchronous={synchronous}")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS hosts (mac TEXT PRIMARY KEY, ip TEXT, hostname TEXT, last_used INTEGER)"
+        )
+
+    def load(self):
+        with self.lock:
+            rows = self.db.execute("SELECT mac, ip, hostname, last_used FROM hosts").fetchall()
+        return [(mac, ip, hostname, str(last_used)) for mac, ip, hostname, last_used in rows]
+
+    def put(self, row):
+        mac, ip, hostname, last_used = row
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO hosts VALUES (?, ?, ?, ?)", (mac, ip, hostname, int(last_used)))
+
+    def put_many(self, rows):
+        with self.lock:
+            self.db.execute("BEGIN")
+            self.db.executemany("INSERT OR REPLACE INTO hosts VALUES (?, ?, ?, ?)",
+                                [(mac, ip, hostname, int(last_used)) for mac, ip, hostname, last_used in rows])
+            self.db.execute("COMMIT")
+
+    def delete(self, mac):
+        with self.lock:
+            self.db.execute("DELETE FROM hosts WHERE mac = ?", (mac,))
+
+    def close(self):
+        with self.lock:
+            self.db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self.db.close()
+
+
+class JSONStorage(LeaseStorage):
+    """
+    Старый формат dhcp-hosts.json ({'index': {'ip': {}}, 'devices': {}}).
+    Изменения копятся в памяти, файл пишется целиком в flush(): временный файл, fsync и rename.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.devices: dict[str, tuple] = {}
+        self.dirty = False
+        if self.path.exists():
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.devices = {mac: tuple(row) for mac, row in json.load(f)['devices'].items()}
+
+    def load(self):
+        return list(self.devices.values())
+
+    def put(self, row):
+        self.devices[row[0]] = row
+        self.dirty = True
+
+    def delete(self, mac):
+        self.dirty |= self.devices.pop(mac, None) is not None
+
+    def flush(self):
+        if not self.dirty:
+            return
+        self.dirty = False
+        devices = dict(self.devices)
+        data = {'index': {'ip': {row[1]: mac for mac, row in devices.items() if row[1]}}, 'devices': devices}
+        tmp = self.path.with_suffix(self.path.suffix + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+    def close(self):
+        self.flush()
+
+
+def open_storage(data_file, kind="sqlite") -> LeaseStorage:
+    """
+    kind="sqlite": база рядом с data_file (hosts.json -> hosts.db). Если есть только старый JSON,
+    аренды переносятся в базу один раз, а JSON переименовывается в *.migrated.
+    kind="json" - старый формат.
+    """
+    data_file = Path(data_file)
+    if kind == "json":
+        return JSONStorage(data_file)
+    if kind != "sqlite":
+        raise ValueError(f"Unknown storage: {kind!r}")
+    if data_file.suffix == ".json":
+        db_file = data_file.with_suffix(".db")
+        storage = SQLiteStorage(db_file)
+        if data_file.exists():
+            rows = JSONStorage(data_file).load()
+            storage.put_many(rows)
+            os.replace(data_file, data_file.with_suffix(".json.migrated"))
+            logger.success(f"[DHCP] Migrated {len(rows)} hosts from '{data_file}' to '{db_file}'")
+        return storage
+    return SQLiteStorage(data_file)
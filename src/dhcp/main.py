@@ -66,7 +66,8 @@ def init_program():
         "domain": "localnet",
         "lease_time": 300,
         "domain_name_servers": ["10.47.0.1"],
-        "data_file": "data.json"
+        "data_file": "data.json",
+        "storage": "sqlite"
     }
     config_file = "config.json"
     if platform.system() == "Linux":
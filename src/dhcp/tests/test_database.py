@@ -0,0 +1,96 @@
+import pytest
+
+from core.config import DHCPServerConfiguration
+from core.database import HostDatabase, LeaseState
+
+MAC = "AA:BB:CC:DD:EE:01"
+OTHER = "AA:BB:CC:DD:EE:02"
+
+
+@pytest.fixture
+def conf(tmp_path):
+    return DHCPServerConfiguration(data_file=str(tmp_path / "hosts.json"))
+
+
+@pytest.fixture
+def db(conf):
+    database = HostDatabase(conf)
+    yield database
+    database.close()
+
+
+def test_offer_bind_renew(db, conf):
+    ip = db.offer(MAC, None, "laptop")
+    assert ip == "10.47.0.2"  # 10.47.0.1 - router
+    assert db.state(MAC) is LeaseState.OFFERED
+    host = db.bind(MAC, ip, now=1000)
+    assert host.ip == ip and host.hostname == "laptop"
+    assert db.state(MAC, now=1000) is LeaseState.BOUND
+    assert db.state(MAC, now=1000 + conf.lease_time // 2) is LeaseState.RENEWING
+    assert db.bind(MAC, ip, now=1200).last_used == 1200
+    assert db.state(MAC, now=1200) is LeaseState.BOUND
+
+
+def test_bind_wrong_address_is_refused(db):
+    ip = db.offer(MAC, None, None)
+    assert db.bind(MAC, "10.47.0.100") is None
+    assert db.bind(OTHER, ip) is None
+
+
+def test_offer_is_held_and_expires(db, conf):
+    ip = db.offer(MAC, None, None)
+    assert db.offer(MAC, None, None) == ip
+    assert db.offer(OTHER, None, None) != ip
+    db.flush(now=db.offer_expiry.next_expiry() + 1)
+    assert db.state(MAC) is None
+    assert db.pool.is_free(ip)
+
+
+def test_release_returns_address_to_same_client(db):
+    ip = db.offer(MAC, None, None)
+    db.bind(MAC, ip)
+    assert not db.release(MAC, "10.47.0.200")
+    assert db.release(MAC, ip)
+    assert db.state(MAC) is LeaseState.RELEASED
+    assert db.get(mac=MAC) is None
+    assert db.offer(OTHER, None, None) != ip
+    assert db.offer(MAC, None, None) == ip
+
+
+def test_decline_holds_address(db, conf):
+    ip = db.offer(MAC, None, None)
+    db.bind(MAC, ip, now=1000)
+    assert db.decline(MAC, ip)
+    assert db.state(MAC) is LeaseState.DECLINED
+    assert not db.pool.is_free(ip)
+    assert MAC not in db.pool.sticky
+    assert db.offer(MAC, None, None) != ip
+    db.flush(now=db.declined.next_expiry() + 1)
+    assert db.pool.is_free(ip)
+
+
+def test_lease_expiry_calls_callbacks(db, conf):
+    expired = []
+    db.add_expire_callback(expired.append)
+    ip = db.offer(MAC, None, None)
+    db.bind(MAC, ip, now=1000)
+    db.flush(now=1000 + conf.lease_time - 1)
+    assert expired == []
+    db.flush(now=1000 + conf.lease_time)
+    assert [host.mac for host in expired] == [MAC]
+    assert db.get(mac=MAC) is None
+    assert db.pool.is_free(ip)
+
+
+def test_leases_survive_restart(conf):
+    db = HostDatabase(conf)
+    ip = db.offer(MAC, None, "laptop")
+    db.bind(MAC, ip, now=1000)
+    db.bind(MAC, ip, now=1100)  # Продление пишется в хранилище только в flush()
+    db.flush(now=1100)
+    db.close()
+    db = HostDatabase(conf)
+    host = db.get(mac=MAC)
+    assert (host.ip, host.hostname, host.last_used) == (ip, "laptop", 1100)
+    assert not db.pool.is_free(ip)
+    db.close()
@@ -0,0 +1,38 @@
+from core.expiry import ExpiryQueue
+
+
+def test_pop_expired_in_deadline_order():
+    queue = ExpiryQueue()
+    queue.schedule("b", 20)
+    queue.schedule("a", 10)
+    queue.schedule("c", 30)
+    assert queue.next_expiry() == 10
+    assert queue.pop_expired(25) == ["a", "b"]
+    assert len(queue) == 1 and "c" in queue
+
+
+def test_reschedule_replaces_deadline():
+    queue = ExpiryQueue()
+    queue.schedule("a", 10)
+    queue.schedule("a", 50)
+    assert queue.pop_expired(20) == []
+    assert queue.next_expiry() == 50
+    assert queue.pop_expired(50) == ["a"]
+
+
+def test_cancel():
+    queue = ExpiryQueue()
+    queue.schedule("a", 10)
+    queue.cancel("a")
+    queue.cancel("missing")
+    assert queue.next_expiry() is None
+    assert queue.pop_expired(100) == []
+    assert len(queue) == 0
+
+
+def test_stale_heap_entries_are_compacted():
+    queue = ExpiryQueue()
+    for i in range(5000):
+        queue.schedule("a", i)
+    assert len(queue.heap) <= 2 * len(queue) + 1024
+    assert queue.pop_expired(4999) == ["a"]
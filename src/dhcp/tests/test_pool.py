@@ -0,0 +1,70 @@
+import ipaddress
+
+from core.pool import AddressPool
+
+FIRST = int(ipaddress.IPv4Address("10.0.0.2"))
+
+
+def _pool(size, reserved=()):
+    return AddressPool(FIRST, FIRST + size - 1, reserved)
+
+
+def test_allocates_in_order_and_skips_reserved():
+    pool = _pool(4, reserved=("10.0.0.3",))
+    assert [pool.allocate() for _ in range(4)] == ["10.0.0.2", "10.0.0.4", "10.0.0.5", None]
+    assert pool.stats() == {"size": 3, "used": 3, "free": 0, "utilisation": 1.0}
+
+
+def test_take_is_skipped_by_allocate():
+    pool = _pool(3)
+    assert pool.take("10.0.0.2")
+    assert not pool.take("10.0.0.2")
+    assert not pool.take("10.1.0.2")
+    assert pool.allocate() == "10.0.0.3"
+
+
+def test_sticky_address_returns_to_same_mac():
+    pool = _pool(254)
+    a = pool.allocate("A")
+    pool.allocate("B")
+    pool.release(a, "A")
+    assert pool.allocate("C") == "10.0.0.4"  # Прежний адрес A не отдаётся, пока есть свободные
+    assert pool.allocate("A") == a
+
+
+def test_freed_addresses_are_reused_oldest_first():
+    pool = _pool(3)
+    a, b, c = (pool.allocate(mac) for mac in "ABC")
+    pool.release(b, "B")
+    pool.release(a, "A")
+    assert pool.allocate("D") == b
+    assert pool.allocate("E") == a
+    assert pool.allocate("F") is None
+
+
+def test_sticky_entry_dropped_when_address_given_away():
+    pool = _pool(1)
+    a = pool.allocate("A")
+    pool.release(a, "A")
+    assert pool.allocate("B") == a
+    assert pool.sticky == {} and pool.sticky_owner == {}
+    pool.release(a, "B")
+    assert pool.allocate("A") == a  # Адрес снова свободен, но за A уже не закреплён
+    assert pool.sticky == {}
+
+
+def test_sticky_is_bounded_by_pool_size():
+    pool = _pool(8)
+    for i in range(1000):
+        pool.release(pool.allocate(str(i)), str(i))
+    assert len(pool.sticky) <= 8
+    assert len(pool.free) <= 2 * pool.size
+
+
+def test_forget():
+    pool = _pool(4)
+    a = pool.allocate("A")
+    pool.release(a, "A")
+    pool.forget("A")
+    pool.forget("unknown")
+    assert pool.sticky == {} and pool.sticky_owner == {}
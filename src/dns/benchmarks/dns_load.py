@@ -0,0 +1,78 @@
+# Нагрузочный тест: запросов в секунду на 1..N процессах-воркерах (SO_REUSEPORT), ответы из локальной зоны
+# python benchmarks/dns_load.py [воркеров...]   (по умолчанию 1, 2, 4 ... os.cpu_count())
+import multiprocessing
+import os
+import socket
+import struct
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from dnslib import DNSRecord  # noqa: E402
+from loguru import logger  # noqa: E402
+
+from sevrer import DNSServer, WorkerPool, Zone, Record, SOA  # noqa: E402
+
+PORT = 15353
+NAMES = 1000
+DURATION = 5.0
+WINDOW = 32  # Запросов "в полёте" на одного клиента
+
+
+def make_server(index):
+    zone = Zone("load", SOA("ns.load", "admin@load"))
+    zone.add_records(*(Record(f"h{i}.load", "A", f"10.0.{i >> 8}.{i & 255}") for i in range(NAMES)))
+    return DNSServer(zone, port=PORT, tcp=False, engine="asyncio", reuse_port=True, serve_stale=0)
+
+
+def client(seconds, result):
+    queries = [DNSRecord.question(f"h{i}.load").pack() for i in range(NAMES)]
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.settimeout(0.5)
+    count = 0
+    sent = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        while sent - count < WINDOW:
+            query = bytearray(queries[sent % NAMES])
+            struct.pack_into("!H", query, 0, sent & 0xFFFF)
+            sock.sendto(query, ("127.0.0.1", PORT))
+            sent += 1
+        try:
+            sock.recv(512)
+            count += 1
+        except socket.timeout:
+            sent = count  # Потерянные запросы не ждём
+    result.put(count)
+
+
+def run(workers, clients):
+    pool = WorkerPool(make_server, workers)
+    pool.start()
+    time.sleep(1 + workers * 0.2)
+    result = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=client, args=(DURATION, result)) for _ in range(clients)]
+    for process in processes:
+        process.start()
+    total = sum(result.get() for _ in processes)
+    for process in processes:
+        process.join()
+    pool.stop()
+    return total / DURATION
+
+
+def main():
+    logger.remove()
+    cpus = os.cpu_count() or 1
+    counts = [int(a) for a in sys.argv[1:]] or sorted({1, 2, 4, cpus} & set(range(1, cpus + 1)))
+    base = None
+    for workers in counts:
+        qps = run(workers, clients=max(2, workers * 2))
+        base = base or qps / workers
+        print(f"{workers:>3} workers: {qps:>9,.0f} q/s ({qps / base / workers:.0%} of linear)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+# Сравнение поиска подменяемых доменов: старый перебор подстрокой vs SuffixMap
+# python benchmarks/spoof_match.py
+import random
+import string
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from sevrer.suffix import SuffixMap  # noqa: E402
+
+
+def random_domain(rnd):
+    label = "".join(rnd.choices(string.ascii_lowercase, k=rnd.randint(4, 12)))
+    return f"{label}.{rnd.choice(('com', 'net', 'org', 'ru', 'io'))}"
+
+
+def scan(spoof_list, domain_name):
+    for domain in spoof_list:
+        if domain in domain_name:
+            return domain
+
+
+def bench(fn, names, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for name in names:
+            fn(name)
+    return (time.perf_counter() - start) / (repeat * len(names))
+
+
+def main():
+    rnd = random.Random(0)
+    for size in (10_000, 100_000, 1_000_000):
+        domains = [random_domain(rnd) for _ in range(size)]
+        index = SuffixMap(domains)
+        hits = [f"www.cdn.{rnd.choice(domains)}." for _ in range(50)]
+        misses = [f"www.{random_domain(rnd)}." for _ in range(50)]
+        names = hits + misses
+        scan_repeat = max(1, 100_000 // size)
+        t_scan = bench(lambda n: scan(domains, n), names, scan_repeat)
+        t_index = bench(index.match, names, 1000)
+        print(f"{size:>9,} domains: scan {t_scan * 1e6:>12.1f} us/lookup | "
+              f"SuffixMap {t_index * 1e6:>6.2f} us/lookup | x{t_scan / t_index:,.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+# Время старта с большой зоной: Zone/Record из кода vs загрузка мастер-файла через sevrer.loader
+# python benchmarks/zone_load.py
+import gc
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from loguru import logger  # noqa: E402
+
+from sevrer import Zone, Record, SOA  # noqa: E402
+from sevrer.loader import load_zones  # noqa: E402
+
+
+def address(i):
+    return f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}"
+
+
+def write_zone(path, size):
+    with open(path, "w") as f:
+        f.write("$ORIGIN big.\n$TTL 3600\n@ IN SOA ns.big. admin.big. ( 1 7200 3600 86400 300 )\n@ NS ns.big.\n")
+        for i in range(size):
+            if i % 10 == 9:
+                f.write(f"c{i} CNAME h{i - 1}.big.\n")
+            else:
+                f.write(f"h{i} IN A {address(i)}\n")
+
+
+def from_code(size):
+    zone = Zone("big", SOA("ns.big", "admin@big"))
+    zone.add_records(*(Record(f"h{i}.big", "A", address(i)) for i in range(size)))
+    return zone
+
+
+def main():
+    logger.remove()
+    code_size = 10_000
+    t = time.perf_counter()
+    from_code(code_size)
+    t_code = (time.perf_counter() - t) / code_size
+    # Загрузка создаёт сотни тысяч мелких объектов без циклов; при старте сервера их замораживает gc.freeze()
+    gc.disable()
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in (10_000, 100_000, 1_000_000):
+            path = os.path.join(tmp, "big.zone")
+            write_zone(path, size)
+            t = time.perf_counter()
+            zones = load_zones(path, auto_ptr=False)
+            t_load = time.perf_counter() - t
+            t = time.perf_counter()
+            zones = load_zones(path)
+            t_ptr = time.perf_counter() - t
+            print(f"{size:>9,} records: Record {t_code * size:>7.2f}s (est.) | load_zones {t_load:>5.2f}s | "
+                  f"+ auto PTR {t_ptr:>5.2f}s ({len(zones)} zones)")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,12 @@
 # https://github.com/mansuf/requests-doh
+import asyncio
 import socket
+import time
 from typing import Literal
 
 import httpx
+from dns.asyncbackend import get_backend
+from dns.asyncquery import https as async_query_https
 from dns.message import make_query
 from dns.query import https as query_https
 from dns.rcode import Rcode
@@ -10,7 +14,7 @@ from dns.rdatatype import RdataType
 from loguru import logger
 
 from .exceptions import (
-    DNSQueryFailed,
+    DNSQueryFailed, DNSUpstreamUnavailable,
     DoHProviderNotExist,
     NoDoHProvider, InvalidDoHProvider
 )
@@ -79,46 +83,207 @@ class DNSOverHTTPS:
         except Exception as e:
             raise InvalidDoHProvider(f"Failed to add DoH provider '{name}'") from e
 
-    def resolve_raw(self, domain_name: str, rdatatype: RdataType) -> tuple[tuple[str, int], ...] | None:
+    @property
+    def url(self):
+        return f"https://{self._provider[0]}{self._provider[1]}"
+
+    @staticmethod
+    def _parse_response(res_message, domain_name: str, rdatatype: RdataType) -> tuple[tuple[str, int], ...]:
+        """
+        Пустой кортеж - отрицательный ответ (NXDOMAIN или нет записей нужного типа).
+        Остальные rcode (SERVFAIL, REFUSED...) - DNSQueryFailed.
+        """
+        rcode = Rcode(res_message.rcode())
+        if rcode == Rcode.NXDOMAIN:
+            return ()
+        if rcode != Rcode.NOERROR:
+            raise DNSQueryFailed(f"Failed to query DNS {rdatatype.name} from host '{domain_name}' (rcode={rcode.name})")
+
+        chain = res_message.resolve_chaining()
+        answers = chain.answer
+        if answers is None:
+            return ()
+        return tuple((str(i), chain.minimum_ttl) for i in answers)
+
+    def resolve_raw(self, domain_name: str, rdatatype: RdataType) -> tuple[tuple[str, int], ...]:
+        """Ответ провайдера (пустой - отрицательный); DNSUpstreamUnavailable - ни один IP не ответил"""
         req_message = make_query(domain_name, rdatatype)
         for ip in self._provider[2]:
             try:
                 res_message = query_https(
-                    req_message, f"https://{self._provider[0]}{self.provider[1]}",
+                    req_message, self.url,
                     path=self.provider[1], source=ip,
                     session=self._session
                 )
-                rcode = Rcode(res_message.rcode())
-                if rcode != Rcode.NOERROR:
-                    raise DNSQueryFailed(f"Failed to query DNS {rdatatype.name} from host '{domain_name}' (rcode={rcode.name})")
-
-                chain = res_message.resolve_chaining()
-                answers = chain.answer
-                if answers is None:
-                    return None
-                return tuple((str(i), chain.minimum_ttl) for i in answers)
             except Exception as e:
-                if e == DNSQueryFailed:
-                    continue
                 logger.exception(e)
                 continue
-
+            # Ответ с rcode окончательный, другие IP о том же не спрашиваем
+            return self._parse_response(res_message, domain_name, rdatatype)
+        raise DNSUpstreamUnavailable(f"No response from {self._provider[0]} for {rdatatype.name} '{domain_name}'")
 
     def resolve(self, domain_name: str, ipv6=False):
         answers = set()
 
         # Query A type (IPv4)
-        A_ANSWERS = self.resolve_raw(domain_name, RdataType.A)
-        if A_ANSWERS is not None:
-            answers.update(A_ANSWERS)
+        answers.update(self.resolve_raw(domain_name, RdataType.A))
 
         if ipv6:
             # Query AAAA type (IPv6)
-            AAAA_ANSWERS = self.resolve_raw(domain_name, RdataType.AAAA)
-            if AAAA_ANSWERS is not None:
-                answers.update(AAAA_ANSWERS)
+            answers.update(self.resolve_raw(domain_name, RdataType.AAAA))
 
         if not answers:
             raise DNSQueryFailed(f"DNS server {self._provider} returned empty results from host '{domain_name}'")
 
         return tuple(i[0] for i in answers)
+
+
+class AsyncDNSOverHTTPS(DNSOverHTTPS):
+    """
+    Асинхронный DoH клиент: на каждый IP провайдера держится свой httpx.AsyncClient (HTTP/2),
+    поэтому соединения остаются тёплыми, а запросы мультиплексируются без head-of-line блокировки.
+    Синхронный resolve_raw() по-прежнему доступен (используется при инициализации и thread-движком).
+
+    В режиме race запрос уходит на самый быстрый IP, каждые `stagger` секунд без ответа
+    стартует следующий (happy eyeballs), побеждает первый полученный ответ. Следующий IP запускается
+    только по таймеру или при сетевой ошибке: ответ с rcode окончательный.
+    `race_providers` добавляет в гонку IP других провайдеров. Порядок задаётся по RTT (EWMA).
+    """
+
+    def __init__(self, provider: AvailableProviders, max_connections=4, max_keepalive_connections=4,
+                 keepalive_expiry=60.0, timeout=5.0, race=True, stagger=0.05,
+                 race_providers: tuple[AvailableProviders, ...] = ()):
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        self.timeout = timeout
+        self.race = race
+        self.stagger = stagger
+        self.rtt: dict[str, float] = {}  # ip: EWMA RTT, секунды
+        self.on_query = None  # on_query(ip, seconds, ok) после каждого завершённого запроса, например для метрик
+        self._clients: dict[tuple[str, str], httpx.AsyncClient] = {}
+        super().__init__(provider)
+        self.race_providers = []
+        for name in race_providers:
+            if name not in self.available_providers:
+                raise DoHProviderNotExist(f"Provider '{name}' does not exist.")
+            if self.available_providers[name] is self._provider:
+                continue
+            self._update_provider_ips(name)
+            self.race_providers.append(self.available_providers[name])
+
+    def __str__(self):
+        return (f"AsyncDNSOverHTTPS(provider={self._provider[0]!r}, IPs={self.provider[2]}, limits={self.limits}, "
+                f"race={self.race}, race_providers={[p[0] for p in self.race_providers]})")
+
+    def _client(self, provider: tuple, ip: str) -> httpx.AsyncClient:
+        client = self._clients.get((provider[0], ip))
+        if client is None:
+            # Транспорт dnspython подключается сразу к ip (bootstrap_address), SNI и Host остаются от провайдера
+            transport = get_backend("asyncio").get_transport_class()(
+                http1=True, http2=True, limits=self.limits, bootstrap_address=ip
+            )
+            client = httpx.AsyncClient(http1=True, http2=True, transport=transport, timeout=self.timeout)
+            self._clients[(provider[0], ip)] = client
+        return client
+
+    def _targets(self) -> list[tuple[tuple, str]]:
+        """(provider, ip) по возрастанию RTT; ещё не опрошенные IP идут первыми, чтобы получить оценку"""
+        targets = [(p, ip) for p in (self._provider, *self.race_providers) for ip in p[2]]
+        return sorted(targets, key=lambda t: self.rtt.get(t[1], 0.0))
+
+    def _update_rtt(self, ip: str, rtt: float, alpha=0.3):
+        prev = self.rtt.get(ip)
+        self.rtt[ip] = rtt if prev is None else prev + alpha * (rtt - prev)
+
+    async def _query(self, target: tuple[tuple, str], req_message, domain_name: str, rdatatype: RdataType):
+        provider, ip = target
+        start = time.monotonic()
+        try:
+            res_message = await async_query_https(
+                req_message, f"https://{provider[0]}{provider[1]}", path=provider[1],
+                client=self._client(provider, ip), timeout=self.timeout
+            )
+        except asyncio.CancelledError:
+            # Проиграл гонку: RTT не меньше прошедшего времени
+            elapsed = time.monotonic() - start
+            if elapsed > self.rtt.get(ip, 0.0):
+                self._update_rtt(ip, elapsed)
+            raise
+        except Exception:
+            elapsed = time.monotonic() - start
+            self._update_rtt(ip, max(elapsed, self.timeout))
+            if self.on_query:
+                self.on_query(ip, elapsed, False)
+            raise
+        elapsed = time.monotonic() - start
+        self._update_rtt(ip, elapsed)
+        if self.on_query:
+            self.on_query(ip, elapsed, True)
+        return self._parse_response(res_message, domain_name, rdatatype)
+
+    async def _resolve_sequential(self, req_message, domain_name: str, rdatatype: RdataType):
+        for target in self._targets():
+            try:
+                return await self._query(target, req_message, domain_name, rdatatype)
+            except DNSQueryFailed:
+                raise
+            except Exception as e:
+                logger.exception(e)
+                continue
+        raise DNSUpstreamUnavailable(f"No response from DoH providers for {rdatatype.name} '{domain_name}'")
+
+    async def _resolve_race(self, req_message, domain_name: str, rdatatype: RdataType):
+        targets = iter(self._targets())
+        pending = set()
+
+        def launch():
+            target = next(targets, None)
+            if target is not None:
+                pending.add(asyncio.create_task(self._query(target, req_message, domain_name, rdatatype)))
+
+        launch()
+        try:
+            while pending:
+                done, _ = await asyncio.wait(pending, timeout=self.stagger, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    pending.discard(task)
+                    e = task.exception()
+                    if e is None or isinstance(e, DNSQueryFailed):
+                        # Ответ провайдера, в том числе с rcode (SERVFAIL, REFUSED), окончательный
+                        return task.result()
+                    logger.warning("DoH query for {!r} failed: {!r}", domain_name, e)
+                launch()  # Истёк stagger или сетевая ошибка — стартуем следующую
+            raise DNSUpstreamUnavailable(f"No response from DoH providers for {rdatatype.name} '{domain_name}'")
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def resolve_raw_async(self, domain_name: str, rdatatype: RdataType) -> tuple[tuple[str, int], ...]:
+        req_message = make_query(domain_name, rdatatype)
+        if self.race:
+            return await self._resolve_race(req_message, domain_name, rdatatype)
+        return await self._resolve_sequential(req_message, domain_name, rdatatype)
+
+    async def warmup(self):
+        """Открывает (или поддерживает) соединение с каждым IP провайдеров"""
+        targets = self._targets()
+        results = await asyncio.gather(
+            *(self._query(t, make_query(t[0][0], RdataType.A), t[0][0], RdataType.A) for t in targets),
+            return_exceptions=True
+        )
+        for (_, ip), result in zip(targets, results):
+            if isinstance(result, Exception):
+                logger.warning(f"DoH warmup failed for {ip}: {result!r}")
+
+    async def keep_warm(self):
+        while True:
+            await self.warmup()
+            await asyncio.sleep(max(self.limits.keepalive_expiry / 2, 1))
+
+    async def aclose(self):
+        clients, self._clients = self._clients, {}
+        for client in clients.values():
+            await client.aclose()
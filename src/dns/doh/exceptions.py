@@ -5,6 +5,10 @@ class DNSQueryFailed(RequestsDOHException):
     """Failed to query DNS from given host"""
     pass
 
+class DNSUpstreamUnavailable(DNSQueryFailed):
+    """None of DoH provider IPs returned a response (network error or timeout)"""
+    pass
+
 class NoDoHProvider(RequestsDOHException):
     """There is no active DoH provider"""
     pass
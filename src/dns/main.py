@@ -1,19 +1,19 @@
+import gc
 import glob
-import json
 import os
 import platform
 import subprocess
 import sys
 import time
 import zipfile
-from collections import defaultdict
 from datetime import datetime
 from pathlib import Path
 
 from loguru import logger
 
-from doh import DNSOverHTTPS
-from sevrer import DNSServer, Zone, Record, SOA, PTRZone
+from doh import AsyncDNSOverHTTPS
+from routes import RouteInstaller, NftSetSink, HostMap, RouteLifecycle
+from sevrer import DNSServer, FileWatcher, ZoneLoader, Registry, MetricsServer, QueryLog, SharedCache, WorkerPool
 
 logger.remove()
 system = platform.system()
@@ -36,51 +36,41 @@ if system == "Linux":
                 if os.path.exists(file):
                     zipf.write(file, os.path.basename(file))
                     os.remove(file)
-    logger.add(sys.stdout, level=0, backtrace=False, diagnose=False, enqueue=True, colorize=False, format="| {level: <8} | {message}")
-    logger.add(log_file, rotation="10 MB", retention="1 day")
+    # Запросы пишет журнал запросов (QueryLog), а не loguru: сообщения резолвера на каждый запрос - TRACE
+    logger.add(sys.stdout, level="DEBUG", backtrace=False, diagnose=False, enqueue=True, colorize=False, format="| {level: <8} | {message}")
+    logger.add(log_file, level="DEBUG", rotation="10 MB", retention="1 day")
     # Configurations
     os.makedirs("/etc/bns/dns_spoof", exist_ok=True)
+    os.makedirs("/etc/bns/zones", exist_ok=True)
+    os.makedirs("/var/lib/bns", exist_ok=True)
 else:
     logger.add(sys.stdout, level="INFO", backtrace=False, diagnose=False, enqueue=True,
                format="\r<green>{time:YYYY-MM-DD HH:mm:ss.SSS}</green> | <level>{level: <8}</level> | {message}")
 
 
-doh = DNSOverHTTPS("cloudflare")
-
-# Home zone
-home = Zone("home", SOA("ns.home", "santaspeen@yandex.ru"))
-records = (
-    Record("@", "NS", "ns.home."),
-    Record("ns.home", "A", "10.47.0.1"),
-    Record("lilrt.home", "A", "10.47.0.1"),
-    Record("lilrt.home", "A", "10.41.0.2"),
-    Record("torrent.home", "CNAME", "lilrt.home."),
-    Record("nginx.home", "CNAME", "lilrt.home."),
-    Record("lako.home", "A", "192.168.0.10"),
-    Record("lako.home", "A", "192.168.0.11"),
-    Record("nginx.lako.home", "CNAME", "lako.home."),
-    Record("torrent.lako.home", "CNAME", "lako.home."),
-)
-home.add_records(*records)
-
-home_ptr_47 = PTRZone("10.47.0")
-home_ptr_47.add("1", "ns.home.")
-home_ptr_47.add("1", "lilrt.home.")
-home_ptr_41 = PTRZone("10.41.0")
-home_ptr_41.add("2", "lilrt.home.")
-home_ptr_168 = PTRZone("192.168.0")
-home_ptr_168.add("10", "lako.home.")
-home_ptr_168.add("11", "lako.home.")
-
-dns_server = DNSServer(
-    home, home_ptr_47, home_ptr_41, home_ptr_168,
-     doh_provider=doh
-)
+cache_snapshot = "dns-cache.bin"
+query_log_file = None  # None - в loguru
+if system == "Linux":
+    cache_snapshot = "/var/lib/bns/dns-cache.bin"
+    query_log_file = "/var/log/bns/dns-queries.jsonl"
+
+zones_dir = "-etc-bns-zones"
+if system == "Linux":
+    zones_dir = "/etc/bns/zones"
+
+# >1 - несколько процессов на порту 53 (SO_REUSEPORT, только Linux), общий кэш в Redis, маршруты ставит родитель
+dns_workers = 1
+redis_url = "unix:///run/redis/redis.sock"
+
+metrics = Registry()
+metrics_server = MetricsServer(metrics, "127.0.0.1", 9153)
+
+_spoof_files = {}  # path -> (mtime_ns, size, domains); неизменённые файлы при перезагрузке не перечитываются
 
 
 def read_domains_from_files(directory):
     logger.info("Reading domains for spoofing from files")
-    domains = set()
+    files = {}
     for filename in os.listdir(directory):
         file_path = os.path.join(directory, filename)
         if not os.path.isfile(file_path):
@@ -88,15 +78,23 @@ def read_domains_from_files(directory):
         if not filename.endswith('.spoof'):
             logger.warning(f"Skipping '{filename}'")
             continue
+        stat = os.stat(file_path)
+        cached = _spoof_files.get(file_path)
+        if cached and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+            files[file_path] = cached
+            continue
         with open(file_path, 'r', encoding='utf-8') as f:
             file_domains = f.readlines()
-        i = 0
+        domains = set()
         for domain in file_domains:
             if domain in ['.', ''] or len(domain) < 3:
                 continue
-            i+=1
             domains.add(domain.strip())
-        logger.success(f"Read {i} domains from '{filename}'")
+        files[file_path] = (stat.st_mtime_ns, stat.st_size, domains)
+        logger.success(f"Read {len(domains)} domains from '{filename}'")
+    _spoof_files.clear()
+    _spoof_files.update(files)
+    domains = set().union(*(file_domains for *_, file_domains in files.values()))
     logger.success(f"Read {len(domains)} domains in total.")
     return domains
 
@@ -104,37 +102,102 @@ def read_domains_from_files(directory):
 spoof_dir = "-etc-bns-dns_spoof"
 if system == "Linux":
     spoof_dir = "/etc/bns/dns_spoof"
-dns_server.add_spoof(*read_domains_from_files(spoof_dir))
 
-_added = set()
-_hosts = defaultdict(lambda: [])
+
+def _reload_spoof(server):
+    t = time.time()
+    server.set_spoof(read_domains_from_files(spoof_dir))
+    logger.success(f"Spoof lists reloaded in {(time.time() - t) * 1000:.1f}ms")
+
+
+def _reload_zones(server, zones):
+    # Перечитываются только изменённые файлы; если хоть один не разобрался (например, записан
+    # наполовину), остаются прежние зоны до следующего изменения
+    t = time.time()
+    try:
+        updated, removed = zones.reload()
+    except ValueError as e:
+        logger.error(f"[zones] Reload aborted, previous zones kept: {e}")
+        return
+    server.update_zones(updated, removed)
+    logger.success(f"Zones reloaded in {(time.time() - t) * 1000:.1f}ms")
+
+
+_watchers = []
+
+
+def make_dns_server(index=None):
+    """index=None - единственный процесс; иначе воркер WorkerPool (вызывается в дочернем процессе)"""
+    suffix = "" if index is None else f".{index}"
+    registry = metrics if index is None else Registry()
+    # "slow" - только медленные (slow_ms) и неудачные запросы, "sampled" - выборка, "all" - все
+    query_log = QueryLog(query_log_file and f"{query_log_file}{suffix}", mode="slow", slow_ms=200)
+    zones = ZoneLoader(zones_dir)
+    server = DNSServer(
+        *zones.load(),
+        doh_provider=AsyncDNSOverHTTPS("cloudflare", race_providers=("quad9",)), engine="asyncio",
+        snapshot_path=f"{cache_snapshot}{suffix}", metrics=registry, query_log=query_log,
+        shared_cache=SharedCache(redis_url) if index is not None else None, reuse_port=index is not None
+    )
+    server.add_spoof(*read_domains_from_files(spoof_dir))
+    # Зоны и списки загружены: их объекты больше не просматриваются сборщиком мусора
+    gc.freeze()
+    _watchers.append(FileWatcher([spoof_dir], lambda changed: _reload_spoof(server)).start())
+    _watchers.append(FileWatcher([zones_dir], lambda changed: _reload_zones(server, zones)).start())
+    if index is not None:
+        MetricsServer(registry, "127.0.0.1", 9154 + index).start()  # 9153 - родительский процесс
+    return server
+
+
+if dns_workers > 1:
+    dns_server = WorkerPool(make_dns_server, dns_workers)
+    # fork до потоков маршрутов, lifecycle и метрик ниже; loguru с enqueue=True к fork готов сам:
+    # сообщения воркеров уходят через его очередь в поток записи родителя
+    dns_server.fork()
+    metrics.add_stats("bns_dns_workers", dns_server.stats, ("restarts", "received"))
+else:
+    dns_server = make_dns_server()
+
+_hosts = HostMap("data.json")
 interface = "wg0stg5"
+spoof_backend = "routes"  # "routes" - маршрут на каждый IP, "nft" - nftables set + fwmark
 
 # restart interface (reset routes)
 if system == "Linux":
     subprocess.run(f"ip link set {interface} down", shell=True, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
     subprocess.run(f"ip link set {interface} up", shell=True, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
 
-def _callback(ip, domain):
-    if ip in _added:
-        return
-    _added.add(ip)
-    if system == "Linux":
-        route_cmd = f"ip route add {ip} dev {interface}"
-        subprocess.run(route_cmd, shell=True, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        logger.success(f"Added route for {ip};({domain}) via {interface}")
-    _hosts[domain].append(ip)
+if spoof_backend == "nft":
+    routes = NftSetSink(interface, dry_run=system != "Linux")
+    if not routes.setup():
+        # Без set и правила fwmark подмена не работает: маршрут на каждый IP
+        logger.error("[nft] Setup failed, falling back to per-IP routes")
+        routes.stop()
+        spoof_backend = "routes"
+if spoof_backend == "routes":
+    routes = RouteInstaller(interface, dry_run=system != "Linux")
+# Адрес живёт TTL + grace после последнего ответа DNS, потом маршрут снимается
+lifecycle = RouteLifecycle(routes, _hosts, grace=3600)
+lifecycle.restore()
+
+route_latency = metrics.histogram("bns_route_install_seconds", "Spoof event to kernel update latency").child()
+routes.latency_observer = route_latency.observe
+metrics.add_stats("bns_routes", routes.stats, ("batches", "errors"))
+metrics.add_stats("bns_spoof_lifecycle", lifecycle.stats, ("removed",))
 
 def _tick_callback():
-    with open("data.json", "w") as f:
-        json.dump(_hosts, f, indent=4)
+    lifecycle.expire()
+    if spoof_backend == "nft":
+        routes.expire()
+    _hosts.flush()
 
-dns_server.add_spoof_callback(_callback)
+dns_server.add_spoof_sink(lifecycle)
 dns_server.add_tick_callback(_tick_callback)
 
 if __name__ == '__main__':
     try:
         dns_server.start()
+        metrics_server.start()
         while dns_server.is_alive():
             time.sleep(1)
     except KeyboardInterrupt:
@@ -142,4 +205,9 @@ if __name__ == '__main__':
     except Exception as e:
         logger.exception(e)
     finally:
+        metrics_server.stop()
+        for watcher in _watchers:
+            watcher.stop()
         dns_server.stop()
+        routes.stop()
+        _hosts.compact()
@@ -0,0 +1,4 @@
+from .installer import RouteInstaller
+from .nft import NftSetSink
+from .hosts import HostMap
+from .lifecycle import RouteLifecycle
@@ -0,0 +1,81 @@
+import queue
+import threading
+import time
+from abc import ABC, abstractmethod
+
+from loguru import logger
+
+
+class BatchWorker(ABC):
+    """
+    Фоновый поток, который собирает элементы очереди в пачки (до batch_size или flush_interval)
+    и применяет их одним вызовом _apply(). Элемент - кортеж, последнее поле - время постановки в очередь.
+    """
+
+    def __init__(self, name: str, batch_size=256, flush_interval=0.2):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue: queue.Queue = queue.Queue()
+        self.batches = 0
+        self.errors = 0
+        self.last_latency = 0.0
+        self.max_latency = 0.0
+        self.latency_observer = None  # latency_observer(seconds) для каждой пачки, например гистограмма метрик
+        self.run = True
+        self.thread = threading.Thread(target=self._worker, name=name, daemon=True)
+        self.thread.start()
+
+    def put(self, *item):
+        self.queue.put((*item, time.monotonic()))
+
+    def _collect(self):
+        try:
+            batch = [self.queue.get(timeout=1)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    @abstractmethod
+    def _apply(self, batch) -> bool:
+        """Применяет пачку; False - пачка не применена"""
+
+    def _applied(self, batch, ok: bool, latency: float):
+        pass
+
+    def _worker(self):
+        while self.run or not self.queue.empty():
+            batch = self._collect()
+            if not batch:
+                continue
+            try:
+                ok = self._apply(batch)
+            except Exception as e:
+                logger.exception(e)
+                ok = False
+            latency = time.monotonic() - min(item[-1] for item in batch)
+            self.batches += 1
+            self.errors += not ok
+            self.last_latency = latency
+            self.max_latency = max(self.max_latency, latency)
+            if self.latency_observer:
+                self.latency_observer(latency)
+            self._applied(batch, ok, latency)
+
+    def stop(self):
+        self.run = False
+        self.thread.join()
+
+    def stats(self):
+        return {
+            "queue": self.queue.qsize(), "batches": self.batches, "errors": self.errors,
+            "last_latency": self.last_latency, "max_latency": self.max_latency,
+        }
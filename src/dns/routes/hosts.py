@@ -0,0 +1,131 @@
+import json
+import os
+import threading
+import time
+
+from loguru import logger
+
+_SEPARATORS = (",", ":")
+
+
+class HostMap:
+    """
+    Карта подменённых адресов domain -> [ip, ...] с инкрементальным сохранением.
+    Новые пары дописываются в журнал (`<path>.journal`, JSON строка на событие) только при изменениях;
+    когда журнал разрастается, он сворачивается в снимок `<path>` (tmp + fsync + rename) и обнуляется.
+    Формат снимка совместим со старым data.json.
+    """
+
+    def __init__(self, path: str, compact_every=10_000):
+        self.path = path
+        self.journal_path = f"{path}.journal"
+        self.compact_every = compact_every
+        self.hosts: dict[str, list[str]] = {}
+        self.pending: list[list[str]] = []
+        self.journal_lines = 0
+        self.lock = threading.Lock()
+        self.io_lock = threading.Lock()
+        self.load()
+
+    def __len__(self):
+        return len(self.hosts)
+
+    def __contains__(self, domain):
+        return domain in self.hosts
+
+    def get(self, domain) -> list[str]:
+        with self.lock:
+            return list(self.hosts.get(domain, ()))
+
+    def _apply(self, op, domain, ip) -> bool:
+        ips = self.hosts.get(domain)
+        if op == "+":
+            if ips is None:
+                self.hosts[domain] = [ip]
+            elif ip in ips:
+                return False
+            else:
+                ips.append(ip)
+            return True
+        if ips is None or ip not in ips:
+            return False
+        ips.remove(ip)
+        if not ips:
+            del self.hosts[domain]
+        return True
+
+    def add(self, domain: str, ip: str) -> bool:
+        with self.lock:
+            changed = self._apply("+", domain, ip)
+            if changed:
+                self.pending.append(["+", domain, ip])
+        return changed
+
+    def remove(self, domain: str, ip: str) -> bool:
+        with self.lock:
+            changed = self._apply("-", domain, ip)
+            if changed:
+                self.pending.append(["-", domain, ip])
+        return changed
+
+    def load(self):
+        t = time.time()
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    self.hosts = {domain: list(ips) for domain, ips in json.load(f).items()}
+            except Exception as e:
+                logger.error(f"[hosts] Failed to load '{self.path}': {e!r}")
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, "r+b") as f:
+                offset = 0
+                for line in f:
+                    try:
+                        self._apply(*json.loads(line))
+                    except Exception:
+                        # Недописанная строка после падения: обрезаем, чтобы новые записи не легли за ней
+                        logger.warning(f"[hosts] Truncated journal '{self.journal_path}' at line {self.journal_lines + 1}")
+                        f.truncate(offset)
+                        break
+                    offset += len(line)
+                    self.journal_lines += 1
+        logger.info(f"[hosts] Loaded {len(self.hosts)} domains ({self.journal_lines} journal entries) "
+                    f"in {(time.time() - t) * 1000:.1f}ms")
+
+    def flush(self):
+        """Дописывает новые события в журнал; ничего не пишет, если изменений не было"""
+        with self.io_lock:
+            with self.lock:
+                pending, self.pending = self.pending, []
+            if pending:
+                data = "".join(json.dumps(event, separators=_SEPARATORS) + "\n" for event in pending)
+                with open(self.journal_path, "a", encoding="utf-8") as f:
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+                self.journal_lines += len(pending)
+            if self.journal_lines >= self.compact_every:
+                self._compact()
+
+    def compact(self):
+        """Сворачивает журнал и несохранённые события в снимок"""
+        with self.io_lock:
+            with self.lock:
+                self.pending.clear()
+            self._compact()
+
+    def _compact(self):
+        t = time.time()
+        with self.lock:
+            hosts = {domain: list(ips) for domain, ips in self.hosts.items()}
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(hosts, f, separators=_SEPARATORS)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        # Снимок уже содержит всё из журнала; повторное применение журнала идемпотентно,
+        # так что падение между rename и truncate безопасно
+        open(self.journal_path, "w").close()
+        self.journal_lines = 0
+        logger.info(f"[hosts] Compacted {len(hosts)} domains into '{self.path}' in {(time.time() - t) * 1000:.1f}ms")
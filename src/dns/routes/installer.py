@@ -0,0 +1,112 @@
+import ipaddress
+import re
+import subprocess
+import threading
+
+from loguru import logger
+
+from .batch import BatchWorker
+
+_FAILED_LINE = re.compile(r"^Command failed -:(\d+)$", re.M)  # ip -force -batch: номер строки с ошибкой
+
+
+class RouteInstaller(BatchWorker):
+    """
+    Установка маршрутов вне пути обработки DNS запроса.
+    add() только ставит адрес в очередь; фоновый поток собирает пачку и применяет её
+    одним вызовом `ip -force -batch -`. prefix_len < 32 заменяет адрес покрывающей сетью
+    (например /24), повторные адреса из уже установленной сети не ставятся; сеть снимается,
+    когда remove() вызван для всех её адресов.
+    """
+
+    def __init__(self, interface: str, prefix_len=32, batch_size=256, flush_interval=0.2, dry_run=False,
+                 netns: str | None = None):
+        self.interface = interface
+        self.prefix_len = prefix_len
+        self.dry_run = dry_run
+        self.netns = netns
+        self.installed: set[ipaddress.IPv4Network] = set()
+        self.pending: set[ipaddress.IPv4Network] = set()
+        self.members: dict[ipaddress.IPv4Network, set[str]] = {}
+        self.failed: set[ipaddress.IPv4Network] = set()  # replace из последней пачки, которые не применились
+        self.lock = threading.Lock()
+        super().__init__("route-installer", batch_size, flush_interval)
+
+    def network(self, ip: str) -> ipaddress.IPv4Network:
+        return ipaddress.ip_network(f"{ip}/{self.prefix_len}", strict=False)
+
+    def add(self, ip: str, domain: str | None = None, ttl: int | None = None):
+        try:
+            net = self.network(ip)
+        except ValueError:
+            logger.warning(f"[routes] Bad address {ip!r} ({domain})")
+            return
+        with self.lock:
+            self.members.setdefault(net, set()).add(ip)
+            if net in self.installed or net in self.pending:
+                return
+            self.pending.add(net)
+        self.put("replace", net)
+
+    def remove(self, ip: str):
+        try:
+            net = self.network(ip)
+        except ValueError:
+            return
+        with self.lock:
+            members = self.members.get(net)
+            if members is None:
+                return
+            members.discard(ip)
+            if members:
+                return
+            del self.members[net]
+            if net in self.pending:
+                # replace ещё в очереди - отменяем его, del пойдёт следом
+                self.pending.discard(net)
+            elif net not in self.installed:
+                return
+            self.installed.discard(net)
+        self.put("del", net)
+
+    def _apply(self, batch):
+        """
+        -force продолжает пачку после ошибки и возвращает не 0, если упала хоть одна команда, поэтому
+        неудачные команды определяются по строкам "Command failed -:N". del уже снятого маршрута
+        (после перезапуска интерфейса или чужого flush) не ошибка; пачка не применена, только если упал replace.
+        """
+        self.failed = {net for op, net, _ in batch if op == "replace"}
+        commands = "".join(f"route {op} {net} dev {self.interface}\n" for op, net, _ in batch)
+        if self.dry_run:
+            self.failed = set()
+            return True
+        cmd = ["ip", "-force", "-batch", "-"]
+        if self.netns:
+            cmd = ["ip", "netns", "exec", self.netns, *cmd]
+        result = subprocess.run(cmd, input=commands, text=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if result.returncode == 0:
+            self.failed = set()
+            return True
+        lines = {int(line) for line in _FAILED_LINE.findall(result.stderr)}
+        if not lines:  # ip не запустился или упал целиком
+            logger.error(f"[routes] ip -batch failed: {result.stderr.strip()}")
+            return False
+        failed = [batch[line - 1] for line in lines if 0 < line <= len(batch)]
+        self.failed = {net for op, net, _ in failed if op == "replace"}
+        if self.failed:
+            logger.error(f"[routes] ip -batch: {len(self.failed)} route(s) not installed: {result.stderr.strip()}")
+        else:
+            logger.debug(f"[routes] ip -batch: {len(failed)} route(s) already removed")
+        return not self.failed
+
+    def _applied(self, batch, ok, latency):
+        with self.lock:
+            for op, net, _ in batch:
+                if op == "replace" and net in self.pending:
+                    self.pending.discard(net)
+                    if net not in self.failed:
+                        self.installed.add(net)
+        logger.success(f"[routes] Applied {len(batch)} route(s) via {self.interface} in {latency * 1000:.1f}ms")
+
+    def stats(self):
+        return {**super().stats(), "installed": len(self.installed)}
@@ -0,0 +1,96 @@
+import heapq
+import threading
+import time
+
+from loguru import logger
+
+from .hosts import HostMap
+
+
+class RouteLifecycle:
+    """
+    Жизненный цикл подменённых адресов. Для каждой пары (ip, domain) хранится срок
+    last_seen + max(ttl, min_ttl) + grace; каждое spoof событие продлевает его.
+    expire() снимает просроченные пары; когда у адреса не осталось доменов, он удаляется
+    из backend (RouteInstaller / NftSetSink) и из HostMap. Сроки лежат в ленивой min-куче,
+    поэтому expire() трогает только то, что действительно истекло.
+    Подключается как spoof sink: add(ip, domain, ttl).
+    """
+
+    def __init__(self, backend, hosts: HostMap | None = None, min_ttl=60, grace=3600):
+        self.backend = backend
+        self.hosts = hosts
+        self.min_ttl = min_ttl
+        self.grace = grace
+        self.deadlines: dict[tuple[str, str], float] = {}
+        self.domains: dict[str, set[str]] = {}
+        self.heap: list[tuple[float, str, str]] = []
+        self.lock = threading.Lock()
+        self.removed = 0
+
+    def __len__(self):
+        return len(self.domains)
+
+    def _track(self, ip, domain, deadline):
+        key = (ip, domain)
+        current = self.deadlines.get(key)
+        if current is None:
+            self.domains.setdefault(ip, set()).add(domain)
+            heapq.heappush(self.heap, (deadline, ip, domain))
+        elif current >= deadline:
+            return
+        # При продлении куча не трогается: устаревший срок перепроверяется в expire()
+        self.deadlines[key] = deadline
+
+    def add(self, ip: str, domain: str, ttl: int | None = None):
+        deadline = time.monotonic() + max(ttl or 0, self.min_ttl) + self.grace
+        with self.lock:
+            self._track(ip, domain, deadline)
+        self.backend.add(ip, domain, ttl)
+        if self.hosts is not None:
+            self.hosts.add(domain, ip)
+
+    def restore(self):
+        """Ставит на учёт пары из HostMap (маршруты после рестарта не восстанавливаются)"""
+        if self.hosts is None:
+            return
+        deadline = time.monotonic() + self.min_ttl + self.grace
+        with self.hosts.lock:
+            pairs = [(ip, domain) for domain, ips in self.hosts.hosts.items() for ip in ips]
+        with self.lock:
+            for ip, domain in pairs:
+                self._track(ip, domain, deadline)
+        logger.info(f"[routes] Tracking {len(pairs)} known address(es) from host map")
+
+    def expire(self, now: float | None = None) -> int:
+        now = time.monotonic() if now is None else now
+        expired = []
+        with self.lock:
+            heap = self.heap
+            while heap and heap[0][0] <= now:
+                deadline, ip, domain = heapq.heappop(heap)
+                current = self.deadlines.get((ip, domain))
+                if current is None:
+                    continue
+                if current > deadline:
+                    heapq.heappush(heap, (current, ip, domain))
+                    continue
+                del self.deadlines[(ip, domain)]
+                domains = self.domains[ip]
+                domains.discard(domain)
+                if not domains:
+                    del self.domains[ip]
+                expired.append((ip, domain, not domains))
+        for ip, domain, last in expired:
+            if last:
+                self.backend.remove(ip)
+            if self.hosts is not None:
+                self.hosts.remove(domain, ip)
+        dropped = sum(last for *_, last in expired)
+        if dropped:
+            self.removed += dropped
+            logger.info(f"[routes] Expired {dropped} address(es), {len(self.domains)} active")
+        return dropped
+
+    def stats(self):
+        return {"addresses": len(self.domains), "pairs": len(self.deadlines), "removed": self.removed}
@@ -0,0 +1,140 @@
+import ipaddress
+import subprocess
+import threading
+import time
+
+from loguru import logger
+
+from .batch import BatchWorker
+
+
+class NftSetSink(BatchWorker):
+    """
+    Подменяемые адреса в nftables set с таймаутом вместо отдельного маршрута на каждый IP.
+    Пакеты к адресам из set помечаются fwmark, а `ip rule fwmark -> table` отправляет их в interface.
+    Таймаут элемента = TTL записи DNS + grace (в пределах min_timeout..max_timeout),
+    повторное add() продлевает его. Каждая пачка применяется одной транзакцией `nft -f -`.
+    netns позволяет поднять всё в отдельном network namespace (для проверки).
+    """
+
+    def __init__(self, interface: str, table="bns", set_name="spoofed", fwmark=0x53, route_table=53,
+                 min_timeout=60, max_timeout=86400, grace=300, refresh=0.5,
+                 batch_size=1024, flush_interval=0.2, netns: str | None = None, dry_run=False):
+        self.interface = interface
+        self.table = table
+        self.set_name = set_name
+        self.fwmark = fwmark
+        self.route_table = route_table
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.grace = grace
+        self.refresh = refresh
+        self.netns = netns
+        self.dry_run = dry_run
+        # ip -> время истечения элемента в ядре (по нашим данным)
+        self.expires: dict[str, float] = {}
+        self.lock = threading.Lock()
+        self.ready = False
+        super().__init__("nft-set-sink", batch_size, flush_interval)
+
+    def _run(self, cmd: list[str], stdin: str | None = None, quiet=False) -> bool:
+        if self.dry_run:
+            return True
+        name = cmd[0]
+        if self.netns:
+            cmd = ["ip", "netns", "exec", self.netns, *cmd]
+        result = subprocess.run(cmd, input=stdin, text=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if result.returncode != 0:
+            if not quiet:
+                logger.error(f"[nft] {name} failed: {result.stderr.strip()}")
+            return False
+        return True
+
+    def setup(self) -> bool:
+        """Создаёт таблицу, set, цепочки маркировки и правило маршрутизации. Повторный вызов пересоздаёт таблицу"""
+        t, s, mark = self.table, self.set_name, hex(self.fwmark)
+        ruleset = (
+            f"table inet {t}\n"
+            f"delete table inet {t}\n"
+            f"table inet {t} {{\n"
+            f"  set {s} {{ type ipv4_addr; flags timeout; }}\n"
+            f"  chain prerouting {{ type filter hook prerouting priority mangle; ip daddr @{s} meta mark set {mark}; }}\n"
+            f"  chain output {{ type route hook output priority mangle; ip daddr @{s} meta mark set {mark}; }}\n"
+            f"}}\n"
+        )
+        routing = (
+            f"rule add fwmark {mark} table {self.route_table}\n"
+            f"route replace default dev {self.interface} table {self.route_table}\n"
+        )
+        # Старые правила (после прошлого запуска) удаляются до первой ошибки: на чистой системе их нет
+        rule = ["ip", "rule", "del", "fwmark", mark, "table", str(self.route_table)]
+        for _ in range(16):
+            if self.dry_run or not self._run(rule, quiet=True):
+                break
+        self.ready = self._run(["nft", "-f", "-"], ruleset) and self._run(["ip", "-batch", "-"], routing)
+        if self.ready:
+            with self.lock:
+                self.expires.clear()
+            logger.success(f"[nft] Set inet {t} {s} -> {self.interface} (fwmark {mark}, table {self.route_table})")
+        return self.ready
+
+    def timeout(self, ttl: int | None) -> int:
+        ttl = self.min_timeout if ttl is None else ttl + self.grace
+        return int(min(max(ttl, self.min_timeout), self.max_timeout))
+
+    def add(self, ip: str, domain: str | None = None, ttl: int | None = None):
+        try:
+            if ipaddress.ip_address(ip).version != 4:
+                return
+        except ValueError:
+            logger.warning(f"[nft] Bad address {ip!r} ({domain})")
+            return
+        timeout = self.timeout(ttl)
+        now = time.monotonic()
+        with self.lock:
+            # Элемент ещё долго проживёт - не тратим транзакцию на продление
+            left = self.expires.get(ip, 0) - now
+            if left > timeout * self.refresh:
+                return
+            self.expires[ip] = now + timeout
+        self.put("add", ip, timeout)
+
+    def remove(self, ip: str):
+        with self.lock:
+            if self.expires.pop(ip, None) is None:
+                return
+        self.put("delete", ip, 0)
+
+    def _apply(self, batch):
+        elements = f"inet {self.table} {self.set_name}"
+        lines = []
+        for op, ip, timeout, _ in batch:
+            if op == "add":
+                # add + delete + add: существующий элемент пересоздаётся с новым таймаутом
+                lines.append(f"add element {elements} {{ {ip} timeout {timeout}s }}\n")
+                lines.append(f"delete element {elements} {{ {ip} }}\n")
+                lines.append(f"add element {elements} {{ {ip} timeout {timeout}s }}\n")
+            else:
+                # add перед delete, чтобы удаление уже истёкшего элемента не роняло транзакцию
+                lines.append(f"add element {elements} {{ {ip} }}\n")
+                lines.append(f"delete element {elements} {{ {ip} }}\n")
+        return self._run(["nft", "-f", "-"], "".join(lines))
+
+    def _applied(self, batch, ok, latency):
+        if not ok:
+            with self.lock:
+                for op, ip, *_ in batch:
+                    if op == "add":
+                        self.expires.pop(ip, None)
+            return
+        logger.success(f"[nft] Applied {len(batch)} element(s) to {self.set_name} in {latency * 1000:.1f}ms")
+
+    def expire(self):
+        """Забывает элементы, которые ядро уже удалило по таймауту"""
+        now = time.monotonic()
+        with self.lock:
+            for ip in [ip for ip, expires in self.expires.items() if expires <= now]:
+                del self.expires[ip]
+
+    def stats(self):
+        return {**super().stats(), "elements": len(self.expires)}
@@ -1,5 +1,12 @@
 # https://github.com/samuelcolvin/dnserver
 
+from .dispatch import SpoofDispatcher
+from .loader import load_zones, ZoneLoader
+from .metrics import Registry, MetricsServer
+from .querylog import QueryLog
 from .server import DNSServer
+from .shared import SharedCache
+from .watch import FileWatcher
+from .workers import WorkerPool
 from .zone import Zone, PTRZone, Record, SOA
 
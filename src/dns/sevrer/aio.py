@@ -0,0 +1,168 @@
+import asyncio
+import struct
+import threading
+
+from dnslib import DNSRecord, DNSError
+from loguru import logger
+
+
+class _Handler:
+    """Замена socketserver-хендлера dnslib: нужна журналу запросов и ProxyResolver"""
+    __slots__ = ("protocol", "client_address", "server", "started")
+
+    def __init__(self, protocol, client_address, server):
+        self.protocol = protocol
+        self.client_address = client_address
+        self.server = server
+        self.started = 0.0
+
+
+class _UDPProtocol(asyncio.DatagramProtocol):
+
+    def __init__(self, engine: "AsyncDNSEngine"):
+        self.engine = engine
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if self.engine.pending >= self.engine.max_pending:
+            return  # Перегрузка: клиент повторит запрос
+        self.engine.pending += 1  # Сразу, а не в задаче: задачи, созданные в этой же пачке датаграмм, тоже считаются
+        self.engine.loop.create_task(self.engine.handle_udp(self.transport, data, addr))
+
+    def error_received(self, exc):
+        logger.error("[AsyncDNSEngine] UDP error: {}", exc)
+
+
+class AsyncDNSEngine:
+    """
+    UDP/TCP DNS сервер на asyncio. Все запросы обслуживаются одним потоком event loop,
+    блокирующие операции резолвера выполняются в его пуле фиксированного размера.
+    """
+    udplen = 0  # Max udp packet length (0 = ignore), как в dnslib.server.DNSHandler
+
+    def __init__(self, resolver, address="0.0.0.0", port=53, tcp=True, logger=None, max_pending=4096,
+                 reuse_port=False):
+        self.resolver = resolver
+        self.address = address
+        self.port = port
+        self.tcp = tcp
+        self.reuse_port = reuse_port  # SO_REUSEPORT: несколько процессов на одном порту (WorkerPool)
+        self.logger = logger
+        self.max_pending = max_pending
+        self.pending = 0
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self.thread: threading.Thread | None = None
+        self._udp_transport = None
+        self._tcp_server = None
+        self._ready = threading.Event()
+        self._error: BaseException | None = None
+
+    async def _get_reply(self, handler, data):
+        rdata = self.resolver.resolve_packed(data)
+        if rdata is not None:
+            return rdata
+        request = DNSRecord.parse(data)
+        self.logger.log_request(handler, request)
+        reply = await self.resolver.resolve_async(request, handler)
+        self.logger.log_reply(handler, reply)
+        rdata = reply.pack()
+        if handler.protocol == 'udp' and self.udplen and len(rdata) > self.udplen:
+            truncated_reply = reply.truncate()
+            rdata = truncated_reply.pack()
+            self.logger.log_truncated(handler, truncated_reply)
+        return rdata
+
+    async def handle_udp(self, transport, data, addr):
+        """pending увеличивает datagram_received() до создания задачи, здесь он только уменьшается"""
+        handler = _Handler('udp', addr, self)
+        try:
+            self.logger.log_recv(handler, data)
+            rdata = await self._get_reply(handler, data)
+            self.logger.log_send(handler, rdata)
+            transport.sendto(rdata, addr)
+        except DNSError as e:
+            self.logger.log_error(handler, e)
+        except Exception as e:
+            logger.exception(e)
+        finally:
+            self.pending -= 1
+
+    async def handle_tcp(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        handler = _Handler('tcp', writer.get_extra_info('peername'), self)
+        try:
+            while True:
+                try:
+                    length = struct.unpack("!H", await reader.readexactly(2))[0]
+                    data = await reader.readexactly(length)
+                except asyncio.IncompleteReadError:
+                    break
+                self.logger.log_recv(handler, data)
+                try:
+                    rdata = await self._get_reply(handler, data)
+                except DNSError as e:
+                    self.logger.log_error(handler, e)
+                    break
+                self.logger.log_send(handler, rdata)
+                writer.write(struct.pack("!H", len(rdata)) + rdata)
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        except Exception as e:
+            logger.exception(e)
+        finally:
+            writer.close()
+
+    async def _serve(self):
+        self._udp_transport, _ = await self.loop.create_datagram_endpoint(
+            lambda: _UDPProtocol(self), local_addr=(self.address, self.port), reuse_port=self.reuse_port or None
+        )
+        if self.tcp:
+            self._tcp_server = await asyncio.start_server(self.handle_tcp, self.address, self.port,
+                                                          reuse_port=self.reuse_port or None)
+        await self.resolver.start_async()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self._serve())
+        except BaseException as e:
+            self._error = e
+            self._ready.set()
+            return
+        self._ready.set()
+        self.loop.run_forever()
+        self.loop.run_until_complete(self._close())
+        self.loop.close()
+
+    async def _close(self):
+        if self._udp_transport:
+            self._udp_transport.close()
+        if self._tcp_server:
+            self._tcp_server.close()
+        tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self.resolver.stop_async()
+        if self._tcp_server:
+            await self._tcp_server.wait_closed()
+
+    def start_thread(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self._run, name="dns-asyncio", daemon=True)
+        self.thread.start()
+        self._ready.wait()
+        if self._error:
+            raise self._error
+
+    def isAlive(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def stop(self):
+        if self.loop and self.loop.is_running():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+        if self.thread:
+            self.thread.join()
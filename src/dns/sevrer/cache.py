@@ -0,0 +1,137 @@
+import heapq
+import threading
+import time
+from collections import OrderedDict
+from typing import Any
+
+ENTRY_OVERHEAD = 256  # Примерная цена записи в памяти (ключ, CacheEntry, узел OrderedDict, элемент кучи)
+
+
+class CacheEntry:
+    __slots__ = ("key", "value", "expires", "ttl", "size", "hits", "prefetching")
+
+    def __init__(self, key, value, expires, ttl, size):
+        self.key = key
+        self.value = value
+        self.expires = expires
+        self.ttl = ttl
+        self.size = size
+        self.hits = 0
+        self.prefetching = False
+
+
+class RecordCache:
+    """
+    LRU кэш с ограничением по числу записей и по объёму (в байтах, оценочно).
+    Ключ - (qname, qtype, qclass). Истёкшие записи удаляются через кучу по времени истечения,
+    без полного прохода по словарю.
+    Истёкшая запись хранится ещё stale_window секунд, чтобы её можно было отдать при недоступности
+    upstream (RFC 8767, serve-stale).
+    """
+
+    def __init__(self, max_entries=100_000, max_bytes=64 * 1024 * 1024, stale_window=0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.stale_window = stale_window
+        self.lock = threading.Lock()
+        self.entries: OrderedDict[tuple, CacheEntry] = OrderedDict()
+        self.heap: list[tuple[float, tuple]] = []
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.stale_served = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _remove(self, entry: CacheEntry):
+        del self.entries[entry.key]
+        self.bytes -= entry.size
+
+    def get_entry(self, key, now=None, count_miss=True) -> CacheEntry | None:
+        """Запись, в том числе истёкшая (но не старше stale_window). Свежее попадание считается hit"""
+        now = now or time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry.expires + self.stale_window <= now:
+                self._remove(entry)
+                self.expirations += 1
+                entry = None
+            if entry is None or entry.expires <= now:
+                self.misses += count_miss
+                return entry
+            self.entries.move_to_end(key)
+            self.hits += 1
+            entry.hits += 1
+            return entry
+
+    def peek(self, key) -> CacheEntry | None:
+        """Запись без учёта в статистике и без сдвига в LRU"""
+        with self.lock:
+            return self.entries.get(key)
+
+    def get(self, key, now=None) -> Any:
+        now = now or time.time()
+        entry = self.get_entry(key, now)
+        if entry is not None and entry.expires > now:
+            return entry.value
+        return None
+
+    def set(self, key, value, ttl, size=0, now=None):
+        now = now or time.time()
+        entry = CacheEntry(key, value, now + ttl, ttl, size + ENTRY_OVERHEAD)
+        with self.lock:
+            old = self.entries.get(key)
+            if old is not None:
+                self._remove(old)
+            self.entries[key] = entry
+            self.bytes += entry.size
+            heapq.heappush(self.heap, (entry.expires + self.stale_window, key))
+            self._expire(now)
+            while self.entries and (len(self.entries) > self.max_entries or self.bytes > self.max_bytes):
+                _, evicted = self.entries.popitem(last=False)
+                self.bytes -= evicted.size
+                self.evictions += 1
+            if len(self.heap) > 2 * len(self.entries) + 1024:
+                # Перезаписи и вытеснения оставляют в куче устаревшие элементы
+                self.heap = [(e.expires + self.stale_window, k) for k, e in self.entries.items()]
+                heapq.heapify(self.heap)
+
+    def _expire(self, now):
+        heap = self.heap
+        removed = 0
+        while heap and heap[0][0] <= now:
+            deadline, key = heapq.heappop(heap)
+            entry = self.entries.get(key)
+            if entry is not None and entry.expires + self.stale_window == deadline:
+                self._remove(entry)
+                removed += 1
+        self.expirations += removed
+        return removed
+
+    def expire(self, now=None) -> int:
+        with self.lock:
+            return self._expire(now or time.time())
+
+    def purge(self, predicate) -> int:
+        """Удаляет записи, для ключа которых predicate(key) истинно. O(n), для перезагрузки конфигурации"""
+        with self.lock:
+            keys = [key for key in self.entries if predicate(key)]
+            for key in keys:
+                self._remove(self.entries[key])
+        return len(keys)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.heap.clear()
+            self.bytes = 0
+
+    def stats(self):
+        return {
+            "size": len(self.entries), "bytes": self.bytes,
+            "hits": self.hits, "misses": self.misses,
+            "evictions": self.evictions, "expirations": self.expirations, "stale_served": self.stale_served,
+        }
@@ -0,0 +1,118 @@
+import threading
+import time
+from collections import deque
+from typing import Callable, Literal
+
+from loguru import logger
+
+
+class CallbackStats:
+    __slots__ = ("calls", "errors", "total_time", "max_time")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def as_dict(self):
+        return {
+            "calls": self.calls, "errors": self.errors, "max_time": self.max_time,
+            "avg_time": self.total_time / self.calls if self.calls else 0.0,
+        }
+
+
+class SpoofDispatcher:
+    """
+    Доставка spoof событий (ip, domain, ttl) в callbacks и sinks через ограниченную очередь и пул потоков.
+    callbacks вызываются как callback(ip, domain), sinks - как sink.add(ip, domain, ttl).
+    Резолвер только вызывает submit(); одинаковые (ip, domain), ещё ждущие в очереди, схлопываются.
+    overflow: "drop-oldest" - выбросить самое старое событие, "block" - ждать место в очереди не дольше
+    block_timeout секунд, затем выбросить самое старое. submit() вызывается и из цикла asyncio движка,
+    поэтому ожидание ограничено: медленный sink не может остановить весь DNS сервер.
+    """
+
+    def __init__(self, max_queue=10_000, workers=2, overflow: Literal["drop-oldest", "block"] = "drop-oldest",
+                 block_timeout=0.01):
+        if overflow not in ("drop-oldest", "block"):
+            raise ValueError(f"Unknown overflow policy: {overflow!r}")
+        self.max_queue = max_queue
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self.callbacks: list[Callable[[str, str], None]] = []
+        self.sinks: list = []
+        self.stats_by_callback: dict[Callable, CallbackStats] = {}
+        self.queue: deque[tuple[str, str, int | None]] = deque()
+        self.pending: set[tuple[str, str]] = set()
+        self.cond = threading.Condition()
+        self.submitted = 0
+        self.deduplicated = 0
+        self.dropped = 0
+        self.run = True
+        self.workers = [
+            threading.Thread(target=self._worker, name=f"spoof-dispatch-{i}", daemon=True) for i in range(workers)
+        ]
+        for worker in self.workers:
+            worker.start()
+
+    def submit(self, ip: str, domain: str, ttl: int | None = None):
+        key = (ip, domain)
+        with self.cond:
+            if key in self.pending:
+                self.deduplicated += 1
+                return
+            if self.overflow == "block" and len(self.queue) >= self.max_queue:
+                self.cond.wait_for(lambda: len(self.queue) < self.max_queue, self.block_timeout)
+            while len(self.queue) >= self.max_queue:
+                self.pending.discard(self.queue.popleft()[:2])
+                self.dropped += 1
+            self.queue.append((ip, domain, ttl))
+            self.pending.add(key)
+            self.submitted += 1
+            self.cond.notify_all()
+
+    def _call(self, callback, *args):
+        stats = self.stats_by_callback.get(callback)
+        if stats is None:
+            stats = self.stats_by_callback.setdefault(callback, CallbackStats())
+        start = time.perf_counter()
+        try:
+            callback(*args)
+        except Exception as e:
+            stats.errors += 1
+            logger.exception(e)
+        elapsed = time.perf_counter() - start
+        stats.calls += 1
+        stats.total_time += elapsed
+        if elapsed > stats.max_time:
+            stats.max_time = elapsed
+
+    def _worker(self):
+        while True:
+            with self.cond:
+                while not self.queue and self.run:
+                    self.cond.wait()
+                if not self.queue:
+                    return
+                ip, domain, ttl = self.queue.popleft()
+                self.pending.discard((ip, domain))
+                self.cond.notify_all()
+            for callback in list(self.callbacks):
+                self._call(callback, ip, domain)
+            for sink in list(self.sinks):
+                self._call(sink.add, ip, domain, ttl)
+
+    def stop(self):
+        """Дожидается обработки очереди и останавливает потоки"""
+        with self.cond:
+            self.run = False
+            self.cond.notify_all()
+        for worker in self.workers:
+            worker.join()
+
+    def stats(self):
+        return {
+            "queue": len(self.queue), "submitted": self.submitted, "deduplicated": self.deduplicated,
+            "dropped": self.dropped,
+            "callbacks": {getattr(cb, "__qualname__", repr(cb)): s.as_dict() for cb, s in self.stats_by_callback.items()},
+        }
@@ -0,0 +1,71 @@
+import asyncio
+import threading
+
+
+class _Call:
+    __slots__ = ("event", "result", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error: BaseException | None = None
+
+
+class InFlight:
+    """
+    Single-flight: одинаковые одновременные запросы (key = (qname, qtype, qclass))
+    выполняются один раз, остальные ждут и получают тот же результат.
+    hits - запросы, присоединившиеся к уже идущему; misses - запросы, ушедшие в upstream.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls: dict[tuple, _Call] = {}
+        self.tasks: dict[tuple, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def do(self, key, fn, *args):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = _Call()
+                self.misses += 1
+            else:
+                self.hits += 1
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn(*args)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.event.set()
+
+    def _done(self, key, task):
+        if self.tasks.get(key) is task:
+            del self.tasks[key]
+        if not task.cancelled():
+            task.exception()  # Помечаем исключение как полученное, даже если все ожидающие отменены
+
+    async def do_async(self, key, fn, *args):
+        task = self.tasks.get(key)
+        if task is None:
+            self.misses += 1
+            task = self.tasks[key] = asyncio.ensure_future(fn(*args))
+            task.add_done_callback(lambda t: self._done(key, t))
+        else:
+            self.hits += 1
+        # shield: отмена одного клиента не отменяет запрос для остальных
+        return await asyncio.shield(task)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "in_flight": len(self.calls) + len(self.tasks)}
@@ -0,0 +1,382 @@
+import os
+import re
+import socket
+import struct
+import time
+from typing import Any, Iterable
+
+from dnslib import DNSLabel, DNSQuestion, RR
+from loguru import logger
+
+from .wire import WireAnswer, pack_answers
+from .zone import TYPE_LOOKUP, TTL, SOA, Zone, PTRZone
+
+_RR_HEADER = struct.Struct("!HHHIH")  # указатель на имя вопроса (0xC00C), type, class, ttl, rdlength
+_NAME_POINTER = 0xC00C
+_TOKEN = re.compile(r'"((?:[^"\\]|\\.)*)"|(\S+)')
+_CLASSES = {"IN", "CH", "HS", "CS"}
+_NAME_TYPES = {"CNAME", "NS", "PTR"}
+ZONE_SUFFIXES = (".zone", ".db", ".yaml", ".yml")
+_LENGTH = [bytes((i,)) for i in range(64)]  # длина метки, не больше 63
+_FIRST_TTL = (6,)  # смещение TTL в единственной записи RRset
+
+
+def _encode_name(name: str) -> bytes:
+    raw = (name.encode() if name.isascii() else name.encode("idna")).rstrip(b".")
+    if not raw:
+        return b"\0"
+    return b"".join(_LENGTH[len(label)] + label for label in raw.split(b".")) + b"\0"
+
+
+def _encode_txt(strings: list[str]) -> bytes:
+    data = bytearray()
+    for string in strings:
+        raw = string.encode()
+        for i in range(0, max(len(raw), 1), 255):
+            chunk = raw[i:i + 255]
+            data.append(len(chunk))
+            data += chunk
+    return bytes(data)
+
+
+class _ZoneData:
+    """Записи одной зоны до сборки: (owner, qtype) -> [(ttl, type, rdata)]"""
+
+    def __init__(self, origin: str, ttl=TTL):
+        self.origin = origin
+        self.ttl = ttl
+        self.soa: SOA | None = None
+        self.rrsets: dict[tuple[str, int], list[tuple[int, str, Any]]] = {}
+
+    def absolute(self, name: str) -> str:
+        if name == "@":
+            return self.origin
+        if name.endswith("."):
+            return name.lower()
+        return f"{name}.{self.origin}".lower()
+
+    def add(self, owner: str, ttl: int, rtype: str, rdata: list[str]):
+        rtype = rtype.upper()
+        if rtype not in TYPE_LOOKUP:
+            raise ValueError(f"Unsupported record type {rtype!r} for {owner!r}")
+        if rtype == "SOA":
+            ns, email, *times = rdata
+            self.soa = SOA(self.absolute(ns), self.absolute(email), *(int(t) for t in times))
+            return
+        self.rrsets.setdefault((owner, TYPE_LOOKUP[rtype][1]), []).append((ttl, rtype, rdata))
+
+
+def _strip(line: str) -> tuple[str, int]:
+    """Убирает комментарий и скобки вне кавычек; возвращает строку и изменение глубины скобок"""
+    if '"' not in line:
+        if ";" in line:
+            line = line.split(";", 1)[0]
+        if "(" not in line and ")" not in line:
+            return line, 0
+        return line.replace("(", " ").replace(")", " "), line.count("(") - line.count(")")
+    chars, depth, quoted, escaped = [], 0, False, False
+    for char in line:
+        if escaped:
+            escaped = False
+        elif char == "\\":
+            escaped = True
+        elif char == '"':
+            quoted = not quoted
+        elif not quoted:
+            if char == ";":
+                break
+            if char in "()":
+                depth += 1 if char == "(" else -1
+                char = " "
+        chars.append(char)
+    return "".join(chars), depth
+
+
+def _logical_lines(text: str):
+    """Строки мастер-файла без комментариев, с раскрытыми скобками: (владелец пропущен, строка)"""
+    buffer, depth, blank_owner = [], 0, False
+    for raw in text.splitlines():
+        line, delta = _strip(raw)
+        if depth == 0:
+            buffer = []
+            blank_owner = raw[:1] in (" ", "\t")
+        depth += delta
+        buffer.append(line)
+        if depth <= 0:
+            depth = 0
+            joined = " ".join(buffer) if len(buffer) > 1 else line
+            if joined and not joined.isspace():
+                yield blank_owner, joined
+
+
+def _tokens(line: str) -> list[str]:
+    if '"' not in line:
+        return line.split()
+    return [m[1] if m[1] is not None else m[2] for m in _TOKEN.finditer(line)]
+
+
+def parse_master(text: str, origin: str | None = None, ttl=TTL) -> list[_ZoneData]:
+    """
+    Разбор мастер-файла RFC 1035: $ORIGIN, $TTL, комментарии, скобки, пустой владелец (= предыдущий),
+    @ и относительные имена, TTL и класс в любом порядке. Каждый $ORIGIN с SOA начинает новую зону.
+    """
+    zones: list[_ZoneData] = []
+    zone = _ZoneData((origin or ".").rstrip(".").lower() + ".", ttl) if origin else None
+    if zone:
+        zones.append(zone)
+    owner = None
+    for blank_owner, line in _logical_lines(text):
+        tokens = _tokens(line)
+        if tokens[0].upper() == "$ORIGIN":
+            origin = tokens[1].lower()
+            if not origin.endswith("."):
+                origin += "."
+            zone = _ZoneData(origin, zone.ttl if zone else ttl)
+            zones.append(zone)
+            continue
+        if tokens[0].upper() == "$TTL":
+            ttl = int(tokens[1])
+            if zone:
+                zone.ttl = ttl
+            continue
+        if zone is None:
+            raise ValueError("Record before $ORIGIN")
+        if not blank_owner:
+            owner = zone.absolute(tokens.pop(0))
+        elif owner is None:
+            raise ValueError(f"Record without owner: {line.strip()!r}")
+        record_ttl = zone.ttl
+        while tokens and (tokens[0].isdigit() or tokens[0].upper() in _CLASSES):
+            value = tokens.pop(0)
+            if value.isdigit():
+                record_ttl = int(value)
+        zone.add(owner, record_ttl, tokens[0], tokens[1:])
+    return [zone for zone in zones if zone.rrsets or zone.soa]
+
+
+def _fast_rdata(zone: _ZoneData, rtype: str, rdata: list[str]) -> bytes | None:
+    """rdata в wire-формате без сжатия имён для частых типов; None - собрать через dnslib"""
+    if rtype == "A":
+        return socket.inet_pton(socket.AF_INET, rdata[0])
+    if rtype == "AAAA":
+        return socket.inet_pton(socket.AF_INET6, rdata[0])
+    if rtype in _NAME_TYPES:
+        return _encode_name(zone.absolute(rdata[0]))
+    if rtype == "MX":
+        return struct.pack("!H", int(rdata[0])) + _encode_name(zone.absolute(rdata[1]))
+    if rtype in ("TXT", "SPF"):
+        return _encode_txt(rdata)
+    return None
+
+
+def _pack_rrset(zone: _ZoneData, owner: str, qtype: int, records) -> tuple[WireAnswer, int]:
+    if len(records) == 1:
+        ttl, rtype, rdata = records[0]
+        data = _fast_rdata(zone, rtype, rdata)
+        if data is not None:
+            return WireAnswer(1, _RR_HEADER.pack(_NAME_POINTER, qtype, 1, ttl, len(data)) + data, _FIRST_TTL), ttl
+    ttl = min(record[0] for record in records)
+    chunks, offsets, offset = [], [], 0
+    for record_ttl, rtype, rdata in records:
+        data = _fast_rdata(zone, rtype, rdata)
+        if data is None:
+            break
+        chunks.append(_RR_HEADER.pack(_NAME_POINTER, qtype, 1, record_ttl, len(data)))
+        chunks.append(data)
+        offsets.append(offset + 6)
+        offset += _RR_HEADER.size + len(data)
+    else:
+        return WireAnswer(len(records), b"".join(chunks), tuple(offsets)), ttl
+    # Редкие типы (SRV, CAA, HTTPS, ...) - через dnslib, тем же путём, что и ответы DoH
+    rcls, _ = TYPE_LOOKUP[records[0][1]]
+    label = DNSLabel(owner)
+    rrs = [RR(label, qtype, rdata=rcls.fromZone(rdata, DNSLabel(zone.origin)), ttl=t) for t, _, rdata in records]
+    return pack_answers(DNSQuestion(label, qtype), rrs), ttl
+
+
+def _build(zone_data: _ZoneData) -> Zone:
+    origin = zone_data.origin
+    soa = zone_data.soa or SOA(f"ns.{origin}", f"hostmaster.{origin}")
+    zone = Zone(origin, soa)
+    zone.ttl = zone_data.ttl
+    answers = zone.answers
+    for (owner, qtype), records in zone_data.rrsets.items():
+        answers[(owner, qtype)] = _pack_rrset(zone_data, owner, qtype, records)
+    return zone
+
+
+def _ptr_zones(zones: list[_ZoneData], existing: dict[str, Zone]) -> list[Zone]:
+    """PTR зоны /24 из A записей; ключи, уже заданные явно, не перезаписываются"""
+    reverse: dict[str, tuple[str, dict]] = {}  # "a.b.c" -> (c.b.a.in-addr.arpa., (owner, 12) -> записи)
+    for zone in zones:
+        for (owner, qtype), records in zone.rrsets.items():
+            if qtype != 1:
+                continue
+            for ttl, _, rdata in records:
+                prefix, _, host = rdata[0].rpartition(".")
+                found = reverse.get(prefix)
+                if found is None:
+                    found = reverse[prefix] = (".".join(reversed(prefix.split("."))) + ".in-addr.arpa.", {})
+                domain, rrsets = found
+                rrsets.setdefault((f"{host}.{domain}", 12), []).append((ttl, "PTR", [owner]))
+    result = []
+    for prefix, (domain, rrsets) in reverse.items():
+        zone = existing.get(domain)
+        if zone is None:
+            zone = PTRZone(prefix)
+            result.append(zone)
+        data = _ZoneData(domain)
+        for key, records in rrsets.items():
+            if key not in zone.answers and key not in zone.rrsets:
+                zone.answers[key] = _pack_rrset(data, key[0], 12, records)
+    return result
+
+
+def _yaml_zones(document) -> list[_ZoneData]:
+    """
+    YAML: одна зона, список зон или {zones: [...]}. Зона:
+      zone: home
+      soa: {ns: ns.home., email: admin@home}
+      ttl: 3600
+      records:
+        - "@ NS ns.home."                                   # строка мастер-файла
+        - {name: lilrt, type: A, value: [10.47.0.1, 10.41.0.2], ttl: 300}
+    """
+    if isinstance(document, dict) and "zones" in document:
+        document = document["zones"]
+    if isinstance(document, dict):
+        document = [document]
+    zones = []
+    for item in document or ():
+        origin = str(item["zone"]).lower().rstrip(".") + "."
+        zone = _ZoneData(origin, int(item.get("ttl", TTL)))
+        if "soa" in item:
+            soa = item["soa"]
+            zone.soa = SOA(zone.absolute(soa["ns"]), soa["email"],
+                           **{k: int(v) for k, v in soa.items() if k not in ("ns", "email")})
+        lines = []
+        for record in item.get("records") or ():
+            if isinstance(record, str):
+                lines.append(record)
+                continue
+            values = record["value"] if isinstance(record["value"], list) else [record["value"]]
+            for value in values:
+                zone.add(zone.absolute(str(record["name"])), int(record.get("ttl", zone.ttl)), str(record["type"]),
+                         _tokens(str(value)))
+        if lines:
+            parsed = parse_master("\n".join(lines), origin, zone.ttl)
+            for key, records in (parsed[0].rrsets.items() if parsed else ()):
+                zone.rrsets.setdefault(key, []).extend(records)
+        zones.append(zone)
+    return zones
+
+
+def _read(path: str) -> list[_ZoneData]:
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read()
+    if path.endswith((".yaml", ".yml")):
+        from ruamel.yaml import YAML
+        return _yaml_zones(YAML(typ="safe").load(text))
+    name = os.path.basename(path)
+    for suffix in (".zone", ".db"):
+        name = name.removesuffix(suffix)
+    return parse_master(text, name if "$ORIGIN" not in text else None)
+
+
+def zone_files(path: str) -> list[str]:
+    if os.path.isdir(path):
+        return sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith(ZONE_SUFFIXES))
+    return [path]
+
+
+def load_zones(paths: str | Iterable[str], auto_ptr=True, strict=False) -> list[Zone]:
+    """
+    Загружает зоны из мастер-файлов (.zone, .db) и YAML (.yaml, .yml); путь может быть каталогом.
+    Записи разбираются и упаковываются в готовые секции ответов за один проход, без объектов Record.
+    auto_ptr - создать PTR зоны /24 из A записей; strict - ошибка в любом файле поднимается, а не пропускается.
+    """
+    return ZoneLoader(paths, auto_ptr).load(strict)
+
+
+def _same_answers(a: Zone, b: Zone) -> bool:
+    if a.answers.keys() != b.answers.keys():
+        return False
+    return all(a.answers[key][0].data == answer.data and a.answers[key][1] == ttl
+               for key, (answer, ttl) in b.answers.items())
+
+
+class ZoneLoader:
+    """
+    Загрузка зон с кэшем по файлам: повторная загрузка перечитывает только файлы, у которых изменились
+    mtime или размер, остальные зоны берутся готовыми. PTR зоны пересобираются, если изменился хоть один файл.
+    """
+
+    def __init__(self, paths: str | Iterable[str], auto_ptr=True):
+        self.paths = [paths] if isinstance(paths, str) else list(paths)
+        self.auto_ptr = auto_ptr
+        self.files: dict[str, tuple[int, int, list[_ZoneData], list[Zone]]] = {}
+        self.zones: dict[str, Zone] = {}
+
+    def load(self, strict=False) -> list[Zone]:
+        t = time.time()
+        self._load(strict)
+        result = list(self.zones.values())
+        count = sum(len(zone.answers) for zone in result)
+        logger.success(f"[zones] Loaded {len(result)} zones, {count} RRsets in {(time.time() - t) * 1000:.1f}ms")
+        return result
+
+    def reload(self) -> tuple[list[Zone], list[str]]:
+        """
+        Перечитывает изменённые файлы; (новые и изменённые зоны, домены удалённых зон).
+        Ошибка в любом файле поднимается, прежние зоны при этом остаются в силе.
+        """
+        previous = self.zones
+        if not self._load(strict=True):
+            return [], []
+        updated = []
+        for domain, zone in self.zones.items():
+            old = previous.get(domain)
+            if old is zone:
+                continue
+            if old is not None and zone.ptr and old.ptr and _same_answers(old, zone):
+                self.zones[domain] = old  # Та же PTR зона: ответы в кэше остаются
+                continue
+            updated.append(zone)
+        removed = [domain for domain in previous if domain not in self.zones]
+        return updated, removed
+
+    def _load(self, strict: bool) -> bool:
+        """False - ни один файл не изменился"""
+        files = {}
+        changed = False
+        for path in self.paths:
+            for file in zone_files(path):
+                try:
+                    stat = os.stat(file)
+                    cached = self.files.get(file)
+                    if cached and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+                        files[file] = cached
+                        continue
+                    changed = True
+                    parsed = _read(file)
+                    built = [_build(zone) for zone in parsed]
+                except Exception as e:
+                    if strict:
+                        raise ValueError(f"Failed to load '{file}': {e!r}") from e
+                    logger.error(f"[zones] Failed to load '{file}': {e!r}")
+                    continue
+                files[file] = (stat.st_mtime_ns, stat.st_size, parsed, built)
+        if not changed and files.keys() == self.files.keys():
+            return False
+        data: list[_ZoneData] = []
+        zones: dict[str, Zone] = {}
+        for *_, parsed, built in files.values():
+            for zone_data, zone in zip(parsed, built):
+                if self.auto_ptr and zone.domain.endswith(".in-addr.arpa."):
+                    zone = _build(zone_data)  # _ptr_zones дописывает в явные обратные зоны, кэш не трогаем
+                data.append(zone_data)
+                zones[zone.domain] = zone
+        if self.auto_ptr:
+            zones.update((zone.domain, zone) for zone in _ptr_zones(data, zones))
+        self.files, self.zones = files, zones
+        return True
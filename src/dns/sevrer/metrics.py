@@ -0,0 +1,204 @@
+import threading
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Iterable
+
+from loguru import logger
+
+# Границы по умолчанию: от попаданий в кэш (десятки мкс) до таймаутов DoH (секунды)
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0)
+
+Sample = tuple[str, dict[str, str], float]  # имя (с суффиксом), метки, значение
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(labels: dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+class Counter:
+    """Счётчик. inc() - одно сложение, без блокировок (+= на int под GIL достаточно для метрик)"""
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class Histogram:
+    """Гистограмма с фиксированными границами; observe() - bisect и два сложения"""
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds: Iterable[float] = LATENCY_BUCKETS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)  # последний - +Inf
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def samples(self, name: str, labels: dict[str, str]) -> list[Sample]:
+        result = []
+        total = 0
+        for bound, count in zip((*self.bounds, "+Inf"), self.counts):
+            total += count
+            result.append((f"{name}_bucket", {**labels, "le": str(bound)}, total))
+        result.append((f"{name}_sum", labels, self.sum))
+        result.append((f"{name}_count", labels, total))
+        return result
+
+
+class Family:
+    """Метрика с метками: child(*значения меток) создаётся один раз и кэшируется вызывающим кодом"""
+
+    def __init__(self, name: str, kind: str, help: str, labels: tuple[str, ...] = (), factory=Counter):
+        self.name = name
+        self.kind = kind
+        self.help = help
+        self.labels = labels
+        self.factory = factory
+        self.children: dict[tuple[str, ...], Counter | Histogram] = {}
+        self.lock = threading.Lock()
+
+    def child(self, *values: str):
+        metric = self.children.get(values)
+        if metric is None:
+            with self.lock:
+                metric = self.children.setdefault(values, self.factory())
+        return metric
+
+    def samples(self) -> list[Sample]:
+        result = []
+        for values, metric in list(self.children.items()):
+            labels = dict(zip(self.labels, values))
+            if isinstance(metric, Histogram):
+                result.extend(metric.samples(self.name, labels))
+            else:
+                result.append((self.name, labels, metric.value))
+        return result
+
+
+class Registry:
+    """
+    Метрики и коллекторы. Горячий путь только увеличивает заранее созданные Counter/Histogram;
+    значения, которые и так считаются где-то ещё (размер кэша, очереди), снимаются коллекторами
+    только при чтении /metrics.
+    """
+
+    def __init__(self):
+        self.families: dict[str, Family] = {}
+        # collector() -> [(имя, тип, описание, [(метки, значение), ...]), ...]
+        self.collectors: list[Callable[[], Iterable[tuple[str, str, str, list[tuple[dict, float]]]]]] = []
+
+    def counter(self, name: str, help: str, labels: tuple[str, ...] = ()) -> Family:
+        return self.families.setdefault(name, Family(name, "counter", help, labels))
+
+    def histogram(self, name: str, help: str, labels: tuple[str, ...] = (), buckets=LATENCY_BUCKETS) -> Family:
+        return self.families.setdefault(name, Family(name, "histogram", help, labels, lambda: Histogram(buckets)))
+
+    def add_collector(self, collector):
+        self.collectors.append(collector)
+
+    def add_stats(self, prefix: str, stats: Callable[[], dict], counters: Iterable[str] = (), help=""):
+        """
+        Коллектор поверх готового stats() -> dict: числовые значения экспортируются как {prefix}_{ключ},
+        ключи из counters - как счётчики {prefix}_{ключ}_total, остальные - как gauge. Вложенные dict пропускаются.
+        """
+        counters = frozenset(counters)
+
+        def collect():
+            for key, value in stats().items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                if key in counters:
+                    yield f"{prefix}_{key}_total", "counter", help or key, [({}, value)]
+                else:
+                    yield f"{prefix}_{key}", "gauge", help or key, [({}, value)]
+
+        self.add_collector(collect)
+
+    def render(self) -> str:
+        lines = []
+        for family in list(self.families.values()):
+            lines.append(f"# HELP {family.name} {family.help}")
+            lines.append(f"# TYPE {family.name} {family.kind}")
+            lines.extend(f"{name}{_labels(labels)} {value}" for name, labels, value in family.samples())
+        for collector in self.collectors:
+            try:
+                collected = list(collector())
+            except Exception as e:
+                logger.warning(f"[metrics] Collector {collector!r} failed: {e!r}")
+                continue
+            for name, kind, help, samples in collected:
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                lines.extend(f"{name}{_labels(labels)} {value}" for labels, value in samples)
+        return "\n".join(lines) + "\n"
+
+
+class QueryMetrics:
+    """
+    Задержка ответа по источнику: local, cache, shared (общий кэш воркеров), doh, doh_empty (пустой ответ),
+    doh_error, upstream
+    """
+
+    def __init__(self, registry: Registry):
+        family = registry.histogram("bns_dns_query_duration_seconds", "DNS query resolution time by source", ("source",))
+        self.local = family.child("local")
+        self.cache = family.child("cache")
+        self.shared = family.child("shared")
+        self.doh = family.child("doh")
+        self.doh_empty = family.child("doh_empty")
+        self.doh_error = family.child("doh_error")
+        self.upstream = family.child("upstream")
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MetricsServer:
+    """HTTP /metrics в формате Prometheus (text exposition 0.0.4) в отдельном потоке"""
+
+    def __init__(self, registry: Registry, address="127.0.0.1", port=9153):
+        self.registry = registry
+        self.address = address
+        self.port = port
+        self.httpd: ThreadingHTTPServer | None = None
+        self.thread: threading.Thread | None = None
+
+    def start(self):
+        self.httpd = ThreadingHTTPServer((self.address, self.port), _MetricsHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.registry = self.registry
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="metrics", daemon=True)
+        self.thread.start()
+        logger.info(f"[metrics] Serving http://{self.address}:{self.port}/metrics")
+
+    def stop(self):
+        if self.httpd:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
@@ -0,0 +1,182 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import Literal
+
+from dnslib import QTYPE, RCODE
+from loguru import logger
+
+# Уровни записи журнала запросов
+OK, NXDOMAIN, ERROR, SLOW = range(4)
+LEVELS = {"ok": OK, "nxdomain": NXDOMAIN, "error": ERROR, "slow": SLOW}
+_NOERROR, _SERVFAIL, _NXDOMAIN = RCODE.NOERROR, RCODE.SERVFAIL, RCODE.NXDOMAIN  # атрибуты Bimap медленные
+MODES = {
+    "all": {"ok": 1.0, "nxdomain": 1.0, "error": 1.0, "slow": 1.0},
+    "sampled": {"ok": 0.01, "nxdomain": 0.1, "error": 1.0, "slow": 1.0},
+    "slow": {"ok": 0.0, "nxdomain": 0.0, "error": 1.0, "slow": 1.0},  # только медленные и неудачные
+    "off": {"ok": 0.0, "nxdomain": 0.0, "error": 0.0, "slow": 0.0},
+}
+
+
+def _question(data: bytes):
+    """qname, qtype из сырого пакета (без сжатия в вопросе); None, если не разбирается"""
+    labels = []
+    offset = 12
+    try:
+        while True:
+            length = data[offset]
+            if length == 0:
+                break
+            if length & 0xC0:
+                return None
+            labels.append(data[offset + 1:offset + 1 + length].decode(errors="replace"))
+            offset += 1 + length
+        return ".".join(labels) + ".", int.from_bytes(data[offset + 1:offset + 3], "big")
+    except IndexError:
+        return None
+
+
+class QueryLog:
+    """
+    Журнал запросов с интерфейсом dnslib DNSLogger, дешёвый на пути запроса.
+    log_send() только определяет уровень (ok / nxdomain / error / slow) по rcode и времени ответа,
+    применяет детерминированную выборку (каждый N-й запрос уровня) и кладёт сырой ответ в кольцевой буфер.
+    Разбор пакета и форматирование выполняет фоновый поток раз в flush_interval:
+    JSON-строки в path (с ротацией по max_bytes) или в loguru, если path не задан.
+    Пакеты, ответ на которые собран быстрым путём, проходят тот же путь.
+    """
+
+    def __init__(self, path: str | None = None, mode: Literal["all", "sampled", "slow", "off"] = "slow",
+                 sample: dict[str, float] | None = None, slow_ms=100.0, ring_size=65536, flush_interval=1.0,
+                 max_bytes=10 * 1024 * 1024):
+        rates = {**MODES[mode], **(sample or {})}
+        # Каждый every[level]-й запрос уровня попадает в журнал; 0 - уровень не пишется
+        self.every = [0] * len(LEVELS)
+        for name, rate in rates.items():
+            self.every[LEVELS[name]] = round(1 / rate) if rate > 0 else 0
+        self.enabled = any(self.every)
+        self.seen = [0] * len(LEVELS)
+        self.slow = slow_ms / 1000
+        self.path = path
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_interval
+        self.ring: deque = deque(maxlen=ring_size)
+        self.dropped = 0
+        self.written = 0
+        self.run = False
+        self.thread: threading.Thread | None = None
+
+    # --- интерфейс DNSLogger, вызывается на пути запроса ---
+
+    def log_recv(self, handler, data):
+        handler.started = time.perf_counter()
+
+    def log_send(self, handler, data):
+        if not self.enabled:
+            return
+        elapsed = time.perf_counter() - handler.started
+        rcode = data[3] & 0x0F if len(data) > 3 else _SERVFAIL
+        if elapsed >= self.slow:
+            level = SLOW
+        elif rcode == _NOERROR:
+            level = OK
+        elif rcode == _NXDOMAIN:
+            level = NXDOMAIN
+        else:
+            level = ERROR
+        every = self.every[level]
+        if not every:
+            return
+        seen = self.seen[level] = self.seen[level] + 1
+        if seen % every:
+            return
+        self._append((time.time(), handler.client_address, handler.protocol, elapsed, level, data))
+
+    def log_error(self, handler, e):
+        if self.every[ERROR]:
+            self._append((time.time(), handler.client_address, handler.protocol, 0.0, ERROR, e))
+
+    def _append(self, entry):
+        ring = self.ring
+        if len(ring) == ring.maxlen:
+            self.dropped += 1
+        ring.append(entry)
+
+    def log_request(self, handler, request):
+        pass
+
+    def log_reply(self, handler, reply):
+        pass
+
+    def log_truncated(self, handler, reply):
+        pass
+
+    def log_data(self, dnsobj):
+        pass
+
+    # --- фоновая запись ---
+
+    @staticmethod
+    def format(entry) -> str:
+        ts, client, protocol, elapsed, level, data = entry
+        record = {
+            "ts": round(ts, 3), "client": client[0] if client else None, "proto": protocol,
+            "level": ("ok", "nxdomain", "error", "slow")[level], "ms": round(elapsed * 1000, 3),
+        }
+        if isinstance(data, (bytes, bytearray)):
+            question = _question(data)
+            if question:
+                record["qname"], qtype = question
+                record["qtype"] = QTYPE.get(qtype, qtype)
+            record["rcode"] = RCODE.get(data[3] & 0x0F) if len(data) > 3 else None
+            record["answers"] = int.from_bytes(data[6:8], "big") if len(data) >= 8 else 0
+        else:
+            record["error"] = repr(data)
+        return json.dumps(record, separators=(",", ":"), ensure_ascii=False)
+
+    def flush(self):
+        ring = self.ring
+        lines = []
+        while ring:
+            try:
+                lines.append(self.format(ring.popleft()))
+            except IndexError:
+                break
+        if not lines:
+            return
+        self.written += len(lines)
+        if self.path is None:
+            for line in lines:
+                logger.info("[query] {}", line)
+            return
+        if self.max_bytes and os.path.exists(self.path) and os.path.getsize(self.path) >= self.max_bytes:
+            os.replace(self.path, f"{self.path}.1")
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+
+    def _worker(self):
+        while self.run:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"[query] Failed to write query log: {e!r}")
+
+    def start(self):
+        if not self.enabled or self.run:
+            return
+        self.run = True
+        self.thread = threading.Thread(target=self._worker, name="query-log", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.run = False
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+        self.flush()
+
+    def stats(self):
+        return {"queue": len(self.ring), "written": self.written, "dropped": self.dropped}
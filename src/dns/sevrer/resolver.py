@@ -1,61 +1,174 @@
+import asyncio
 import re
 import socket
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any
 
 from dns.rdatatype import RdataType
-from dnslib import QTYPE, DNSRecord, RCODE, RR
+from dnslib import QTYPE, DNSRecord, DNSHeader, RCODE, RR
 from dnslib.proxy import ProxyResolver as LibProxyResolver
 from loguru import logger
 
 from doh import DNSQueryFailed
+from .cache import RecordCache
+from .dispatch import SpoofDispatcher
+from .inflight import InFlight
+from .metrics import Registry, QueryMetrics
+from .shared import SharedCache
+from .suffix import SuffixMap
+from . import snapshot
+from .wire import WireAnswer, pack_answers, parse_question, build_reply, unpack_answers
 from .zone import TYPE_LOOKUP
 
 ipv4_pattern = r'(?:\b25[0-5]|\b2[0-4][0-9]|\b1[0-9]{2}|\b[1-9][0-9]|\b[0-9])(?:\.(?:25[0-5]|2[0-4][0-9]|1[0-9]{2}|[1-9]?[0-9])){3}'
+STALE_TTL = 30  # TTL устаревшего ответа, RFC 8767
 
 
 class DNSCache:
 
-    def __init__(self):
+    def __init__(self, max_entries=100_000, max_bytes=64 * 1024 * 1024, stale_window=3600, prefetch_at=0.9,
+                 prefetch_hits=2, snapshot_path=None, snapshot_interval=300, dispatcher: SpoofDispatcher | None = None,
+                 shared: SharedCache | None = None):
         self.run = True
-        self.cache = {}
-        self.spoof_list = []
-        self.spoof_callbacks = []
+        self.cache = RecordCache(max_entries, max_bytes, stale_window)
+        self.shared = shared  # Общий кэш воркеров (L2), None - только локальный
+        self.snapshot_path = snapshot_path
+        self.snapshot_interval = snapshot_interval
+        self.prefetch_at = prefetch_at  # Доля TTL, после которой популярная запись обновляется заранее
+        self.prefetch_hits = prefetch_hits
+        self.spoof_list = SuffixMap()
+        self.dispatcher = dispatcher or SpoofDispatcher()
+        self.spoof_callbacks = self.dispatcher.callbacks
         self.tick_callbacks = []
         self.worker = threading.Thread(target=self._worker, daemon=True)
         self.worker.start()
 
     def get(self, key):
-        # Проверяем, жива ли запись, когда ее запрашивают
-        record = self.cache.get(key)
-        if record:
-            rrs, expiry = record
-            if time.time() < expiry:
-                return rrs
-            else:
-                del self.cache[key]  # Удаляем запись, если TTL истек
-        return None
+        # key: (qname, qtype, qclass); истёкшая запись удаляется при обращении
+        return self.cache.get(key)
+
+    def lookup(self, key, count_miss=True):
+        return self.cache.get_entry(key, count_miss=count_miss)
+
+    def get_shared(self, key) -> tuple[WireAnswer, float] | None:
+        """Промах локального кэша: запись из общего кэша копируется в локальный. (WireAnswer, expires) или None"""
+        if self.shared is None:
+            return None
+        found = self.shared.get(key)
+        if found is None:
+            return None
+        answer, expires, ttl = found
+        self.cache.set(key, answer, ttl, len(key[0]) + len(answer), now=expires - ttl)
+        return answer, expires
+
+    def get_stale(self, key):
+        entry = self.cache.get_entry(key, count_miss=False)
+        if entry is None or entry.expires > time.time():
+            return None
+        self.cache.stale_served += 1
+        return entry.value
+
+    def prefetch_pending(self, entry, now) -> bool:
+        """Популярная запись прошла prefetch_at своего TTL и ещё не обновляется"""
+        if self.prefetch_at is None or entry.prefetching or entry.hits < self.prefetch_hits:
+            return False
+        return now >= entry.expires - entry.ttl * (1 - self.prefetch_at)
+
+    def prefetch_due(self, entry, now) -> bool:
+        """Как prefetch_pending, но True возвращается один раз на запись"""
+        if not self.prefetch_pending(entry, now):
+            return False
+        entry.prefetching = True
+        return True
 
-    def set(self, domain_name, rrs: list[RR], _res):
+    def prefetch_failed(self, key):
+        """Обновление не записало новый ответ: запись снова может быть обновлена заранее"""
+        entry = self.cache.peek(key)
+        if entry is not None:
+            entry.prefetching = False
+
+    def set(self, key, answer: WireAnswer, rrs: list[RR]):
         # Используем TTL из объекта RR для определения времени истечения
         if len(rrs) == 0:
             return
+        domain_name = key[0]
         ttl = rrs[0].ttl
-        self.cache[domain_name] = (rrs, time.time() + ttl)
-        for domain in self.spoof_list:
-            if domain not in domain_name:
-                continue
-            logger.debug(f"{domain!r} in {domain_name!r}")
-            if rrs[0].rtype == 65:  # https
-                for rr in rrs:
-                    ipv4_addresses = re.findall(ipv4_pattern, str(rr.rdata))
-                    if len(ipv4_addresses) > 0:
-                        logger.success(f"Spoofed HTTPS: '{domain_name}' '{rr.rdata}'")
-                    [callback(ip, domain_name) for callback in self.spoof_callbacks for ip in ipv4_addresses]
-            if rrs[0].rtype == 1:  # A
-                logger.success(f"Spoofed: '{domain_name}' {_res}")
-                [callback(r, domain_name) for callback in self.spoof_callbacks for r, _ in _res]
+        self.cache.set(key, answer, ttl, len(domain_name) + len(answer))
+        if self.shared is not None:
+            self.shared.set(key, answer, ttl)
+        self._spoof(domain_name, rrs, ttl)
+
+    def _spoof(self, domain_name, rrs: list[RR], ttl: int | None = None):
+        domain = self.spoof_list.match(domain_name)
+        if domain is None:
+            return
+        logger.debug("{!r} in {!r}", domain, domain_name)
+        if rrs[0].rtype == 65:  # https
+            for rr in rrs:
+                ipv4_addresses = re.findall(ipv4_pattern, str(rr.rdata))
+                if len(ipv4_addresses) > 0:
+                    logger.success("Spoofed HTTPS: '{}' '{}'", domain_name, rr.rdata)
+                for ip in ipv4_addresses:
+                    self.dispatcher.submit(ip, domain_name, ttl)
+        if rrs[0].rtype == 1:  # A
+            ips = [str(rr.rdata) for rr in rrs]
+            logger.success("Spoofed: '{}' {}", domain_name, ips)
+            for ip in ips:
+                self.dispatcher.submit(ip, domain_name, ttl)
+
+    def save_snapshot(self):
+        if not self.snapshot_path:
+            return
+        try:
+            t = time.time()
+            count = snapshot.save(self.cache, self.snapshot_path)
+            logger.info(f"Cache snapshot saved: {count} entries in {(time.time() - t) * 1000:.1f}ms")
+        except Exception as e:
+            logger.error(f"Failed to save cache snapshot: {e!r}")
+
+    def load_snapshot(self):
+        """Загружает снимок кэша; для подменяемых доменов заново вызываются spoof callbacks"""
+        if not self.snapshot_path:
+            return
+        t = time.time()
+        count = 0
+        try:
+            for key, answer, expires, ttl in snapshot.load(self.snapshot_path):
+                domain_name = key[0]
+                self.cache.set(key, answer, ttl, len(domain_name) + len(answer), now=expires - ttl)
+                count += 1
+                if self.spoof_list.match(domain_name):
+                    self._replay_spoof(key, answer, expires)
+        except Exception as e:
+            logger.error(f"Failed to load cache snapshot: {e!r}")
+        logger.info(f"Cache snapshot loaded: {count} entries in {(time.time() - t) * 1000:.1f}ms")
+
+    def _replay_spoof(self, key, answer: WireAnswer, expires: float):
+        left = max(0, int(expires - time.time()))
+        self._spoof(key[0], unpack_answers(*key, answer, left), left)
+
+    def set_spoof_list(self, domains) -> tuple[int, int]:
+        """
+        Заменяет список подменяемых доменов целиком: новый SuffixMap собирается в стороне и подставляется
+        одним присваиванием, поэтому запросы читают его без блокировок.
+        Для добавленных доменов spoof события повторяются по уже закэшированным ответам.
+        """
+        spoof_list = SuffixMap(domains)
+        old = self.spoof_list
+        added = [domain for domain in spoof_list if domain not in old.map]
+        removed = sum(1 for domain in old if domain not in spoof_list.map)
+        self.spoof_list = spoof_list
+        if added:
+            index = SuffixMap(added)
+            with self.cache.lock:
+                entries = [(e.key, e.value, e.expires) for e in self.cache.entries.values() if index.match(e.key[0])]
+            now = time.time()
+            for key, answer, expires in entries:
+                if expires > now:
+                    self._replay_spoof(key, answer, expires)
+        return len(added), removed
 
     def _sleep(self, t):
         i = 0
@@ -67,76 +180,236 @@ class DNSCache:
 
     def _worker(self):
         # Функция для периодической очистки мертвых записей
+        last_snapshot = time.time()
         while self.run:
             try:
                 self._sleep(10)
                 [callback() for callback in self.tick_callbacks]
-                current_time = time.time()
-                keys_to_delete = [key for key, (rr, expiry) in self.cache.items() if expiry < current_time]
-                for key in keys_to_delete:
-                    del self.cache[key]
+                self.cache.expire()
+                if self.run and time.time() - last_snapshot >= self.snapshot_interval:
+                    self.save_snapshot()
+                    last_snapshot = time.time()
             except Exception as e:
                 logger.exception(e)
 
 
 class ProxyResolver(LibProxyResolver):
-    def __init__(self, upstream, doh):
+    def __init__(self, upstream, doh, workers=16, cache_entries=100_000, cache_bytes=64 * 1024 * 1024,
+                 serve_stale=3600, prefetch_at=0.9, snapshot_path=None, spoof_dispatcher=None,
+                 metrics: Registry | None = None, shared_cache: SharedCache | None = None):
         self.doh = doh
-        self.cache = DNSCache()
+        self.metrics = QueryMetrics(metrics or Registry())
+        self.cache = DNSCache(cache_entries, cache_bytes, serve_stale, prefetch_at, snapshot_path=snapshot_path,
+                              dispatcher=spoof_dispatcher, shared=shared_cache)
+        self.inflight = InFlight()
+        self._tasks = set()
+        # Используется только asyncio-движком: фиксированное число потоков под блокирующие запросы
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="resolver")
         super().__init__(address=upstream, port=53, timeout=5, strip_aaaa=True)
 
-    def _resolve_from_local(self, request, type_name):
+    def _resolve_from_local(self, request, type_name, start):
         zone = self.find_zone(request.q)
         if zone:
-            reply = request.reply()
-            zone.find(request.q, reply)
-            if reply.rr:
-                logger.info(f'Found in local zones.')
-                return reply
+            found = zone.answer(str(request.q.qname).lower(), request.q.qtype)
+            if found:
+                logger.trace("Found in local zones.")
+                reply = self._reply_from_wire(request, *found)
             else:
-                logger.info(f"Zone found but '{request.q.qname}' ({type_name}) not found.")
+                logger.trace("Zone found but '{}' ({}) not found.", request.q.qname, type_name)
+                reply = request.reply()
                 reply.header.rcode = getattr(RCODE, 'NXDOMAIN')
-                return reply
+            self.metrics.local.observe(time.perf_counter() - start)
+            return reply
 
-        logger.debug(f'Not found in local zones.')
+        logger.trace("Not found in local zones.")
 
-    def _resolve_over_https(self, request, type_name):
-        reply = request.reply()
+    @staticmethod
+    def _reply_from_wire(request, answer, ttl):
+        data = DNSRecord(DNSHeader(id=request.header.id, bitmap=request.header.bitmap), q=request.q).pack()
+        return DNSRecord.parse(build_reply(data, len(data), answer, ttl))
+
+    def resolve_packed(self, data: bytes) -> bytes | None:
+        """
+        Быстрый путь для попаданий в кэш: ответ собирается из запроса и упакованной секции ответов
+        без объектов dnslib. None - нужен обычный resolve()
+        """
+        start = time.perf_counter()
+        question = parse_question(data)
+        if question is None:
+            return None
+        key, qend = question
+        zone = self.find_zone_name(key[0])
+        if zone is not None:
+            found = zone.answer(key[0], key[1])
+            if found is None:
+                return None  # NXDOMAIN из зоны собирает обычный путь
+            rdata = build_reply(data, qend, *found)
+            self.metrics.local.observe(time.perf_counter() - start)
+            return rdata
+        entry = self.cache.lookup(key, count_miss=False)
+        if entry is None:
+            return None
+        now = time.time()
+        if entry.expires <= now or self.cache.prefetch_pending(entry, now):
+            return None
+        rdata = build_reply(data, qend, entry.value, entry.expires - now)
+        self.metrics.cache.observe(time.perf_counter() - start)
+        return rdata
+
+    def _resolve_from_cache(self, request, type_name, prefetch):
+        key = self._cache_key(request.q)
+        entry = self.cache.lookup(key)
+        if entry is None:
+            return None
+        now = time.time()
+        if entry.expires <= now:
+            return None  # Устаревшая запись отдаётся только если upstream недоступен
+        if self.cache.prefetch_due(entry, now):
+            prefetch(key, request.q, type_name)
+        logger.trace("Found in cache.")
+        return self._reply_from_wire(request, entry.value, entry.expires - now)
+
+    def _resolve_from_shared(self, request, start):
+        found = self.cache.get_shared(self._cache_key(request.q))
+        if found is None:
+            return None
+        answer, expires = found
+        logger.trace("Found in shared cache.")
+        reply = self._reply_from_wire(request, answer, expires - time.time())
+        self.metrics.shared.observe(time.perf_counter() - start)
+        return reply
+
+    def _resolve_stale(self, request):
+        answer = self.cache.get_stale(self._cache_key(request.q))
+        if answer is None:
+            return None
+        logger.warning("Serving stale answer for '{}'", request.q.qname)
+        return self._reply_from_wire(request, answer, STALE_TTL)
+
+    def _prefetch(self, key, q, type_name):
+        self.executor.submit(self._prefetch_job, key, q, type_name)
+
+    def _prefetch_job(self, key, q, type_name):
+        try:
+            rrs = self.inflight.do(key, self._fetch_over_https, q, type_name, str(q.qname))
+        except Exception as e:
+            logger.warning("Prefetch failed for '{}': {!r}", q.qname, e)
+            rrs = None
+        if not rrs:
+            self.cache.prefetch_failed(key)
+
+    def _prefetch_async(self, key, q, type_name):
+        task = asyncio.create_task(self._prefetch_job_async(key, q, type_name))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _prefetch_job_async(self, key, q, type_name):
+        try:
+            rrs = await self.inflight.do_async(key, self._fetch_over_https_async, q, type_name, str(q.qname))
+        except Exception as e:
+            logger.warning("Prefetch failed for '{}': {!r}", q.qname, e)
+            rrs = None
+        if not rrs:
+            self.cache.prefetch_failed(key)
+
+    def _store_https(self, q, type_name, res) -> list[RR]:
         rcls, qtype = TYPE_LOOKUP[type_name]
+        rrs = []
+        if not res:
+            return rrs
+        for i, min_ttl in res:
+            if qtype == QTYPE.HTTPS:
+                rdata = rcls.fromZone(i.split(" ", maxsplit=2))
+            else:
+                rdata = rcls(i)
+            rrs.append(RR(q.qname, qtype, rdata=rdata, ttl=min_ttl))
+        self.cache.set(self._cache_key(q), pack_answers(q, rrs), rrs)
+        return rrs
+
+    def _reply_from_https(self, request, rrs):
+        if not rrs:  # Отрицательный ответ провайдера, stale здесь не отдаётся
+            reply = request.reply()
+            reply.header.rcode = getattr(RCODE, 'NXDOMAIN')
+        else:
+            logger.trace("Found in DOH.")
+            reply = request.reply()
+            for rr in rrs:
+                reply.add_answer(rr)
+        return reply
+
+    def _reply_https_failed(self, request, type_name, domain_name, e):
+        logger.error("Domain: {} ({})", domain_name, type_name)
+        logger.error(e)
+        reply = self._resolve_stale(request)
+        if reply:
+            return reply
+        reply = request.reply()
+        reply.header.rcode = getattr(RCODE, 'NXDOMAIN')
+        return reply
+
+    @staticmethod
+    def _cache_key(q):
+        return str(q.qname).lower(), q.qtype, q.qclass
+
+    def _fetch_over_https(self, q, type_name, domain_name):
+        _, qtype = TYPE_LOOKUP[type_name]
+        res = self.doh.resolve_raw(domain_name, RdataType(qtype))
+        return self._store_https(q, type_name, res)
+
+    def _observe_https(self, rrs, start):
+        (self.metrics.doh if rrs else self.metrics.doh_empty).observe(time.perf_counter() - start)
+
+    def _resolve_over_https(self, request, type_name, start):
         domain_name = str(request.q.qname)
-        _cached = self.cache.get(domain_name)
-        if _cached:
-            logger.info(f'Found in cache.')
-            for cached_rr in _cached:
-                reply.add_answer(cached_rr)
+        reply = self._resolve_from_cache(request, type_name, self._prefetch)
+        if reply:
+            self.metrics.cache.observe(time.perf_counter() - start)
             return reply
-        try:
-            res = self.doh.resolve_raw(domain_name, RdataType(qtype))
-            if not res:
-                reply.header.rcode = getattr(RCODE, 'NXDOMAIN')
-            else:
-                logger.info(f'Found in DOH.')
-                rrs = []
-                for i, min_ttl in res:
-                    if qtype == QTYPE.HTTPS:
-                        rdata = rcls.fromZone(i.split(" ", maxsplit=2))
-                    else:
-                        rdata = rcls(i)
-                    rr = RR(request.q.qname, qtype, rdata=rdata, ttl=min_ttl)
-                    rrs.append(rr)
-                    reply.add_answer(rr)
-                self.cache.set(domain_name, rrs, res)
+        reply = self._resolve_from_shared(request, start)
+        if reply:
             return reply
+        try:
+            rrs = self.inflight.do(self._cache_key(request.q), self._fetch_over_https,
+                                   request.q, type_name, domain_name)
+            self._observe_https(rrs, start)
+            return self._reply_from_https(request, rrs)
         except DNSQueryFailed as e:
-            logger.error(f"Domain: {domain_name} ({type_name})")
-            logger.error(e)
-            reply.header.rcode = getattr(RCODE, 'NXDOMAIN')
+            self.metrics.doh_error.observe(time.perf_counter() - start)
+            return self._reply_https_failed(request, type_name, domain_name, e)
+
+    async def _doh_resolve_async(self, domain_name, rdatatype):
+        if hasattr(self.doh, "resolve_raw_async"):
+            return await self.doh.resolve_raw_async(domain_name, rdatatype)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self.doh.resolve_raw, domain_name, rdatatype)
+
+    async def _fetch_over_https_async(self, q, type_name, domain_name):
+        _, qtype = TYPE_LOOKUP[type_name]
+        res = await self._doh_resolve_async(domain_name, RdataType(qtype))
+        return self._store_https(q, type_name, res)
+
+    async def _resolve_over_https_async(self, request, type_name, start):
+        domain_name = str(request.q.qname)
+        reply = self._resolve_from_cache(request, type_name, self._prefetch_async)
+        if reply:
+            self.metrics.cache.observe(time.perf_counter() - start)
             return reply
-        except Exception as e:
-            raise e
+        if self.cache.shared is not None:
+            loop = asyncio.get_running_loop()
+            reply = await loop.run_in_executor(self.executor, self._resolve_from_shared, request, start)
+            if reply:
+                return reply
+        try:
+            rrs = await self.inflight.do_async(self._cache_key(request.q), self._fetch_over_https_async,
+                                               request.q, type_name, domain_name)
+            self._observe_https(rrs, start)
+            return self._reply_from_https(request, rrs)
+        except DNSQueryFailed as e:
+            self.metrics.doh_error.observe(time.perf_counter() - start)
+            return self._reply_https_failed(request, type_name, domain_name, e)
 
     def _resolve_from_upstream(self, request, handler):
-        logger.info(f'Querying upstream.')
+        logger.trace("Querying upstream.")
         try:
             if self.strip_aaaa and request.q.qtype == QTYPE.AAAA:
                 reply = request.reply()
@@ -155,17 +428,49 @@ class ProxyResolver(LibProxyResolver):
         return reply
 
     def resolve(self, request, handler):
+        start = time.perf_counter()
+        try:
+            type_name = QTYPE[request.q.qtype]
+            local_reply = self._resolve_from_local(request, type_name, start)
+            if type_name not in TYPE_LOOKUP:
+                raise TypeError(f"Unknown {type_name=}. '{request.q.qname}' ({type_name})")
+            if local_reply:
+                return local_reply
+            return self._resolve_over_https(request, type_name, start)
+        except Exception as e:
+            logger.exception(e)
+            reply = self._resolve_from_upstream(request, handler)
+            self.metrics.upstream.observe(time.perf_counter() - start)
+            return reply
+
+    async def resolve_async(self, request, handler):
+        # Тот же путь, что и resolve(), но без блокировки event loop: блокирующие вызовы идут в общий пул
+        start = time.perf_counter()
         try:
             type_name = QTYPE[request.q.qtype]
-            local_reply = self._resolve_from_local(request, type_name)
+            local_reply = self._resolve_from_local(request, type_name, start)
             if type_name not in TYPE_LOOKUP:
                 raise TypeError(f"Unknown {type_name=}. '{request.q.qname}' ({type_name})")
             if local_reply:
                 return local_reply
-            return self._resolve_over_https(request, type_name)
+            return await self._resolve_over_https_async(request, type_name, start)
         except Exception as e:
             logger.exception(e)
-            return self._resolve_from_upstream(request, handler)
+            loop = asyncio.get_running_loop()
+            reply = await loop.run_in_executor(self.executor, self._resolve_from_upstream, request, handler)
+            self.metrics.upstream.observe(time.perf_counter() - start)
+            return reply
+
+    async def start_async(self):
+        if hasattr(self.doh, "keep_warm"):
+            self._warm_task = asyncio.create_task(self.doh.keep_warm())
+
+    async def stop_async(self):
+        if hasattr(self.doh, "aclose"):
+            await self.doh.aclose()
 
     def find_zone(self, q) -> Any:
         ...
+
+    def find_zone_name(self, name: str) -> Any:
+        ...
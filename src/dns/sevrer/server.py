@@ -1,68 +1,214 @@
 from __future__ import annotations as _annotations
 
-from dnslib.server import DNSServer as LibDNSServer, DNSLogger
+from typing import Literal
+
+from dnslib.server import DNSServer as LibDNSServer, DNSHandler as LibDNSHandler
 from loguru import logger
 
 from doh import DNSOverHTTPS
+from .aio import AsyncDNSEngine
+from .dispatch import SpoofDispatcher
+from .metrics import Registry
+from .querylog import QueryLog
 from .resolver import ProxyResolver
+from .shared import SharedCache
+from .suffix import SuffixMap
 from .zone import Zone, PTRZone
 
 
+class DNSHandler(LibDNSHandler):
+
+    def get_reply(self, data):
+        rdata = self.server.resolver.resolve_packed(data)
+        if rdata is not None:
+            return rdata
+        return super().get_reply(data)
+
+
 class DNSServer:
-    def __init__(self, *zones: Zone, upstream="8.8.4.4", doh_provider: DNSOverHTTPS | None = None, port=53, tcp=True):
+    def __init__(self, *zones: Zone, upstream="8.8.4.4", doh_provider: DNSOverHTTPS | None = None, port=53, tcp=True,
+                 engine: Literal["thread", "asyncio"] = "thread", cache_entries=100_000, cache_bytes=64 * 1024 * 1024,
+                 serve_stale=3600, prefetch_at: float | None = 0.9, snapshot_path: str | None = None,
+                 spoof_dispatcher: SpoofDispatcher | None = None, metrics: Registry | None = None,
+                 query_log: QueryLog | None = None, shared_cache: SharedCache | None = None, reuse_port=False):
         self.zones: list[Zone] = list(zones) or []
         self.zones.append(PTRZone("127.0.0").add("1", "localhost."))
+        self.zone_index = SuffixMap()
+        for zone in self.zones:
+            self._index_zone(zone, self.zone_index)
         self.doh = doh_provider
+        self.metrics = metrics or Registry()
         self.port = port
         self.tcp = tcp
+        self.engine = engine
         self.upstream = upstream
         if doh_provider:
             self.upstream = doh_provider.provider[3]
-        self.resolver: ProxyResolver = ProxyResolver(self.upstream, self.doh)
+        self.resolver: ProxyResolver = ProxyResolver(
+            self.upstream, self.doh, cache_entries=cache_entries, cache_bytes=cache_bytes,
+            serve_stale=serve_stale, prefetch_at=prefetch_at, snapshot_path=snapshot_path,
+            spoof_dispatcher=spoof_dispatcher, metrics=self.metrics, shared_cache=shared_cache
+        )
         self.resolver.find_zone = self.find_zone
+        self.resolver.find_zone_name = self.find_zone_name
+        # Журнал запросов вместо DNSLogger: на пути запроса только выборка и запись в кольцевой буфер
+        self.query_log = query_log or QueryLog()
+        self._register_metrics()
 
-        dns_logger = DNSLogger(logf=logger.info)
-        dns_logger.log_prefix = lambda handler: f'[{handler.__class__.__name__}:{handler.server.resolver.__class__.__name__}] '
-        self.udp_server: LibDNSServer = LibDNSServer(self.resolver, port=self.port, logger=dns_logger)
-        self.tcp_server: LibDNSServer = LibDNSServer(self.resolver, port=self.port, tcp=True, logger=dns_logger)
+        if engine == "asyncio":
+            self.async_server = AsyncDNSEngine(self.resolver, port=self.port, tcp=self.tcp, logger=self.query_log,
+                                               reuse_port=reuse_port)
+        elif engine == "thread":
+            if reuse_port:
+                raise ValueError("reuse_port is supported only by the asyncio engine")
+            self.udp_server: LibDNSServer = LibDNSServer(
+                self.resolver, port=self.port, logger=self.query_log, handler=DNSHandler
+            )
+            self.tcp_server: LibDNSServer = LibDNSServer(
+                self.resolver, port=self.port, tcp=True, logger=self.query_log, handler=DNSHandler
+            )
+        else:
+            raise ValueError(f"Unknown engine: {engine!r}")
+
+    def _register_metrics(self):
+        cache = self.resolver.cache
+        self.metrics.add_stats("bns_dns_cache", cache.cache.stats,
+                               ("hits", "misses", "evictions", "expirations", "stale_served"))
+        self.metrics.add_collector(lambda: [(
+            "bns_dns_cache_hit_ratio", "gauge", "Cache hits / lookups",
+            [({}, cache.cache.hits / max(cache.cache.hits + cache.cache.misses, 1))]
+        )])
+        if cache.shared is not None:
+            self.metrics.add_stats("bns_dns_shared_cache", cache.shared.stats, ("hits", "misses", "writes", "errors"))
+        self.metrics.add_stats("bns_dns_query_log", self.query_log.stats, ("written", "dropped"))
+        self.metrics.add_stats("bns_dns_inflight", self.resolver.inflight.stats, ("hits", "misses"))
+        self.metrics.add_stats("bns_spoof_events", cache.dispatcher.stats, ("submitted", "deduplicated", "dropped"))
+        self.metrics.add_collector(lambda: [(
+            "bns_dns_zones", "gauge", "Local zones", [({}, len(self.zones))]
+        ), (
+            "bns_spoof_domains", "gauge", "Domains in the spoof list", [({}, len(cache.spoof_list))]
+        )])
+        if hasattr(self.doh, "rtt"):
+            doh_latency = self.metrics.histogram("bns_doh_query_duration_seconds", "DoH query time per provider IP",
+                                                 ("ip", "ok"))
+            self.doh.on_query = lambda ip, seconds, ok: doh_latency.child(ip, "1" if ok else "0").observe(seconds)
+            self.metrics.add_collector(lambda: [(
+                "bns_doh_rtt_seconds", "gauge", "DoH RTT estimate (EWMA) per provider IP",
+                [({"ip": ip}, rtt) for ip, rtt in list(self.doh.rtt.items())]
+            )])
 
     def start(self):
-        logger.info(f'Starting DNS server; port={self.port}, upstream={self.upstream!r}, doh={self.doh}')
-        self.udp_server.start_thread()
-        if self.tcp:
-            self.tcp_server.start_thread()
+        logger.info(f'Starting DNS server; port={self.port}, upstream={self.upstream!r}, doh={self.doh}, engine={self.engine}')
+        self.resolver.cache.load_snapshot()
+        self.query_log.start()
+        if self.engine == "asyncio":
+            self.async_server.start_thread()
+        else:
+            self.udp_server.start_thread()
+            if self.tcp:
+                self.tcp_server.start_thread()
         logger.success('DNS server started')
 
     def is_alive(self):
+        if self.engine == "asyncio":
+            return self.async_server.isAlive()
         if self.tcp:
             return self.udp_server.isAlive() and self.tcp_server.isAlive()
         return self.udp_server.isAlive()
 
-    def stop(self):
+    def _stop_servers(self):
+        if self.engine == "asyncio":
+            self.async_server.stop()
+            return
         if self.tcp:
             self.tcp_server.stop()
             self.tcp_server.server.server_close()
         self.udp_server.stop()
         self.udp_server.server.server_close()
+
+    def stop(self):
+        self._stop_servers()
+        self.resolver.executor.shutdown(wait=False, cancel_futures=True)
         self.resolver.cache.run = False
         self.resolver.cache.worker.join()
+        self.resolver.cache.save_snapshot()
+        self.resolver.cache.dispatcher.stop()
+        if self.resolver.cache.shared is not None:
+            self.resolver.cache.shared.stop()
+        self.query_log.stop()
         logger.success('DNS server stopped')
 
+    @staticmethod
+    def _index_zone(zone: Zone, index: SuffixMap):
+        if zone.domain in index:
+            logger.warning(f'[server] Zone {zone.domain!r} already exists, replacing')
+        index.add(zone.domain, zone)
+
     def find_zone(self, q) -> Zone | None:
-        for zone in self.zones:
-            if q.qname.matchSuffix(zone.label):
-                return zone
+        return self.find_zone_name(str(q.qname))
+
+    def find_zone_name(self, name: str) -> Zone | None:
+        # Самая длинная подходящая зона, O(число меток)
+        return self.zone_index.get(name)
 
     def add_zone(self, zone: Zone):
         logger.success(f'[server] Added: {zone}')
         self.zones.append(zone)
+        self._index_zone(zone, self.zone_index)
+        self._purge_zone_names(SuffixMap([zone.domain]))
+
+    def set_zones(self, *zones: Zone):
+        """
+        Заменяет все зоны (localhost PTR сохраняется). Индекс собирается заново и подставляется одним
+        присваиванием; закэшированные ответы для имён внутри зон больше не нужны и удаляются.
+        """
+        zones = [*zones, PTRZone("127.0.0").add("1", "localhost.")]
+        index = SuffixMap()
+        for zone in zones:
+            self._index_zone(zone, index)
+        self.zones, self.zone_index = zones, index
+        purged = self._purge_zone_names(index)
+        logger.success(f'[server] Zones reloaded: {len(zones)} zones, {purged} cached answers purged')
+
+    def update_zones(self, zones: list[Zone], removed: list[str] = ()):
+        """
+        Добавляет или заменяет зоны и удаляет зоны removed, не трогая остальные. Индекс копируется,
+        изменяется и подставляется одним присваиванием; из кэша удаляются только имена изменённых зон.
+        """
+        if not zones and not removed:
+            return
+        changed = SuffixMap([*(zone.domain for zone in zones), *removed])
+        index = SuffixMap()
+        index.map = dict(self.zone_index.map)
+        for domain in removed:
+            index.discard(domain)
+        for zone in zones:
+            index.add(zone.domain, zone)
+        self.zones = [zone for zone in self.zones if zone.domain not in changed] + list(zones)
+        self.zone_index = index
+        purged = self._purge_zone_names(changed)
+        logger.success(f'[server] Zones updated: {len(zones)} changed, {len(removed)} removed, '
+                       f'{purged} cached answers purged')
+
+    def _purge_zone_names(self, index: SuffixMap) -> int:
+        return self.resolver.cache.cache.purge(lambda key: index.match(key[0]) is not None)
 
     def add_spoof(self, *domains: str):
-        self.resolver.cache.spoof_list += domains
+        self.resolver.cache.spoof_list.update(domains)
         logger.info("Added domains for spoofing: " + ", ".join(domains))
 
+    def set_spoof(self, domains):
+        """Атомарно заменяет список подменяемых доменов; возвращает (добавлено, удалено)"""
+        added, removed = self.resolver.cache.set_spoof_list(domains)
+        logger.success(f'[server] Spoof list reloaded: +{added} -{removed}')
+        return added, removed
+
     def add_spoof_callback(self, callback):
         self.resolver.cache.spoof_callbacks.append(callback)
 
+    def add_spoof_sink(self, sink):
+        """sink.add(ip, domain, ttl) - например routes.NftSetSink"""
+        self.resolver.cache.dispatcher.sinks.append(sink)
+
     def add_tick_callback(self, callback):
         self.resolver.cache.tick_callbacks.append(callback)
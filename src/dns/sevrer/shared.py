@@ -0,0 +1,126 @@
+import struct
+import threading
+import time
+from collections import deque
+
+import redis
+from loguru import logger
+
+from .wire import WireAnswer
+
+_VALUE = struct.Struct("!dIH")  # expires, ttl, ancount; далее ttl_offsets и data, как в снимке кэша
+
+
+def encode(answer: WireAnswer, expires: float, ttl: int) -> bytes:
+    return (_VALUE.pack(expires, ttl, answer.ancount) + struct.pack(f"!{answer.ancount}H", *answer.ttl_offsets)
+            + answer.data)
+
+
+def decode(raw: bytes) -> tuple[WireAnswer, float, int]:
+    expires, ttl, ancount = _VALUE.unpack_from(raw)
+    offset = _VALUE.size + 2 * ancount
+    return WireAnswer(ancount, raw[offset:], struct.unpack_from(f"!{ancount}H", raw, _VALUE.size)), expires, ttl
+
+
+class SharedCache:
+    """
+    Кэш второго уровня в Redis, общий для процессов-воркеров (WorkerPool).
+    Значение - упакованная секция ответов с абсолютным временем истечения, срок жизни ключа - PX,
+    поэтому Redis сам удаляет истёкшие записи.
+    get() синхронный и вызывается только при промахе локального кэша, перед запросом в DoH.
+    set() на пути запроса только кладёт запись в очередь: фоновый поток пишет пачками через pipeline.
+    Если Redis недоступен, обращения к нему пропускаются retry секунд - воркеры работают на локальных кэшах.
+    """
+
+    def __init__(self, url="unix:///run/redis/redis.sock", prefix="bns:dns:", timeout=0.05, retry=5.0,
+                 max_queue=10_000, batch_size=256, flush_interval=0.05):
+        self.url = url
+        self.prefix = prefix
+        self.client = redis.Redis.from_url(url, socket_timeout=timeout, socket_connect_timeout=timeout)
+        self.retry = retry
+        self.down_until = 0.0
+        self.queue: deque[tuple[tuple, WireAnswer, float, int]] = deque(maxlen=max_queue)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.errors = 0
+        self.run = True
+        self.event = threading.Event()
+        self.worker = threading.Thread(target=self._worker, name="shared-cache", daemon=True)
+        self.worker.start()
+
+    def _key(self, key) -> str:
+        qname, qtype, qclass = key
+        return f"{self.prefix}{qname}:{qtype}:{qclass}"
+
+    def _failed(self, e):
+        self.errors += 1
+        if self.down_until < time.time():
+            logger.warning("[shared-cache] Redis {} unavailable: {!r}", self.url, e)
+        self.down_until = time.time() + self.retry
+
+    def get(self, key) -> tuple[WireAnswer, float, int] | None:
+        """(WireAnswer, expires, ttl) или None"""
+        if self.down_until > time.time():
+            return None
+        try:
+            raw = self.client.get(self._key(key))
+        except redis.RedisError as e:
+            self._failed(e)
+            return None
+        if raw is None:
+            self.misses += 1
+            return None
+        answer, expires, ttl = decode(raw)
+        if expires <= time.time():
+            self.misses += 1
+            return None
+        self.hits += 1
+        return answer, expires, ttl
+
+    def set(self, key, answer: WireAnswer, ttl: int):
+        self.queue.append((key, answer, time.time() + ttl, ttl))
+        if len(self.queue) >= self.batch_size:
+            self.event.set()
+
+    def flush(self):
+        queue = self.queue
+        while queue:
+            batch = []
+            while queue and len(batch) < self.batch_size:
+                batch.append(queue.popleft())
+            if self.down_until > time.time():
+                continue  # Записи теряются: это только кэш
+            now = time.time()
+            pipe = self.client.pipeline(transaction=False)
+            for key, answer, expires, ttl in batch:
+                left = int((expires - now) * 1000)
+                if left > 0:
+                    pipe.set(self._key(key), encode(answer, expires, ttl), px=left)
+            try:
+                pipe.execute()
+                self.writes += len(batch)
+            except redis.RedisError as e:
+                self._failed(e)
+
+    def _worker(self):
+        while self.run:
+            self.event.wait(self.flush_interval)
+            self.event.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.exception(e)
+
+    def stop(self):
+        self.run = False
+        self.event.set()
+        self.worker.join()
+        self.flush()
+        self.client.close()
+
+    def stats(self):
+        return {"queue": len(self.queue), "hits": self.hits, "misses": self.misses, "writes": self.writes,
+                "errors": self.errors}
@@ -0,0 +1,58 @@
+import os
+import struct
+import time
+from pathlib import Path
+
+from .cache import RecordCache
+from .wire import WireAnswer
+
+MAGIC = b"BNSC\x01"
+_ENTRY = struct.Struct("!dIHHHHI")  # expires, ttl, qtype, qclass, ancount, len(qname), len(data)
+
+
+def save(cache: RecordCache, path: str | Path) -> int:
+    """
+    Сохраняет свежие записи кэша в компактный бинарный файл (временный файл + rename).
+    Хранится абсолютное время истечения, поэтому при загрузке остаток TTL считается заново
+    """
+    path = Path(path)
+    now = time.time()
+    with cache.lock:
+        entries = [e for e in cache.entries.values() if e.expires > now]
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp, "wb") as f:
+        f.write(MAGIC)
+        for entry in entries:
+            (qname, qtype, qclass), answer = entry.key, entry.value
+            name = qname.encode()
+            f.write(_ENTRY.pack(entry.expires, entry.ttl, qtype, qclass, answer.ancount, len(name), len(answer.data)))
+            f.write(name)
+            f.write(struct.pack(f"!{answer.ancount}H", *answer.ttl_offsets))
+            f.write(answer.data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return len(entries)
+
+
+def load(path: str | Path):
+    """Отдаёт (key, WireAnswer, expires, ttl) для записей, которые ещё не истекли"""
+    path = Path(path)
+    if not path.exists():
+        return
+    data = path.read_bytes()
+    if not data.startswith(MAGIC):
+        raise ValueError(f"Bad cache snapshot: {path}")
+    now = time.time()
+    offset = len(MAGIC)
+    while offset < len(data):
+        expires, ttl, qtype, qclass, ancount, name_len, data_len = _ENTRY.unpack_from(data, offset)
+        offset += _ENTRY.size
+        qname = data[offset:offset + name_len].decode()
+        offset += name_len
+        ttl_offsets = struct.unpack_from(f"!{ancount}H", data, offset)
+        offset += 2 * ancount
+        answer = WireAnswer(ancount, data[offset:offset + data_len], ttl_offsets)
+        offset += data_len
+        if expires > now:
+            yield (qname, qtype, qclass), answer, expires, ttl
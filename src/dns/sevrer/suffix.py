@@ -0,0 +1,56 @@
+from typing import Any, Iterable
+
+
+def normalize(domain: str) -> str:
+    return domain.strip().strip(".").lower()
+
+
+class SuffixMap:
+    """
+    Хэш-индекс доменов для поиска по суффиксу: 'youtube.com' совпадает с 'youtube.com' и 'www.youtube.com',
+    но не с 'notyoutube.com'. Поиск - O(число меток) запросов к dict, независимо от размера индекса.
+    """
+
+    def __init__(self, domains: Iterable[str] = ()):
+        self.map: dict[str, Any] = {}
+        self.update(domains)
+
+    def __len__(self):
+        return len(self.map)
+
+    def __iter__(self):
+        return iter(self.map)
+
+    def __contains__(self, domain: str):
+        return normalize(domain) in self.map
+
+    def add(self, domain: str, value: Any = True):
+        domain = normalize(domain)
+        if domain:
+            self.map[domain] = value
+
+    def update(self, domains: Iterable[str]):
+        for domain in domains:
+            self.add(domain)
+
+    def discard(self, domain: str):
+        self.map.pop(normalize(domain), None)
+
+    def match(self, name: str) -> str | None:
+        """Самый длинный суффикс name из индекса (по границам меток) или None"""
+        name = name.lower()
+        if name.endswith("."):
+            name = name[:-1]
+        index = self.map
+        while name:
+            if name in index:
+                return name
+            dot = name.find(".")
+            if dot < 0:
+                return None
+            name = name[dot + 1:]
+        return None
+
+    def get(self, name: str, default=None) -> Any:
+        suffix = self.match(name)
+        return default if suffix is None else self.map[suffix]
@@ -0,0 +1,129 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import threading
+import time
+from typing import Callable, Iterable
+
+from loguru import logger
+
+# linux/inotify.h
+IN_MODIFY = 0x002
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+
+
+def _inotify():
+    """(libc, fd) или None, если inotify недоступен (не Linux, нет libc, лимит экземпляров)"""
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+    except (OSError, AttributeError):
+        return None
+    if fd < 0:
+        return None
+    return libc, fd
+
+
+def _signature(path: str):
+    """Отпечаток файла или каталога (mtime, размер каждого файла) для поиска изменений"""
+    try:
+        if os.path.isdir(path):
+            with os.scandir(path) as it:
+                return frozenset((e.name, e.stat().st_mtime_ns, e.stat().st_size) for e in it if e.is_file())
+        stat = os.stat(path)
+        return stat.st_mtime_ns, stat.st_size
+    except FileNotFoundError:
+        return None
+
+
+class FileWatcher:
+    """
+    Следит за файлами и каталогами и вызывает callback(changed_paths) после изменений.
+    Используется inotify (через ctypes); без него - опрос раз в interval секунд.
+    inotify только будит поток: изменения определяются сравнением отпечатков, события
+    в течение debounce секунд схлопываются в один вызов.
+    """
+
+    def __init__(self, paths: Iterable[str], callback: Callable[[list[str]], None], interval=2.0, debounce=0.3,
+                 use_inotify=True):
+        self.paths = [os.path.abspath(path) for path in paths]
+        self.callback = callback
+        self.interval = interval
+        self.debounce = debounce
+        self.signatures = {path: _signature(path) for path in self.paths}
+        self.inotify = _inotify() if use_inotify else None
+        if self.inotify:
+            libc, fd = self.inotify
+            for path in self.paths:
+                # Файл заменяется через rename, поэтому следим за каталогом, в котором он лежит
+                target = path if os.path.isdir(path) else os.path.dirname(path)
+                if libc.inotify_add_watch(fd, os.fsencode(target), WATCH_MASK) < 0:
+                    logger.warning(f"[watch] inotify_add_watch failed for '{target}' (errno {ctypes.get_errno()})")
+        self.run = True
+        self.thread = threading.Thread(target=self._worker, name="file-watcher", daemon=True)
+
+    @property
+    def mode(self):
+        return "inotify" if self.inotify else "polling"
+
+    def start(self):
+        logger.info(f"[watch] Watching {len(self.paths)} path(s) via {self.mode}")
+        self.thread.start()
+        return self
+
+    def _wait(self) -> bool:
+        """Ждёт события inotify (или интервал опроса); False - пора остановиться"""
+        if not self.inotify:
+            time.sleep(self.interval)
+            return self.run
+        fd = self.inotify[1]
+        while self.run:
+            ready, _, _ = select.select([fd], [], [], 1)
+            if not ready:
+                continue
+            # Дочитываем все события, ждём, пока запись файлов закончится
+            time.sleep(self.debounce)
+            try:
+                while os.read(fd, 65536):
+                    pass
+            except BlockingIOError:
+                pass
+            return self.run
+        return False
+
+    def check(self) -> list[str]:
+        changed = []
+        for path in self.paths:
+            signature = _signature(path)
+            if signature != self.signatures[path]:
+                self.signatures[path] = signature
+                changed.append(path)
+        return changed
+
+    def _worker(self):
+        while self._wait():
+            changed = self.check()
+            if not changed:
+                continue
+            try:
+                self.callback(changed)
+            except Exception as e:
+                logger.exception(e)
+
+    def stop(self):
+        self.run = False
+        if self.thread.is_alive():
+            self.thread.join()
+        if self.inotify:
+            os.close(self.inotify[1])
+            self.inotify = None
@@ -0,0 +1,100 @@
+import math
+import struct
+
+from dnslib import DNSRecord, DNSHeader, DNSQuestion, DNSBuffer, RR
+
+_HEADER = struct.Struct("!HHHHHH")
+_TTL = struct.Struct("!I")
+REPLY_FLAGS = 0x8480  # qr aa ra - как у DNSRecord.reply()
+_PLAIN = frozenset(range(33, 127)) - {ord("."), ord("\\")}
+
+
+class WireAnswer:
+    """
+    Упакованная секция ответов. Имена сжаты относительно вопроса по смещению 12,
+    поэтому секцию можно дописать к любому вопросу с тем же qname (без учёта регистра).
+    ttl_offsets - смещения полей TTL внутри data.
+    """
+    __slots__ = ("ancount", "data", "ttl_offsets")
+
+    def __init__(self, ancount: int, data: bytes, ttl_offsets: tuple[int, ...]):
+        self.ancount = ancount
+        self.data = data
+        self.ttl_offsets = ttl_offsets
+
+    def __len__(self):
+        return len(self.data)
+
+
+def _skip_name(data, offset):
+    while True:
+        length = data[offset]
+        if length & 0xC0 == 0xC0:
+            return offset + 2
+        offset += 1
+        if length == 0:
+            return offset
+        offset += length
+
+
+def pack_answers(q: DNSQuestion, rrs: list[RR]) -> WireAnswer:
+    buffer = DNSBuffer()
+    q.pack(buffer)
+    qend = 12 + len(buffer.data)
+    data = DNSRecord(DNSHeader(qr=1), q=q, rr=rrs).pack()[qend:]
+    offsets = []
+    offset = 0
+    for _ in rrs:
+        offset = _skip_name(data, offset) + 4  # type, class
+        offsets.append(offset)
+        rdlength = struct.unpack_from("!H", data, offset + 4)[0]
+        offset += 6 + rdlength
+    return WireAnswer(len(rrs), data, tuple(offsets))
+
+
+def parse_question(data: bytes):
+    """
+    Разбирает обычный запрос (один вопрос, opcode QUERY, без сжатия в qname).
+    Возвращает ((qname, qtype, qclass), конец вопроса) или None, если нужен полный разбор dnslib.
+    """
+    if len(data) < 17:
+        return None
+    _, flags, qdcount, ancount, nscount, _ = _HEADER.unpack_from(data)
+    if flags & 0xF800 or qdcount != 1 or ancount or nscount:  # qr=1 или opcode != QUERY
+        return None
+    labels = []
+    offset = 12
+    try:
+        while True:
+            length = data[offset]
+            if length == 0:
+                offset += 1
+                break
+            if length & 0xC0:
+                return None
+            label = data[offset + 1:offset + 1 + length]
+            if len(label) != length or not _PLAIN.issuperset(label):
+                return None
+            labels.append(label)
+            offset += 1 + length
+        qtype, qclass = struct.unpack_from("!HH", data, offset)
+    except (IndexError, struct.error):
+        return None
+    qname = (b".".join(labels) + b".").lower().decode() if labels else "."
+    return (qname, qtype, qclass), offset + 4
+
+
+def build_reply(data: bytes, qend: int, answer: WireAnswer, ttl: int) -> bytes:
+    """Ответ из запроса data (вопрос копируется как есть) и кэшированной секции ответов"""
+    ident, flags = struct.unpack_from("!HH", data)
+    answers = bytearray(answer.data)
+    ttl = max(math.ceil(ttl), 0)
+    for offset in answer.ttl_offsets:
+        _TTL.pack_into(answers, offset, ttl)
+    return _HEADER.pack(ident, flags | REPLY_FLAGS, 1, answer.ancount, 0, 0) + data[12:qend] + answers
+
+
+def unpack_answers(qname: str, qtype: int, qclass: int, answer: WireAnswer, ttl: float = 0) -> list[RR]:
+    """Обратное pack_answers(): RR объекты из упакованной секции (медленно, не для горячего пути)"""
+    data = DNSRecord(DNSHeader(), q=DNSQuestion(qname, qtype, qclass)).pack()
+    return DNSRecord.parse(build_reply(data, len(data), answer, ttl)).rr
@@ -0,0 +1,209 @@
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+from typing import Callable
+
+from loguru import logger
+
+from .dispatch import SpoofDispatcher
+
+
+class SpoofForwarder:
+    """Sink воркера: spoof события уходят в очередь родительского процесса, маршруты воркер не трогает"""
+
+    def __init__(self, events: multiprocessing.Queue):
+        self.events = events
+        self.dropped = 0
+
+    def add(self, ip: str, domain: str, ttl: int | None = None):
+        try:
+            self.events.put_nowait((ip, domain, ttl))
+        except queue.Full:
+            self.dropped += 1
+
+
+def _worker_main(index: int, factory: Callable, events: multiprocessing.Queue, stop: multiprocessing.Event):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl+C обрабатывает родитель и останавливает воркеры через stop
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    server = factory(index)
+    server.add_spoof_sink(SpoofForwarder(events))
+    server.start()
+    logger.info(f"[workers] Worker {index} started, pid={os.getpid()}")
+    try:
+        # Не stop.wait(): Event.set() ждёт подтверждения от всех ждущих, и убитый (SIGKILL) воркер его повесит
+        while not stop.is_set() and server.is_alive():
+            time.sleep(1)
+    finally:
+        server.stop()
+
+
+class _Supervisor:
+    """
+    Процесс, который форкает воркеры и перезапускает упавшие. Сам потоков не запускает,
+    поэтому fork воркера (в том числе перезапуск) никогда не копирует чужие потоки и захваченные ими блокировки.
+    """
+
+    def __init__(self, pool: "WorkerPool"):
+        self.pool = pool
+        self.processes: list[multiprocessing.Process | None] = [None] * pool.workers
+        self.started_at = [0.0] * pool.workers
+
+    def _spawn(self, index):
+        pool = self.pool
+        process = pool.context.Process(target=_worker_main, name=f"dns-worker-{index}", daemon=True,
+                                       args=(index, pool.factory, pool.events, pool.stop_event))
+        process.start()
+        self.processes[index] = process
+        self.started_at[index] = time.monotonic()
+        pool.pids[index] = process.pid
+
+    def check(self):
+        """Перезапускает завершившиеся воркеры"""
+        pool = self.pool
+        for index, process in enumerate(self.processes):
+            if process is None or process.is_alive() or pool.stop_event.is_set():
+                continue
+            pool.pids[index] = 0
+            if time.monotonic() - self.started_at[index] < pool.restart_delay:
+                continue
+            logger.error(f"[workers] Worker {index} exited with code {process.exitcode}, restarting")
+            process.close()
+            with pool.restarts.get_lock():
+                pool.restarts.value += 1
+            self._spawn(index)
+
+    def main(self, timeout=10):
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, lambda *_: self.pool.stop_event.set())
+        parent = os.getppid()
+        for index in range(self.pool.workers):
+            self._spawn(index)
+        while not self.pool.stop_event.is_set():
+            time.sleep(0.5)
+            if os.getppid() != parent:  # Родитель убит, stop() не будет
+                self.pool.stop_event.set()
+                break
+            self.check()
+        deadline = time.monotonic() + timeout
+        for process in self.processes:
+            if process is not None:
+                process.join(max(0.0, deadline - time.monotonic()))
+                if process.is_alive():
+                    process.terminate()
+                    process.join()
+
+
+class WorkerPool:
+    """
+    Несколько процессов DNS сервера на одном порту: каждый воркер открывает свои сокеты с SO_REUSEPORT,
+    ядро распределяет запросы между ними, поэтому резолвер не упирается в одно ядро из-за GIL.
+    factory(index) вызывается в дочернем процессе и возвращает DNSServer(..., reuse_port=True);
+    общий кэш между воркерами - SharedCache (Redis).
+    Маршруты ставит только родительский процесс: spoof события воркеров приходят через multiprocessing.Queue
+    в его SpoofDispatcher, sinks и tick callbacks добавляются так же, как у DNSServer.
+
+    Воркеры форкает процесс-супервизор, он же перезапускает упавшие (не чаще раза в restart_delay секунд).
+    Супервизор форкается в fork() - вызывать его нужно до запуска потоков в родителе (sinks маршрутов,
+    FileWatcher, MetricsServer): fork копирует только вызвавший поток, а блокировки, захваченные остальными,
+    в дочернем процессе так и остаются захваченными. start() вызывает fork() сам, если он ещё не был вызван;
+    SpoofDispatcher и поток приёма событий создаются уже после fork.
+    """
+
+    def __init__(self, factory: Callable[[int], object], workers: int | None = None,
+                 dispatcher: SpoofDispatcher | None = None, max_queue=10_000, restart_delay=1.0, tick_interval=10):
+        self.factory = factory
+        self.workers = workers or os.cpu_count() or 1
+        self.dispatcher = dispatcher
+        self.callbacks = []
+        self.sinks = []
+        self.tick_callbacks = []
+        self.tick_interval = tick_interval
+        self.restart_delay = restart_delay
+        # fork: factory может быть замыканием из main.py, а main.py не должен выполняться в воркере заново
+        self.context = multiprocessing.get_context("fork")
+        self.events = self.context.Queue(max_queue)
+        self.stop_event = self.context.Event()
+        self.pids = self.context.Array("i", self.workers)  # 0 - воркер не запущен
+        self.restarts = self.context.Value("i", 0)
+        self.supervisor: multiprocessing.Process | None = None
+        self.received = 0
+        self.run = False
+        self.thread: threading.Thread | None = None
+
+    def fork(self):
+        if self.supervisor is not None:
+            return
+        logger.info(f"[workers] Starting {self.workers} DNS workers")
+        # Не daemon: daemon процессам multiprocessing запрещает создавать дочерние
+        self.supervisor = self.context.Process(target=_Supervisor(self).main, name="dns-workers")
+        self.supervisor.start()
+
+    def start(self):
+        self.fork()
+        self.run = True
+        if self.dispatcher is None:
+            self.dispatcher = SpoofDispatcher()
+        self.dispatcher.callbacks.extend(self.callbacks)
+        self.dispatcher.sinks.extend(self.sinks)
+        self.thread = threading.Thread(target=self._receiver, name="dns-workers", daemon=True)
+        self.thread.start()
+
+    def _receiver(self):
+        last_tick = time.monotonic()
+        while self.run:
+            try:
+                ip, domain, ttl = self.events.get(timeout=0.5)
+                self.received += 1
+                self.dispatcher.submit(ip, domain, ttl)
+            except queue.Empty:
+                pass
+            except Exception as e:
+                logger.exception(e)
+            if time.monotonic() - last_tick >= self.tick_interval:
+                last_tick = time.monotonic()
+                for callback in self.tick_callbacks:
+                    try:
+                        callback()
+                    except Exception as e:
+                        logger.exception(e)
+
+    def is_alive(self):
+        return self.run and self.supervisor is not None and self.supervisor.is_alive()
+
+    def stop(self, timeout=10):
+        self.stop_event.set()
+        if self.supervisor is not None:
+            self.supervisor.join(timeout + 1)
+            if self.supervisor.is_alive():
+                self.supervisor.terminate()
+                self.supervisor.join()
+        self.run = False
+        if self.thread:
+            self.thread.join()
+        if self.dispatcher is None:
+            return
+        while True:  # События, отправленные воркерами перед остановкой
+            try:
+                self.dispatcher.submit(*self.events.get_nowait())
+            except queue.Empty:
+                break
+        self.dispatcher.stop()
+        logger.success("[workers] DNS workers stopped")
+
+    def add_spoof_callback(self, callback):
+        (self.callbacks if self.dispatcher is None else self.dispatcher.callbacks).append(callback)
+
+    def add_spoof_sink(self, sink):
+        (self.sinks if self.dispatcher is None else self.dispatcher.sinks).append(sink)
+
+    def add_tick_callback(self, callback):
+        self.tick_callbacks.append(callback)
+
+    def stats(self):
+        return {
+            "workers": self.workers, "alive": sum(1 for pid in self.pids if pid),
+            "restarts": self.restarts.value, "received": self.received,
+        }
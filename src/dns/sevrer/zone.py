@@ -2,9 +2,11 @@ from dataclasses import dataclass
 from datetime import datetime, timezone
 from typing import Literal, Any, overload
 
-from dnslib import QTYPE, dns, DNSLabel, RR
+from dnslib import QTYPE, dns, DNSLabel, RR, DNSQuestion
 from loguru import logger
 
+from .wire import WireAnswer, pack_answers, unpack_answers
+
 S = 1
 M = S*60
 H = M*60
@@ -92,7 +94,11 @@ class Record:
                 self.value = self.value.replace("@", zone.domain)
 
         self.qname = DNSLabel(self.domain)
-        self.rr = RR(self.qname, self.qtype, rdata=self.rcls(self.value), ttl=TTL)
+        if self.type == "SOA":
+            rdata = self.rcls(self.value[0], self.value[1], self.value[2:])  # mname, rname, (serial, refresh, ...)
+        else:
+            rdata = self.rcls(self.value)
+        self.rr = RR(self.qname, self.qtype, rdata=rdata, ttl=TTL)
 
         # Check if domain matches zone
         if not zone.ptr and self.domain.split(".")[-zone.lvl:] != zone.domain.split("."):
@@ -121,6 +127,9 @@ class Zone:
         self.lvl = len(domain.split('.'))
         self.ttl = TTL
         self.records: list[Record] = []
+        self.rrsets: dict[tuple[str, int], list[RR]] = {}  # RR объекты записей, добавленных через Record
+        # (qname в нижнем регистре, qtype): упакованный RRset и его TTL - готовая секция ответов
+        self.answers: dict[tuple[str, int], tuple[WireAnswer, int]] = {}
         self.label = DNSLabel(domain)
         self.ptr = ptr
         if not ptr:
@@ -136,15 +145,31 @@ class Zone:
         record.link(self, True)
         logger.info(f"[{self.domain!r}] Added: {record}")
         self.records.append(record)
+        key = (str(record.qname).lower(), record.qtype)
+        self.rrsets.setdefault(key, []).append(record.rr)
+        self.answers.pop(key, None)  # RRset упакуется при первом запросе
 
     def add_records(self, *records: Record):
         for record in records:
             self.add_record(record)
 
+    def answer(self, qname: str, qtype: int) -> tuple[WireAnswer, int] | None:
+        """Упакованный RRset и TTL; qname в нижнем регистре с точкой на конце"""
+        key = (qname, qtype)
+        found = self.answers.get(key)
+        if found is None:
+            rrs = self.rrsets.get(key)
+            if rrs is None:
+                return None
+            found = self.answers[key] = (pack_answers(DNSQuestion(rrs[0].rname, qtype), rrs), rrs[0].ttl)
+        return found
+
     def find(self, q, reply=None):
-        for record in self.records:
-            if record.match(q):
-                reply.add_answer(record.rr)
+        key = (str(q.qname).lower(), q.qtype)
+        found = self.answer(*key)
+        if found:
+            for rr in unpack_answers(*key, q.qclass, *found):
+                reply.add_answer(rr)
 
     def __str__(self):
         return f"Zone({self.domain!r}, {self.serial_no}, {self.ttl})"
@@ -159,7 +184,7 @@ class PTRZone(Zone):
         self.ttl = 1*H
 
     def add(self, ip: str, domain: str):
-        ptr = Record(ip.split(".")[-1], "PTR", domain)
+        ptr = Record(f'{ip.split(".")[-1]}.{self.domain}', "PTR", domain)
         self.add_record(ptr)
         return self
 
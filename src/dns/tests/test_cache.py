@@ -0,0 +1,73 @@
+from sevrer.cache import ENTRY_OVERHEAD, RecordCache
+
+KEY = ("a.test.", 1, 1)
+
+
+def test_lru_evicts_least_recently_used():
+    cache = RecordCache(max_entries=2)
+    cache.set(("a.", 1, 1), "a", 60, now=100)
+    cache.set(("b.", 1, 1), "b", 60, now=100)
+    assert cache.get(("a.", 1, 1), now=101) == "a"  # a теперь новее b
+    cache.set(("c.", 1, 1), "c", 60, now=101)
+    assert cache.get(("b.", 1, 1), now=101) is None
+    assert cache.get(("a.", 1, 1), now=101) == "a"
+    assert cache.evictions == 1
+
+
+def test_byte_limit_evicts():
+    cache = RecordCache(max_bytes=2 * (ENTRY_OVERHEAD + 100))
+    for i in range(3):
+        cache.set((f"{i}.", 1, 1), i, 60, size=100, now=100)
+    assert len(cache) == 2
+    assert cache.bytes == 2 * (ENTRY_OVERHEAD + 100)
+
+
+def test_overwrite_keeps_byte_count():
+    cache = RecordCache()
+    cache.set(KEY, "old", 60, size=10, now=100)
+    cache.set(KEY, "new", 60, size=20, now=100)
+    assert len(cache) == 1
+    assert cache.bytes == ENTRY_OVERHEAD + 20
+    assert cache.get(KEY, now=101) == "new"
+
+
+def test_expired_entry_is_stale_until_window_ends():
+    cache = RecordCache(stale_window=100)
+    cache.set(KEY, "a", 10, now=1000)
+    assert cache.get(KEY, now=1011) is None
+    entry = cache.get_entry(KEY, now=1011)
+    assert entry is not None and entry.value == "a" and entry.expires == 1010
+    assert cache.get_entry(KEY, now=1111) is None
+    assert len(cache) == 0
+
+
+def test_expire_without_stale_window():
+    cache = RecordCache()
+    cache.set(("a.", 1, 1), "a", 10, now=1000)
+    cache.set(("b.", 1, 1), "b", 100, now=1000)
+    assert cache.expire(now=1050) == 1
+    assert list(cache.entries) == [("b.", 1, 1)]
+
+
+def test_hit_and_miss_counters():
+    cache = RecordCache()
+    cache.set(KEY, "a", 10, now=1000)
+    cache.get(KEY, now=1001)
+    cache.get(("other.", 1, 1), now=1001)
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert cache.entries[KEY].hits == 1
+
+
+def test_peek_does_not_count():
+    cache = RecordCache()
+    cache.set(KEY, "a", 10)
+    assert cache.peek(KEY).value == "a"
+    assert (cache.hits, cache.misses) == (0, 0)
+
+
+def test_purge():
+    cache = RecordCache()
+    cache.set(("a.zone.", 1, 1), "a", 60)
+    cache.set(("b.other.", 1, 1), "b", 60)
+    assert cache.purge(lambda key: key[0].endswith("zone.")) == 1
+    assert list(cache.entries) == [("b.other.", 1, 1)]
@@ -0,0 +1,103 @@
+import asyncio
+import threading
+
+import pytest
+
+from sevrer.inflight import InFlight
+
+
+def test_concurrent_calls_are_coalesced():
+    inflight = InFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return "answer"
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(inflight.do("key", fetch)))
+    leader.start()
+    started.wait(5)
+    followers = [threading.Thread(target=lambda: results.append(inflight.do("key", fetch))) for _ in range(3)]
+    for thread in followers:
+        thread.start()
+    while inflight.hits < 3:
+        threading.Event().wait(0.001)
+    release.set()
+    for thread in [leader, *followers]:
+        thread.join(5)
+    assert results == ["answer"] * 4
+    assert len(calls) == 1
+    assert inflight.stats() == {"hits": 3, "misses": 1, "in_flight": 0}
+
+
+def test_error_is_shared_and_not_cached():
+    inflight = InFlight()
+    started = threading.Event()
+    release = threading.Event()
+
+    def fail():
+        started.set()
+        release.wait(5)
+        raise RuntimeError("upstream")
+
+    errors = []
+
+    def call():
+        try:
+            inflight.do("key", fail)
+        except RuntimeError as e:
+            errors.append(e)
+
+    leader = threading.Thread(target=call)
+    leader.start()
+    started.wait(5)
+    follower = threading.Thread(target=call)
+    follower.start()
+    while inflight.hits < 1:
+        threading.Event().wait(0.001)
+    release.set()
+    leader.join(5)
+    follower.join(5)
+    assert len(errors) == 2
+    assert inflight.do("key", lambda: "retry") == "retry"
+
+
+def test_async_calls_are_coalesced():
+    inflight = InFlight()
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "answer"
+
+    async def main():
+        return await asyncio.gather(*(inflight.do_async("key", fetch) for _ in range(5)))
+
+    assert asyncio.run(main()) == ["answer"] * 5
+    assert len(calls) == 1
+    assert inflight.stats() == {"hits": 4, "misses": 1, "in_flight": 0}
+
+
+def test_async_cancelled_waiter_does_not_cancel_others():
+    inflight = InFlight()
+
+    async def fetch():
+        await asyncio.sleep(0.05)
+        return "answer"
+
+    async def main():
+        first = asyncio.ensure_future(inflight.do_async("key", fetch))
+        second = asyncio.ensure_future(inflight.do_async("key", fetch))
+        await asyncio.sleep(0)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(main()) == "answer"
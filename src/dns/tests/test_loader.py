@@ -0,0 +1,73 @@
+import os
+
+import pytest
+
+from sevrer.loader import ZoneLoader
+
+ZONE_A = """$ORIGIN a.test.
+$TTL 300
+@ IN SOA ns.a.test. admin.a.test. ( 1 7200 3600 86400 300 )
+www IN A 10.0.0.5
+"""
+ZONE_B = "$ORIGIN b.test.\nhost IN A 10.0.1.7\n"
+
+
+def _write(path, text, mtime_ns=None):
+    path.write_text(text)
+    if mtime_ns is not None:
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+@pytest.fixture
+def zones_dir(tmp_path):
+    _write(tmp_path / "a.zone", ZONE_A, 1_000_000_000)
+    _write(tmp_path / "b.zone", ZONE_B, 1_000_000_000)
+    return tmp_path
+
+
+def test_load_builds_zones_and_ptr(zones_dir):
+    zones = {zone.domain: zone for zone in ZoneLoader(str(zones_dir)).load()}
+    assert set(zones) == {"a.test.", "b.test.", "0.0.10.in-addr.arpa.", "1.0.10.in-addr.arpa."}
+    assert ("www.a.test.", 1) in zones["a.test."].answers
+    assert ("5.0.0.10.in-addr.arpa.", 12) in zones["0.0.10.in-addr.arpa."].answers
+
+
+def test_reload_reparses_only_changed_files(zones_dir):
+    loader = ZoneLoader(str(zones_dir))
+    loader.load()
+    a = loader.zones["a.test."]
+    assert loader.reload() == ([], [])
+    _write(zones_dir / "b.zone", ZONE_B + "other IN A 10.0.1.8\n", 2_000_000_000)
+    updated, removed = loader.reload()
+    assert sorted(zone.domain for zone in updated) == ["1.0.10.in-addr.arpa.", "b.test."]
+    assert removed == []
+    assert loader.zones["a.test."] is a
+    assert ("other.b.test.", 1) in loader.zones["b.test."].answers
+
+
+def test_failed_reload_keeps_previous_zones(zones_dir):
+    loader = ZoneLoader(str(zones_dir))
+    loader.load()
+    before = dict(loader.zones)
+    _write(zones_dir / "a.zone", ZONE_A + "broken IN BOGUS x\n", 2_000_000_000)
+    with pytest.raises(ValueError, match="a.zone"):
+        loader.reload()
+    assert loader.zones == before
+    _write(zones_dir / "a.zone", ZONE_A + "api IN A 10.0.0.6\n", 3_000_000_000)
+    updated, _ = loader.reload()
+    assert "a.test." in {zone.domain for zone in updated}
+
+
+def test_removed_file_removes_zones(zones_dir):
+    loader = ZoneLoader(str(zones_dir))
+    loader.load()
+    os.remove(zones_dir / "a.zone")
+    updated, removed = loader.reload()
+    assert updated == []
+    assert sorted(removed) == ["0.0.10.in-addr.arpa.", "a.test."]
+
+
+def test_non_strict_load_skips_bad_file(zones_dir):
+    _write(zones_dir / "c.zone", "$ORIGIN c.test.\nx IN BOGUS y\n")
+    zones = {zone.domain for zone in ZoneLoader(str(zones_dir), auto_ptr=False).load()}
+    assert zones == {"a.test.", "b.test."}
@@ -0,0 +1,62 @@
+import threading
+
+import pytest
+
+from routes import installer
+from routes.installer import RouteInstaller
+from sevrer.dispatch import SpoofDispatcher
+
+
+class _Result:
+    def __init__(self, returncode=0, stderr=""):
+        self.returncode = returncode
+        self.stderr = stderr
+
+
+@pytest.fixture
+def route_installer():
+    routes = RouteInstaller("wg0", flush_interval=0.01)
+    yield routes
+    routes.stop()
+
+
+def _apply(routes, batch, result, monkeypatch):
+    monkeypatch.setattr(installer.subprocess, "run", lambda *args, **kwargs: result)
+    ok = routes._apply(batch)
+    routes._applied(batch, ok, 0.0)
+    return ok
+
+
+def test_missing_route_del_does_not_drop_replaces(route_installer, monkeypatch):
+    old, new = route_installer.network("10.0.0.1"), route_installer.network("10.0.0.2")
+    route_installer.pending.add(new)
+    result = _Result(1, "RTNETLINK answers: No such process\nCommand failed -:1\n")
+    assert _apply(route_installer, [("del", old, 0), ("replace", new, 0)], result, monkeypatch)
+    assert route_installer.installed == {new}
+    assert route_installer.pending == set()
+
+
+def test_failed_replace_is_not_installed(route_installer, monkeypatch):
+    good, bad = route_installer.network("10.0.0.1"), route_installer.network("10.0.0.2")
+    route_installer.pending.update((good, bad))
+    result = _Result(1, "RTNETLINK answers: Invalid argument\nCommand failed -:2\n")
+    assert not _apply(route_installer, [("replace", good, 0), ("replace", bad, 0)], result, monkeypatch)
+    assert route_installer.installed == {good}
+
+
+def test_ip_failure_fails_whole_batch(route_installer, monkeypatch):
+    net = route_installer.network("10.0.0.1")
+    route_installer.pending.add(net)
+    assert not _apply(route_installer, [("replace", net, 0)], _Result(1, "Cannot open netns"), monkeypatch)
+    assert route_installer.installed == set()
+
+
+def test_dispatcher_block_waits_bounded_time():
+    dispatcher = SpoofDispatcher(max_queue=1, workers=1, overflow="block", block_timeout=0.01)
+    release = threading.Event()
+    dispatcher.callbacks.append(lambda ip, domain: release.wait(5))
+    for i in range(4):
+        dispatcher.submit(f"10.0.0.{i}", "example.com")
+    assert dispatcher.dropped >= 1
+    release.set()
+    dispatcher.stop()
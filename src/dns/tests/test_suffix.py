@@ -0,0 +1,27 @@
+from sevrer.suffix import SuffixMap
+
+
+def test_match_on_label_boundaries():
+    index = SuffixMap(["youtube.com"])
+    assert index.match("youtube.com") == "youtube.com"
+    assert index.match("www.youtube.com.") == "youtube.com"
+    assert index.match("WWW.YouTube.COM") == "youtube.com"
+    assert index.match("notyoutube.com") is None
+    assert index.match("youtube.com.evil") is None
+
+
+def test_longest_suffix_wins():
+    index = SuffixMap()
+    index.add("example.com", "outer")
+    index.add("sub.example.com", "inner")
+    assert index.get("a.sub.example.com.") == "inner"
+    assert index.get("a.example.com.") == "outer"
+    assert index.get("other.org", "default") == "default"
+
+
+def test_normalized_add_and_discard():
+    index = SuffixMap([" Example.COM. ", "", "."])
+    assert len(index) == 1
+    assert "example.com" in index
+    index.discard("EXAMPLE.com.")
+    assert index.match("www.example.com") is None
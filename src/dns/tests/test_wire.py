@@ -0,0 +1,48 @@
+import struct
+
+from dnslib import A, DNSQuestion, DNSRecord, QTYPE, RR
+
+from sevrer.wire import build_reply, pack_answers, parse_question, unpack_answers
+
+
+def _answer(*ips, ttl=300):
+    q = DNSQuestion("www.example.com.", QTYPE.A)
+    return pack_answers(q, [RR("www.example.com.", QTYPE.A, rdata=A(ip), ttl=ttl) for ip in ips])
+
+
+def test_parse_question():
+    data = DNSRecord.question("WWW.Example.com", "AAAA").pack()
+    key, qend = parse_question(data)
+    assert key == ("www.example.com.", QTYPE.AAAA, 1)
+    assert qend == len(data)
+
+
+def test_build_reply_patches_every_ttl():
+    answer = _answer("10.0.0.1", "10.0.0.2")
+    request = DNSRecord.question("www.example.com", "A")
+    data = request.pack()
+    reply = DNSRecord.parse(build_reply(data, len(data), answer, 41.2))
+    assert reply.header.id == request.header.id
+    assert reply.header.qr == 1 and reply.header.ra == 1
+    assert [str(rr.rdata) for rr in reply.rr] == ["10.0.0.1", "10.0.0.2"]
+    assert [rr.ttl for rr in reply.rr] == [42, 42]
+    # Кэшированная секция не меняется
+    assert [struct.unpack_from("!I", answer.data, offset)[0] for offset in answer.ttl_offsets] == [300, 300]
+
+
+def test_build_reply_clamps_negative_ttl():
+    data = DNSRecord.question("www.example.com", "A").pack()
+    reply = DNSRecord.parse(build_reply(data, len(data), _answer("10.0.0.1"), -5))
+    assert reply.rr[0].ttl == 0
+
+
+def test_build_reply_keeps_question_case():
+    data = DNSRecord.question("WWW.EXAMPLE.COM", "A").pack()
+    reply = DNSRecord.parse(build_reply(data, len(data), _answer("10.0.0.1"), 10))
+    assert str(reply.q.qname) == "WWW.EXAMPLE.COM."
+    assert str(reply.rr[0].rname) == "WWW.EXAMPLE.COM."
+
+
+def test_unpack_answers_roundtrip():
+    rrs = unpack_answers("www.example.com.", QTYPE.A, 1, _answer("10.0.0.1"), 7)
+    assert [(str(rr.rname), str(rr.rdata), rr.ttl) for rr in rrs] == [("www.example.com.", "10.0.0.1", 7)]